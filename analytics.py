@@ -0,0 +1,177 @@
+import sqlite3
+import statistics
+import threading
+from dataclasses import dataclass
+from enum import StrEnum
+from pathlib import Path
+from time import time
+
+from common_types import Backend
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    id INTEGER PRIMARY KEY,
+    broadcast_id TEXT,
+    started_at REAL NOT NULL,
+    ended_at REAL
+);
+CREATE TABLE IF NOT EXISTS picks (
+    id INTEGER PRIMARY KEY,
+    session_id INTEGER NOT NULL REFERENCES sessions(id),
+    level_id INTEGER NOT NULL,
+    source TEXT NOT NULL,
+    picked_at REAL NOT NULL,
+    pick_latency REAL NOT NULL,
+    verdict TEXT,
+    review_seconds REAL,
+    verdict_latency REAL,
+    resolved_at REAL
+);
+CREATE TABLE IF NOT EXISTS backend_calls (
+    id INTEGER PRIMARY KEY,
+    session_id INTEGER NOT NULL REFERENCES sessions(id),
+    pick_id INTEGER REFERENCES picks(id),
+    backend TEXT NOT NULL,
+    operation TEXT NOT NULL,
+    latency REAL NOT NULL,
+    succeeded INTEGER NOT NULL,
+    recorded_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS picks_by_session ON picks(session_id);
+CREATE INDEX IF NOT EXISTS backend_calls_by_operation ON backend_calls(backend, operation);
+"""
+
+
+class RequestSource(StrEnum):
+    SHEET = "sheet"
+    BOT = "bot"
+
+
+@dataclass
+class LatencyStats:
+    backend: str
+    operation: str
+    calls: int
+    failures: int
+    median: float
+    p95: float
+    total: float
+
+
+class AnalyticsStore:
+    def __init__(self, path: Path):
+        self.connection = sqlite3.connect(str(path), isolation_level=None, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.executescript(SCHEMA)
+        self._lock = threading.Lock()
+
+    def _execute(self, statement: str, parameters: tuple = ()) -> sqlite3.Cursor:
+        with self._lock:
+            return self.connection.execute(statement, parameters)
+
+    def start_session(self, broadcast_id: str | None) -> int:
+        return self._execute("INSERT INTO sessions (broadcast_id, started_at) VALUES (?, ?)", (broadcast_id, time())).lastrowid
+
+    def end_session(self, session_id: int) -> None:
+        self._execute("UPDATE sessions SET ended_at = ? WHERE id = ?", (time(), session_id))
+
+    def record_pick(self, session_id: int, level_id: int, source: RequestSource, pick_latency: float) -> int:
+        return self._execute(
+            "INSERT INTO picks (session_id, level_id, source, picked_at, pick_latency) VALUES (?, ?, ?, ?, ?)",
+            (session_id, level_id, source.value, time(), pick_latency)
+        ).lastrowid
+
+    def record_verdict(self, pick_id: int, verdict: str, verdict_latency: float) -> None:
+        resolved_at = time()
+        self._execute(
+            "UPDATE picks SET verdict = ?, review_seconds = ? - picked_at - ?, verdict_latency = ?, resolved_at = ? WHERE id = ?",
+            (verdict, resolved_at, verdict_latency, verdict_latency, resolved_at, pick_id)
+        )
+
+    def record_backend_call(self, session_id: int, pick_id: int | None, backend: Backend, operation: str, latency: float, succeeded: bool) -> None:
+        self._execute(
+            "INSERT INTO backend_calls (session_id, pick_id, backend, operation, latency, succeeded, recorded_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (session_id, pick_id, backend.value, operation, latency, int(succeeded), time())
+        )
+
+    def get_requests_per_hour(self, session_id: int | None = None) -> float | None:
+        session_filter = "WHERE s.id = ?" if session_id is not None else ""
+        rows = self._execute(
+            f"""
+            SELECT COUNT(p.verdict), MAX(p.resolved_at) - s.started_at
+            FROM sessions s JOIN picks p ON p.session_id = s.id
+            {session_filter}
+            GROUP BY s.id
+            """,
+            (session_id,) if session_id is not None else ()
+        ).fetchall()
+        resolved = sum(row[0] for row in rows)
+        hours = sum(row[1] or 0 for row in rows) / 3600
+        return resolved / hours if hours else None
+
+    def get_median_review_seconds(self, session_id: int | None = None) -> float | None:
+        session_filter = "AND session_id = ?" if session_id is not None else ""
+        rows = self._execute(
+            f"SELECT review_seconds FROM picks WHERE review_seconds IS NOT NULL {session_filter}",
+            (session_id,) if session_id is not None else ()
+        ).fetchall()
+        return statistics.median(row[0] for row in rows) if rows else None
+
+    def get_median_time_per_level(self, session_id: int | None = None) -> float | None:
+        session_filter = "AND session_id = ?" if session_id is not None else ""
+        rows = self._execute(
+            f"SELECT pick_latency + review_seconds + verdict_latency FROM picks WHERE verdict IS NOT NULL {session_filter}",
+            (session_id,) if session_id is not None else ()
+        ).fetchall()
+        return statistics.median(row[0] for row in rows) if rows else None
+
+    def get_backend_latency_breakdown(self, session_id: int | None = None) -> list[LatencyStats]:
+        session_filter = "WHERE session_id = ?" if session_id is not None else ""
+        rows = self._execute(
+            f"SELECT backend, operation, latency, succeeded FROM backend_calls {session_filter} ORDER BY backend, operation",
+            (session_id,) if session_id is not None else ()
+        ).fetchall()
+
+        grouped: dict[tuple[str, str], list[tuple[float, int]]] = {}
+        for backend, operation, latency, succeeded in rows:
+            grouped.setdefault((backend, operation), []).append((latency, succeeded))
+
+        breakdown = []
+        for (backend, operation), calls in grouped.items():
+            latencies = sorted(latency for latency, _ in calls)
+            breakdown.append(LatencyStats(
+                backend=backend,
+                operation=operation,
+                calls=len(calls),
+                failures=sum(1 for _, succeeded in calls if not succeeded),
+                median=statistics.median(latencies),
+                p95=latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))],
+                total=sum(latencies)
+            ))
+        return sorted(breakdown, key=lambda stats: stats.total, reverse=True)
+
+    def close(self) -> None:
+        with self._lock:
+            self.connection.close()
+
+
+def print_report(store: AnalyticsStore) -> None:
+    requests_per_hour = store.get_requests_per_hour()
+    median_time_per_level = store.get_median_time_per_level()
+    median_review_seconds = store.get_median_review_seconds()
+
+    print(f"Requests per hour: {requests_per_hour:.1f}" if requests_per_hour else "Requests per hour: no data")
+    print(f"Median time per level: {median_time_per_level:.1f}s" if median_time_per_level else "Median time per level: no data")
+    print(f"Median review time: {median_review_seconds:.1f}s" if median_review_seconds else "Median review time: no data")
+    print()
+    print(f"{'Backend':<12} {'Operation':<28} {'Calls':>6} {'Failed':>6} {'p50, s':>8} {'p95, s':>8} {'Total, s':>9}")
+    for stats in store.get_backend_latency_breakdown():
+        print(f"{stats.backend:<12} {stats.operation:<28} {stats.calls:>6} {stats.failures:>6} {stats.median:>8.3f} {stats.p95:>8.3f} {stats.total:>9.1f}")
+
+
+if __name__ == "__main__":
+    from paths import ANALYTICS_PATH
+
+    print_report(AnalyticsStore(ANALYTICS_PATH))
@@ -1,3 +1,4 @@
+import threading
 from calendar import month
 from datetime import datetime
 from enum import StrEnum
@@ -6,9 +7,15 @@ from google.oauth2.credentials import Credentials
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
 
+import google_auth_httplib2
+import httplib2
+
 import typing as tp
 
-from common_types import FormResponse, Language, OpenRequest
+from common_types import Backend, FormResponse, Language, OpenRequest
+from level_ids import parse_level_id, RejectedResponse
+from tracing import TRACER
+from traffic import TRAFFIC
 
 
 SCRIPT_ID = "AKfycby6qY02LIuIPW2NyW972Sz0AalKvyPFJfwjtmuw8dUrR8gRnIuVuTpNwhq1M_ujB5ER4w"
@@ -55,47 +62,70 @@ def build_open_request_from_row(request_row: list) -> OpenRequest:
 
 
 class AppsScriptApiWrapper:
-    def __init__(self, creds: Credentials):
-        self.service = build("script", "v1", credentials=creds)
+    def __init__(self, creds: Credentials | None = None, service: tp.Any | None = None):
+        self.creds = creds
+        self.service = service or build("script", "v1", credentials=creds)
+        self._thread_local = threading.local()
+
+    def _get_http(self) -> google_auth_httplib2.AuthorizedHttp:
+        # httplib2 connections are not thread-safe and the chat intake appends requests from its own thread, so each
+        # thread gets its own one
+        http = getattr(self._thread_local, "http", None)
+        if not http:
+            http = google_auth_httplib2.AuthorizedHttp(self.creds, http=httplib2.Http())
+            self._thread_local.http = http
+        return http
+
+    def _run(self, request: dict) -> dict:
+        pending_run = self.service.scripts().run(scriptId=SCRIPT_ID, body=request)
+        return pending_run.execute(http=self._get_http()) if self.creds else pending_run.execute()
 
     def execute_function(self, func: AppsScriptFunction, parameters: list[tp.Any] | None = None) -> tp.Any:
         request = dict(function=func.value)
         if parameters:
             request.update(parameters=parameters)
 
-        try:
-            response = self.service.scripts().run(scriptId=SCRIPT_ID, body=request).execute()
-            if "error" in response:
-                error = response["error"]["details"][0]
-                print(f"Script error message: {0}.{format(error['errorMessage'])}")
-
-                if "scriptStackTraceElements" in error:
-                    print("Script error stacktrace:")
-                    for trace in error["scriptStackTraceElements"]:
-                        print(trace)
-            else:
-                print("Executed!")
-                return response
-        except HttpError as error:
-            print(f"An error occurred: {error}")
-            print(error.content)
+        with TRACER.span(f"apps_script.{func.value}", backend="apps_script", endpoint=func.value):
+            try:
+                response = TRAFFIC.exchange(Backend.APPS_SCRIPT, func.value, request, lambda: self._run(request))
+                if "error" in response:
+                    error = response["error"]["details"][0]
+                    print(f"Script error message: {0}.{format(error['errorMessage'])}")
+
+                    if "scriptStackTraceElements" in error:
+                        print("Script error stacktrace:")
+                        for trace in error["scriptStackTraceElements"]:
+                            print(trace)
+                else:
+                    print("Executed!")
+                    return response
+            except HttpError as error:
+                print(f"An error occurred: {error}")
+                print(error.content)
 
         return None
 
-    def get_new_responses(self) -> list[FormResponse]:
+    def get_new_responses(self) -> tuple[list[FormResponse], list[RejectedResponse]]:
         response = self.execute_function(AppsScriptFunction.GET_RAW_NEW_RESPONSES)
 
+        # A malformed answer only costs its own row, the rest of the batch is still ingested
         form_responses = []
+        rejected_responses = []
         for row in response['response']['result']:
-            language = Language(row[1])
-            form_responses.append(FormResponse(
-                submission_timestamp=datetime.strptime(row[0], '%m/%d/%Y %H:%M:%S'),
-                language=language,
-                level_id=int(row[2 if language == Language.EN else 4]),
-                showcase_link=row[3 if language == Language.EN else 5] or None
-            ))
-
-        return form_responses
+            raw_level_id = ""
+            try:
+                language = Language(row[1])
+                raw_level_id = str(row[2 if language == Language.EN else 4])
+                form_responses.append(FormResponse(
+                    submission_timestamp=datetime.strptime(row[0], '%m/%d/%Y %H:%M:%S'),
+                    language=language,
+                    level_id=parse_level_id(raw_level_id),
+                    showcase_link=row[3 if language == Language.EN else 5] or None
+                ))
+            except (ValueError, IndexError) as e:
+                rejected_responses.append(RejectedResponse(str(row[0]) if row else "", raw_level_id, str(e)))
+
+        return form_responses, rejected_responses
 
     def pick_open_request(self, first: bool) -> OpenRequest | None:
         response = self.execute_function(AppsScriptFunction.PICK_OPEN_REQUEST, [first])
@@ -0,0 +1,164 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from enum import StrEnum
+from time import monotonic
+
+import requests
+
+import typing as tp
+
+from common_types import BroadcastInfo
+from twitch import TwitchClient
+from yt import get_recent_channel_video_ids, YoutubeApiWrapper
+
+
+class BroadcastEventType(StrEnum):
+    WENT_LIVE = "went_live"
+    WENT_OFFLINE = "went_offline"
+
+
+@dataclass
+class BroadcastEvent:
+    type: BroadcastEventType
+    broadcast: BroadcastInfo
+
+
+@dataclass
+class PollingPolicy:
+    min_interval: float
+    max_interval: float
+    backoff: float = 1.5
+
+
+# Right after a change the channel is polled often, then the interval grows while nothing happens
+YOUTUBE_POLLING_POLICY = PollingPolicy(min_interval=15.0, max_interval=120.0)
+TWITCH_POLLING_POLICY = PollingPolicy(min_interval=5.0, max_interval=60.0)
+
+
+@dataclass
+class _ChannelState:
+    channel: str
+    is_youtube: bool
+    policy: PollingPolicy
+    broadcast: BroadcastInfo | None = None
+    interval: float = 0.0
+    next_poll_at: float = 0.0
+
+    def reschedule(self, changed: bool) -> None:
+        if changed or not self.interval:
+            self.interval = self.policy.min_interval
+        else:
+            self.interval = min(self.interval * self.policy.backoff, self.policy.max_interval)
+        self.next_poll_at = monotonic() + self.interval
+
+
+class BroadcastMonitor:
+    def __init__(self, youtube: YoutubeApiWrapper, twitch_client: TwitchClient, on_event: tp.Callable[[BroadcastEvent], None], max_concurrent_polls: int = 4):
+        self.youtube = youtube
+        self.twitch_client = twitch_client
+        self.on_event = on_event
+        self.session = requests.Session()
+        self.executor = ThreadPoolExecutor(max_workers=max_concurrent_polls, thread_name_prefix="broadcast-monitor")
+        self._channels: list[_ChannelState] = []
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, name="broadcast-monitor", daemon=True)
+
+    def set_channels(self, youtube_channel_ids: list[str], twitch_logins: list[str]) -> None:
+        with self._lock:
+            existing = {(state.channel, state.is_youtube): state for state in self._channels}
+            self._channels = [
+                existing.get((channel_id, True)) or _ChannelState(channel_id, True, YOUTUBE_POLLING_POLICY)
+                for channel_id in dict.fromkeys(youtube_channel_ids) if channel_id
+            ] + [
+                existing.get((login.lower(), False)) or _ChannelState(login.lower(), False, TWITCH_POLLING_POLICY)
+                for login in dict.fromkeys(twitch_logins) if login
+            ]
+        self._wakeup.set()
+
+    def get_live_broadcasts(self) -> list[BroadcastInfo]:
+        with self._lock:
+            return [state.broadcast for state in self._channels if state.broadcast]
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stopped = True
+        self._wakeup.set()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def _postpone(self, state: _ChannelState) -> None:
+        with self._lock:
+            state.reschedule(changed=False)
+
+    def _poll_youtube_channel(self, state: _ChannelState) -> BroadcastInfo | None:
+        # Checking whether the known stream is still live takes a single 1-unit call. Otherwise, the candidates are
+        # taken from the channel feed
+        with self._lock:
+            known_broadcast = state.broadcast
+        if known_broadcast:
+            candidates = [known_broadcast.video_id]
+        else:
+            candidates = get_recent_channel_video_ids(state.channel, self.session)
+        live_video_ids = self.youtube.get_live_video_ids(candidates) if candidates else []
+        return BroadcastInfo(live_video_ids[0], True, state.channel) if live_video_ids else None
+
+    def _poll_twitch_channels(self, states: list[_ChannelState]) -> dict[str, BroadcastInfo | None]:
+        stream_ids = self.twitch_client.get_stream_ids([state.channel for state in states])
+        return {
+            login: BroadcastInfo(stream_id, False, login) if stream_id else None
+            for login, stream_id in stream_ids.items()
+        }
+
+    def _apply(self, state: _ChannelState, broadcast: BroadcastInfo | None) -> None:
+        # Events are sent without holding the lock, their handlers may call get_live_broadcasts()
+        with self._lock:
+            previous = state.broadcast
+            changed = previous != broadcast
+            state.broadcast = broadcast
+            state.reschedule(changed)
+
+        if previous and changed:
+            self.on_event(BroadcastEvent(BroadcastEventType.WENT_OFFLINE, previous))
+        if broadcast and changed:
+            self.on_event(BroadcastEvent(BroadcastEventType.WENT_LIVE, broadcast))
+
+    def poll_due_channels(self) -> None:
+        now = monotonic()
+        with self._lock:
+            due = [state for state in self._channels if state.next_poll_at <= now]
+
+        youtube_polls = [(state, self.executor.submit(self._poll_youtube_channel, state)) for state in due if state.is_youtube]
+        twitch_states = [state for state in due if not state.is_youtube]
+
+        if twitch_states:
+            try:
+                twitch_broadcasts = self._poll_twitch_channels(twitch_states)
+            except Exception as e:
+                print(f"Failed to check Twitch streams: {e}")
+                for state in twitch_states:
+                    self._postpone(state)
+            else:
+                for state in twitch_states:
+                    self._apply(state, twitch_broadcasts.get(state.channel))
+
+        for state, poll in youtube_polls:
+            try:
+                self._apply(state, poll.result())
+            except Exception as e:
+                print(f"Failed to check YouTube channel {state.channel}: {e}")
+                self._postpone(state)
+
+    def _run(self) -> None:
+        while not self._stopped:
+            try:
+                self.poll_due_channels()
+            except RuntimeError:  # The executor has been shut down
+                return
+            with self._lock:
+                next_poll_at = min((state.next_poll_at for state in self._channels), default=monotonic() + 60)
+            self._wakeup.wait(max(next_poll_at - monotonic(), 0.5))
+            self._wakeup.clear()
@@ -1,10 +1,15 @@
 from __future__ import annotations
 
-from dataclasses import dataclass, asdict, field
+from dataclasses import dataclass, field, fields
 import json
+import threading
+
+import typing as tp
 
 from common_types import BroadcastInfo
-from paths import CONFIG_DIR_PATH, CONFIG_PATH
+from compact_int_set import CompactIntSet
+from paths import CONFIG_DIR_PATH, CONFIG_PATH, STATE_PATH
+from state_store import StateStore
 
 
 START_ANNOUNCEMENT_TEMPLATE = """
@@ -26,28 +31,109 @@ class Caretaker:
     api_token: str = "REDACTED"
     youtube_channel_id: str = "UChO6WUVUrzGI7iklJHYsVYw"
     twitch_login: str = "kazvixx"
+    additional_youtube_channel_ids: list[str] = field(default_factory=list)
+    additional_twitch_logins: list[str] = field(default_factory=list)
+    coordinator_url: str = ""
+    coordinator_token: str = ""
     form_link: str = "https://docs.google.com/forms/d/e/1FAIpQLSdiiNCszrGo6ISM3h8tVcJFa1l9JJ97GAUqiCJn-4yP_Q5Oeg/viewform?usp=header"
     spreadsheet_link: str = "https://docs.google.com/spreadsheets/d/1o162S5-ObUH5twiYT20dVUoKfu38vW1nOZ5rHz-Y6gI/edit?gid=1210513451#gid=1210513451"
     start_announcement_text: str = START_ANNOUNCEMENT_TEMPLATE
     end_goodbye_text: str = END_GOODBYE_TEXT
     last_stream_id: str | None = None
     last_stream_is_youtube: bool = False
-    last_stream_processed_levels: set[int] = field(default_factory=set)
+    last_stream_processed_levels: CompactIntSet = field(default_factory=CompactIntSet)
+    store: StateStore | None = field(default=None, repr=False, compare=False)
+    dirty_settings: set[str] = field(default_factory=set, repr=False, compare=False)
+    dirty_settings_lock: threading.Lock = field(default_factory=threading.Lock, repr=False, compare=False)
 
     @classmethod
-    def load(cls) -> Caretaker:
-        if CONFIG_PATH.is_file():
-            loaded_dict = json.loads(CONFIG_PATH.read_text(encoding='utf-8'))
-            loaded_dict["last_stream_processed_levels"] = set(loaded_dict.get("last_stream_processed_levels", []))
-            return Caretaker(**loaded_dict)
+    def get_setting_names(cls) -> list[str]:
+        return [f.name for f in fields(cls) if f.name not in ("last_stream_processed_levels", "store", "dirty_settings", "dirty_settings_lock")]
 
+    @classmethod
+    def load(cls) -> Caretaker:
         CONFIG_DIR_PATH.mkdir(parents=True, exist_ok=True)
-        return Caretaker()
+        store = StateStore(STATE_PATH)
+
+        settings = store.load_settings()
+        if not settings and CONFIG_PATH.is_file():
+            legacy_dict = json.loads(CONFIG_PATH.read_text(encoding='utf-8'))
+            settings = {name: value for name, value in legacy_dict.items() if name in cls.get_setting_names()}
+            store.save_settings(settings)
+            store.add_processed_levels(legacy_dict.get("last_stream_processed_levels", []))
+            CONFIG_PATH.rename(CONFIG_PATH.with_suffix('.json.bak'))
+
+        known_settings = {name: value for name, value in settings.items() if name in cls.get_setting_names()}
+        processed_levels = CompactIntSet.from_sorted(store.load_processed_levels())
+        return Caretaker(**known_settings, last_stream_processed_levels=processed_levels, store=store)
+
+    @classmethod
+    def load_detached(cls) -> Caretaker:
+        # The stored settings without the store behind them: nothing gets written back and processed levels start
+        # empty in memory, so scripted sessions don't touch the state of the panel, which may be running next to them
+        settings = {}
+        if STATE_PATH.is_file():
+            store = StateStore(STATE_PATH, read_only=True)
+            try:
+                settings = store.load_settings()
+            finally:
+                store.close()
+        if not settings and CONFIG_PATH.is_file():
+            settings = json.loads(CONFIG_PATH.read_text(encoding='utf-8'))
+
+        return Caretaker(**{name: value for name, value in settings.items() if name in cls.get_setting_names()})
+
+    def update_settings(self, **values: tp.Any) -> bool:
+        with self.dirty_settings_lock:
+            for name, value in values.items():
+                if getattr(self, name) != value:
+                    setattr(self, name, value)
+                    self.dirty_settings.add(name)
+            return bool(self.dirty_settings)
 
     def save(self):
-        saved_dict = asdict(self)
-        saved_dict["last_stream_processed_levels"] = list(saved_dict.get("last_stream_processed_levels", []))
-        CONFIG_PATH.write_text(json.dumps(saved_dict, ensure_ascii=False, indent=4), encoding='utf-8')
+        with self.dirty_settings_lock:
+            changed_settings = {name: getattr(self, name) for name in self.dirty_settings}
+            self.dirty_settings = set()
+        if changed_settings and self.store:
+            self.store.save_settings(changed_settings)
+
+    def mark_levels_processed(self, level_ids: set[int]) -> None:
+        new_level_ids = self.last_stream_processed_levels.get_missing(level_ids)
+        if not new_level_ids:
+            return
+        self.last_stream_processed_levels.update(new_level_ids)
+        if self.store:
+            self.store.add_processed_levels(new_level_ids)
+
+    def reset_processed_levels(self) -> None:
+        if self.store:
+            self.store.clear_processed_levels()
+        self.last_stream_processed_levels.clear()
 
     def get_last_broadcast_info(self) -> BroadcastInfo | None:
         return BroadcastInfo(self.last_stream_id, self.last_stream_is_youtube) if self.last_stream_id else None
+
+
+class DebouncedSaver:
+    # Coalesces bursts of save requests into a single write performed in the background once they stop coming
+    def __init__(self, caretaker: Caretaker, delay_seconds: float = 1.0):
+        self.caretaker = caretaker
+        self.delay_seconds = delay_seconds
+        self._timer: threading.Timer | None = None
+        self._lock = threading.Lock()
+
+    def schedule(self) -> None:
+        with self._lock:
+            if self._timer:
+                self._timer.cancel()
+            self._timer = threading.Timer(self.delay_seconds, self.caretaker.save)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def flush(self) -> None:
+        with self._lock:
+            if self._timer:
+                self._timer.cancel()
+                self._timer = None
+        self.caretaker.save()
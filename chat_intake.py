@@ -0,0 +1,126 @@
+import re
+import threading
+from datetime import datetime, timezone
+
+import typing as tp
+
+from googleapiclient.errors import HttpError
+
+from common_types import FormResponse, Language
+from level_ids import parse_level_id
+from yt import QUOTA_COSTS, YoutubeApiMethod, YoutubeApiWrapper
+
+
+REQUEST_COMMANDS = {
+    "!req": Language.EN,
+    "!request": Language.EN,
+    "!рек": Language.RU,
+    "!реквест": Language.RU,
+    "!запрос": Language.RU,
+}
+
+SHOWCASE_LINK_PATTERN = re.compile(r"https?://(?:www\.|m\.)?(?:youtube\.com|youtu\.be)/\S+")
+
+MIN_POLLING_INTERVAL_SECONDS = 20.0  # Each poll costs 5 quota units, so YouTube's suggested interval is way too frequent
+QUOTA_RESERVE_UNITS = 500  # Leave some quota for posting to the chat
+
+
+def parse_chat_request(text: str, published_at: datetime) -> FormResponse | None:
+    words = text.split()
+    if len(words) < 2:
+        return None
+
+    language = REQUEST_COMMANDS.get(words[0].lower())
+    if not language:
+        return None
+
+    showcase_link_match = SHOWCASE_LINK_PATTERN.search(text)
+    try:
+        level_id = parse_level_id(SHOWCASE_LINK_PATTERN.sub(" ", text.split(maxsplit=1)[1]))
+    except ValueError:
+        return None
+
+    return FormResponse(
+        submission_timestamp=published_at,
+        language=language,
+        level_id=level_id,
+        showcase_link=showcase_link_match.group(0) if showcase_link_match else None
+    )
+
+
+class LiveChatIntake:
+    # Polls the stream chat for request commands (e.g. "!req 12345678 https://youtu.be/...") and passes the requests
+    # found on each page to on_requests. Messages sent before the intake has been started are ignored
+    def __init__(
+        self,
+        youtube: YoutubeApiWrapper,
+        live_chat_id: str,
+        on_requests: tp.Callable[[list[FormResponse]], None],
+        on_stopped: tp.Callable[[str], None] | None = None
+    ):
+        self.youtube = youtube
+        self.live_chat_id = live_chat_id
+        self.on_requests = on_requests
+        self.on_stopped = on_stopped
+        self.started_at = datetime.now(timezone.utc)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="live-chat-intake", daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self, timeout: float | None = None) -> None:
+        # With a timeout, waits for the poll in flight so no requests are passed on after stop() returns
+        self._stop.set()
+        if timeout is not None and self._thread.is_alive() and self._thread is not threading.current_thread():
+            self._thread.join(timeout)
+
+    def _extract_requests(self, response: dict) -> list[FormResponse]:
+        chat_requests = []
+        for item in response.get("items", []):
+            snippet = item.get("snippet", {})
+            raw_published_at = snippet.get("publishedAt")
+            text = snippet.get("displayMessage") or snippet.get("textMessageDetails", {}).get("messageText")
+            if not raw_published_at or not text:
+                continue
+            published_at = datetime.fromisoformat(raw_published_at.replace("Z", "+00:00"))
+            if published_at < self.started_at:
+                continue
+            chat_request = parse_chat_request(text, published_at.astimezone().replace(tzinfo=None))
+            if chat_request:
+                chat_requests.append(chat_request)
+        return chat_requests
+
+    def _run(self) -> None:
+        page_token = None
+        stop_reason = "Stopped"
+
+        while not self._stop.is_set():
+            if self.youtube.quota.get_remaining() < QUOTA_RESERVE_UNITS + QUOTA_COSTS[YoutubeApiMethod.LIVE_CHAT_MESSAGES_LIST]:
+                stop_reason = "YouTube API quota is running low"
+                break
+
+            polling_interval = MIN_POLLING_INTERVAL_SECONDS
+            try:
+                response = self.youtube.list_live_chat_messages(self.live_chat_id, page_token)
+            except HttpError as e:
+                if e.resp.status in (403, 404):  # The chat has ended or has been disabled
+                    stop_reason = f"The chat is no longer available ({e.resp.status})"
+                    break
+                print(f"Failed to read the stream chat: {e}")
+            except Exception as e:
+                print(f"Failed to read the stream chat: {e}")
+            else:
+                if response.get("offlineAt"):
+                    stop_reason = "The stream has ended"
+                    break
+                page_token = response.get("nextPageToken", page_token)
+                polling_interval = max(response.get("pollingIntervalMillis", 0) / 1000, MIN_POLLING_INTERVAL_SECONDS)
+                chat_requests = self._extract_requests(response)
+                if chat_requests and not self._stop.is_set():
+                    self.on_requests(chat_requests)
+
+            self._stop.wait(polling_interval)
+
+        if self.on_stopped:
+            self.on_stopped(stop_reason)
@@ -1,6 +1,6 @@
 from __future__ import annotations
 
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from datetime import datetime
 from enum import StrEnum
 
@@ -42,6 +42,7 @@ class OpenRequest:
     stars: int | None
     difficulty: str
     showcase_link: str | None
+    length: str | None = None  # Only known for the requests ingested by this process
 
 
 class SendType(StrEnum):
@@ -71,7 +72,17 @@ class SendType(StrEnum):
                 return None
 
 
+class Backend(StrEnum):
+    GD = "gd"
+    APPS_SCRIPT = "apps_script"
+    REQUEST_BOT = "request_bot"
+    YOUTUBE = "youtube"
+    TWITCH = "twitch"
+    COORDINATOR = "coordinator"
+
+
 @dataclass
 class BroadcastInfo:
     video_id: str
     is_youtube: bool
+    channel: str | None = field(default=None, compare=False)
@@ -0,0 +1,62 @@
+from __future__ import annotations
+
+from array import array
+from bisect import bisect_left
+from itertools import chain
+
+import typing as tp
+
+
+MAX_VALUE = 2 ** 32 - 1
+COMPACTION_THRESHOLD = 4096
+
+
+class CompactIntSet:
+    # A set of unsigned 32-bit integers stored as a sorted array searched with bisect, followed by an unsorted tail of
+    # recent additions. The tail is merged into the sorted array once it grows past COMPACTION_THRESHOLD, so memory
+    # usage stays at ~4 bytes per value instead of the ~60 of a Python set
+    def __init__(self, values: tp.Iterable[int] = ()):
+        self._sorted = array('I')
+        self._tail: set[int] = set()
+        self.update(values)
+
+    @classmethod
+    def from_sorted(cls, sorted_values: array) -> CompactIntSet:
+        # Takes over an already sorted array without copying it, like the one StateStore.load_processed_levels returns
+        int_set = cls()
+        int_set._sorted = sorted_values
+        return int_set
+
+    def _in_sorted(self, value: int) -> bool:
+        index = bisect_left(self._sorted, value)
+        return index < len(self._sorted) and self._sorted[index] == value
+
+    def __contains__(self, value: object) -> bool:
+        return isinstance(value, int) and (value in self._tail or self._in_sorted(value))
+
+    def __len__(self) -> int:
+        return len(self._sorted) + len(self._tail)
+
+    def __iter__(self) -> tp.Iterator[int]:
+        return chain(iter(self._sorted), iter(self._tail))
+
+    def get_missing(self, values: tp.Iterable[int]) -> list[int]:
+        return [value for value in dict.fromkeys(values) if value not in self]
+
+    def update(self, values: tp.Iterable[int]) -> None:
+        added = self.get_missing(values)
+        out_of_range = [value for value in added if not 0 <= value <= MAX_VALUE]
+        if out_of_range:
+            raise ValueError(f"Values don't fit into 32 bits: {', '.join(map(str, out_of_range))}")
+
+        self._tail.update(added)
+        if len(self._tail) > COMPACTION_THRESHOLD:
+            self.compact()
+
+    def compact(self) -> None:
+        self._sorted = array('I', sorted(chain(self._sorted, self._tail)))
+        self._tail = set()
+
+    def clear(self) -> None:
+        self._sorted = array('I')
+        self._tail = set()
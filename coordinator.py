@@ -0,0 +1,353 @@
+import argparse
+import json
+import random
+import secrets
+import threading
+from collections import Counter
+from dataclasses import dataclass
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from time import monotonic
+from uuid import uuid4
+
+import typing as tp
+
+import gd
+from apps_script import AppsScriptFunction
+from common_types import BroadcastInfo, FormResponse, OpenRequest, SendType
+from coordinator_client import CoordinatorEndpoint, DEFAULT_PORT, dump_open_request, load_form_response
+from engine import StreamEngine
+from headless import build_engine
+from paths import COORDINATOR_HISTORY_PATH
+from tracing import TRACER
+from traffic import TRAFFIC
+
+
+# Several panels can work through one queue: the coordinator runs the stream on the host (form, announcements,
+# ingestion, the goodbye message) and hands every open request to a single operator at a time. Operators point the
+# "Coordinator URL" option of their panels at it:
+#   python coordinator.py --token <secret>                on the host
+#   http://<host>:8765 and the same token                  in the Options tab of every panel
+
+DEFAULT_LEASE_SECONDS = 10 * 60
+DEFAULT_POLL_INTERVAL = 10.0
+SHEET_PICK_ATTEMPTS = 5
+
+
+class LeaseError(Exception):
+    pass
+
+
+@dataclass
+class Lease:
+    lease_id: str
+    operator: str
+    request: OpenRequest
+    expires_at: float
+
+
+class QueueCoordinator:
+    # Owns the open requests ingested during the stream and leases each of them to one operator. A lease which is not
+    # resolved or released in time goes back to the queue, though its operator can still resolve it as long as nobody
+    # else has taken the request. Requests that were in the sheet before the coordinator started are picked from the
+    # sheet once the ingested ones run out
+    def __init__(self, engine: StreamEngine, lease_seconds: float = DEFAULT_LEASE_SECONDS):
+        self.engine = engine
+        self.lease_seconds = lease_seconds
+        self.queue: dict[int, OpenRequest] = {}
+        self.leases: dict[str, Lease] = {}
+        self.expired_leases: dict[str, Lease] = {}
+        self.leased_levels: dict[int, str] = {}
+        self.resolved_levels: set[int] = set()
+        self.verdicts_by_operator: Counter[str] = Counter()
+        self._lock = threading.Lock()
+        self._sheet_lock = threading.Lock()
+        self._random = random.Random()
+        engine.on_requests_queued = self.enqueue
+
+    def enqueue(self, requests: list[OpenRequest]) -> None:
+        with self._lock:
+            for request in requests:
+                if request.level_id not in self.leased_levels and request.level_id not in self.resolved_levels:
+                    self.queue.setdefault(request.level_id, request)
+
+    def ingest_form_responses(self) -> None:
+        # Ingestion goes through the sheet like picks and verdicts, so it takes the sheet lock as well
+        with self._sheet_lock:
+            self.engine.process_new_responses()
+
+    def submit_responses(self, responses: list[FormResponse]) -> None:
+        with self._sheet_lock:
+            self.engine.on_chat_requests(responses)
+
+    def expire_leases(self) -> None:
+        now = monotonic()
+        with self._lock:
+            for lease in [lease for lease in self.leases.values() if lease.expires_at <= now]:
+                print(f"Lease of level {lease.request.level_id} by {lease.operator} has expired, the request is back in the queue")
+                self._drop_lease(lease)
+                self.expired_leases[lease.lease_id] = lease
+                self.queue[lease.request.level_id] = lease.request
+
+    def _drop_lease(self, lease: Lease) -> None:
+        del self.leases[lease.lease_id]
+        if self.leased_levels.get(lease.request.level_id) == lease.lease_id:
+            del self.leased_levels[lease.request.level_id]
+
+    def _take(self, operator: str, request: OpenRequest) -> Lease:
+        self.queue.pop(request.level_id, None)
+        for lease_id in [lease_id for lease_id, lease in self.expired_leases.items() if lease.request.level_id == request.level_id]:
+            del self.expired_leases[lease_id]
+
+        lease = Lease(uuid4().hex, operator, request, monotonic() + self.lease_seconds)
+        self.leases[lease.lease_id] = lease
+        self.leased_levels[request.level_id] = lease.lease_id
+        return lease
+
+    def _pick_from_sheet(self, oldest: bool) -> OpenRequest | None:
+        # The sheet can't skip leased requests, so we retry with random picks a few times when it returns one
+        with self._sheet_lock:
+            for attempt in range(SHEET_PICK_ATTEMPTS):
+                request = self.engine.app_script.pick_open_request(oldest and attempt == 0)
+                if not request:
+                    return None
+                with self._lock:
+                    if request.level_id not in self.leased_levels and request.level_id not in self.resolved_levels:
+                        return request
+        return None
+
+    def lease(self, operator: str, oldest: bool) -> Lease | None:
+        self.expire_leases()
+        with self._lock:
+            if self.queue:
+                if oldest:
+                    request = min(self.queue.values(), key=lambda request: request.submission_timestamp)
+                else:
+                    request = self._random.choice(list(self.queue.values()))
+                return self._take(operator, request)
+
+        request = self._pick_from_sheet(oldest)
+        if not request:
+            return None
+        with self._lock:
+            if request.level_id in self.leased_levels:  # Leased by someone else while we were asking the sheet
+                return None
+            return self._take(operator, request)
+
+    def _find_lease(self, operator: str, lease_id: str) -> Lease:
+        lease = self.leases.get(lease_id)
+        if not lease:
+            lease = self.expired_leases.get(lease_id)
+            if not lease or lease.request.level_id not in self.queue:
+                raise LeaseError("The lease has expired and the request has been taken by another operator")
+        if lease.operator != operator:
+            raise LeaseError(f"The lease belongs to {lease.operator}")
+        return lease
+
+    def resolve(self, operator: str, lease_id: str, resolution: str) -> None:
+        with self._lock:
+            lease = self._find_lease(operator, lease_id)
+            if lease.lease_id in self.expired_leases:  # Nobody took it yet, so the late verdict still counts
+                del self.expired_leases[lease.lease_id]
+                lease = self._take(operator, lease.request)
+
+        level_id = lease.request.level_id
+        with self._sheet_lock:
+            self.engine.app_script.execute_function(AppsScriptFunction.RESOLVE_REQUEST, [level_id, resolution])
+
+        with self._lock:
+            self._drop_lease(lease)
+            self.resolved_levels.add(level_id)
+            self.verdicts_by_operator[operator] += 1
+            if resolution == "later":
+                self.engine.later_cnt += 1
+            elif resolution == SendType.NOT_SENT.get_apps_script_value():
+                self.engine.rejected_cnt += 1
+            else:
+                self.engine.approved_cnt += 1
+        self.engine.history.record_verdict(level_id, resolution)
+        print(f"{operator}: level {level_id} -> {resolution}")
+
+    def release(self, operator: str, lease_id: str) -> None:
+        with self._lock:
+            lease = self.leases.get(lease_id)
+            if not lease:
+                return
+            if lease.operator != operator:
+                raise LeaseError(f"The lease belongs to {lease.operator}")
+            self._drop_lease(lease)
+            self.queue[lease.request.level_id] = lease.request
+
+    def get_status(self) -> dict:
+        now = monotonic()
+        with self._lock:
+            return dict(
+                queued=len(self.queue),
+                leases=[
+                    dict(operator=lease.operator, level_id=lease.request.level_id, expires_in=round(lease.expires_at - now))
+                    for lease in self.leases.values()
+                ],
+                verdicts=dict(self.verdicts_by_operator),
+                approved=self.engine.approved_cnt,
+                rejected=self.engine.rejected_cnt,
+                later=self.engine.later_cnt
+            )
+
+
+class CoordinatorRequestHandler(BaseHTTPRequestHandler):
+    server: "CoordinatorServer"
+
+    def do_POST(self) -> None:  # noqa
+        if not secrets.compare_digest(self.headers.get("x-key", ""), self.server.token):
+            self._reply(HTTPStatus.FORBIDDEN, dict(error="Wrong coordinator token"))
+            return
+
+        if self.path not in set(CoordinatorEndpoint):
+            self._reply(HTTPStatus.NOT_FOUND, dict(error=f"Unknown endpoint {self.path}"))
+            return
+
+        try:
+            payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            with TRACER.span(f"coordinator.serve{self.path}", operator=payload.get("operator")):
+                result = self._dispatch(payload)
+        except LeaseError as e:
+            self._reply(HTTPStatus.CONFLICT, dict(error=str(e)))
+        except KeyError as e:
+            self._reply(HTTPStatus.BAD_REQUEST, dict(error=f"Missing field {e}"))
+        except Exception as e:
+            print(f"Failed to handle {self.path}: {e}")
+            self._reply(HTTPStatus.BAD_GATEWAY, dict(error=str(e)))
+        else:
+            self._reply(HTTPStatus.OK, result)
+
+    def _dispatch(self, payload: dict) -> tp.Any:
+        coordinator = self.server.coordinator
+        operator = payload["operator"]
+        match self.path:
+            case CoordinatorEndpoint.LEASE:
+                lease = coordinator.lease(operator, bool(payload.get("oldest", True)))
+                return dict(lease_id=lease.lease_id, request=dump_open_request(lease.request)) if lease else dict(lease_id=None)
+            case CoordinatorEndpoint.RESOLVE:
+                coordinator.resolve(operator, payload["lease_id"], payload["resolution"])
+            case CoordinatorEndpoint.RELEASE:
+                coordinator.release(operator, payload["lease_id"])
+            case CoordinatorEndpoint.SUBMIT_RESPONSES:
+                coordinator.submit_responses([load_form_response(raw) for raw in payload["responses"]])
+            case CoordinatorEndpoint.STATUS:
+                return coordinator.get_status()
+        return dict()
+
+    def _reply(self, status: HTTPStatus, body: dict) -> None:
+        # The error goes into the reason phrase too, so it ends up in the message of requests.HTTPError on the panel
+        reason = body.get("error", status.phrase).splitlines()[0].encode('ascii', errors='replace').decode('ascii')
+        encoded = json.dumps(body).encode('utf-8')
+        self.send_response(status, reason)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(encoded)))
+        self.end_headers()
+        self.wfile.write(encoded)
+
+    def log_message(self, format: str, *args: tp.Any) -> None:  # noqa
+        pass  # Operators poll a lot, we only print verdicts and failures
+
+
+class CoordinatorServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address: tuple[str, int], coordinator: QueueCoordinator, token: str):
+        super().__init__(address, CoordinatorRequestHandler)
+        self.coordinator = coordinator
+        self.token = token
+
+
+def poll_form(coordinator: QueueCoordinator, interval: float, stop_event: threading.Event) -> None:
+    while not stop_event.wait(interval):
+        try:
+            coordinator.ingest_form_responses()
+            coordinator.expire_leases()
+        except Exception as e:
+            print(f"Failed to poll the form: {e}")
+
+
+def main(argv: tp.Sequence[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Runs the stream on the host and shares its queue between several panels")
+    parser.add_argument("--host", default="0.0.0.0", help="Interface to listen on, all of them by default")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--token", help="Secret the panels have to send, the one from the settings or a random one by default")
+    parser.add_argument("--lease-seconds", type=float, default=DEFAULT_LEASE_SECONDS, help="How long an operator may keep a request before it goes back to the queue")
+    parser.add_argument("--poll-interval", type=float, default=DEFAULT_POLL_INTERVAL, help="How often new form responses are ingested, seconds")
+    parser.add_argument("--youtube", metavar="VIDEO_ID", help="Stream on this YouTube broadcast instead of looking it up")
+    parser.add_argument("--twitch", metavar="LOGIN", help="Stream on this Twitch channel instead of looking it up")
+    parser.add_argument("--resume", action="store_true", help="Pick up the stream without the announcements and the form reopening")
+    parser.add_argument("--keep-remaining", action="store_true", help="Don't dump the remaining requests to the bot when the coordinator stops")
+    parser.add_argument("--local-sheet", action="store_true", help="Use an in-memory spreadsheet instead of Apps Script")
+    parser.add_argument("--bot-url", help="Request bot API root URL, the one from the settings by default")
+    parser.add_argument("--bot-token", help="Request bot API token, the one from the settings by default")
+    parser.add_argument("--analytics", type=Path, default=Path(":memory:"), help="Analytics database, in-memory by default")
+    parser.add_argument("--history", type=Path, default=COORDINATOR_HISTORY_PATH, help="Submission history database, it must not be shared with a running panel")
+    parser.add_argument("--trace", type=Path, help="Record tracing spans and save them as a Chrome trace")
+    arguments = parser.parse_args(argv)
+
+    if arguments.trace:
+        TRACER.enabled = True
+
+    # The coordinator runs the stream startup routine for everyone, so it posts the form link to the chat itself
+    engine, _ = build_engine(
+        bot_url=arguments.bot_url,
+        bot_token=arguments.bot_token,
+        analytics_path=arguments.analytics,
+        history_path=arguments.history,
+        local_sheet=arguments.local_sheet,
+        live_chat=True
+    )
+    token = arguments.token or engine.caretaker.coordinator_token or secrets.token_urlsafe(16)
+    coordinator = QueueCoordinator(engine, arguments.lease_seconds)
+
+    if arguments.youtube:
+        broadcast = BroadcastInfo(arguments.youtube, True, engine.caretaker.youtube_channel_id)
+    elif arguments.twitch:
+        broadcast = BroadcastInfo(arguments.twitch, False, arguments.twitch)
+    else:
+        broadcast = engine.lookup_broadcast()
+    if not broadcast:
+        print("There is no active livestream on the selected channel, pass --youtube or --twitch to choose one")
+        engine.close()
+        return 1
+
+    if arguments.resume:
+        engine.resume_stream(broadcast)
+    else:
+        engine.start_stream(broadcast)
+
+    server = CoordinatorServer((arguments.host, arguments.port), coordinator, token)
+    stop_event = threading.Event()
+    poller = threading.Thread(target=poll_form, args=(coordinator, arguments.poll_interval, stop_event), daemon=True)
+    poller.start()
+
+    print(f"Coordinating {engine.video_link} on port {arguments.port} with the token {token}, press Ctrl+C to end the stream")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop_event.set()
+        server.server_close()
+        poller.join()
+
+        status = coordinator.get_status()
+        if status["leases"]:
+            print(f"{len(status['leases'])} requests were still being reviewed: " + ", ".join(f"{lease['level_id']} ({lease['operator']})" for lease in status["leases"]))
+        engine.end_stream(not arguments.keep_remaining)
+        print(f"Verdicts by operator: {status['verdicts']}")
+        engine.close()
+        TRAFFIC.close()
+        if arguments.trace:
+            print(f"GD API shares: {gd.API.rate_limiter.describe_shares()}")
+            TRACER.export_chrome_trace(arguments.trace)
+        gd.API.close()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
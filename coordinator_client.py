@@ -0,0 +1,133 @@
+import os
+import socket
+from dataclasses import dataclass, field
+from datetime import datetime
+from enum import StrEnum
+
+import requests
+
+import typing as tp
+
+from common_types import Backend, FormResponse, Language, OpenRequest
+from tracing import TRACER
+from traffic import TRAFFIC
+
+
+DEFAULT_PORT = 8765
+CONNECT_TIMEOUT = 3.05
+READ_TIMEOUT = 30.0  # Resolving goes through Apps Script on the coordinator side
+
+
+class CoordinatorEndpoint(StrEnum):
+    LEASE = "/lease"
+    RESOLVE = "/resolve"
+    RELEASE = "/release"
+    SUBMIT_RESPONSES = "/responses"
+    STATUS = "/status"
+
+
+def dump_open_request(request: OpenRequest) -> dict:
+    return dict(
+        submission_timestamp=request.submission_timestamp.isoformat(),
+        language=request.language.value,
+        level_name=request.level_name,
+        creator=request.creator,
+        level_id=request.level_id,
+        stars=request.stars,
+        difficulty=request.difficulty,
+        showcase_link=request.showcase_link,
+        length=request.length
+    )
+
+
+def load_open_request(raw: dict) -> OpenRequest:
+    return OpenRequest(
+        submission_timestamp=datetime.fromisoformat(raw["submission_timestamp"]),
+        language=Language(raw["language"]),
+        level_name=raw["level_name"],
+        creator=raw["creator"],
+        level_id=int(raw["level_id"]),
+        stars=raw["stars"],
+        difficulty=raw["difficulty"],
+        showcase_link=raw["showcase_link"],
+        length=raw.get("length")
+    )
+
+
+def dump_form_response(response: FormResponse) -> dict:
+    return dict(
+        submission_timestamp=response.submission_timestamp.isoformat(),
+        language=response.language.value,
+        level_id=response.level_id,
+        showcase_link=response.showcase_link
+    )
+
+
+def load_form_response(raw: dict) -> FormResponse:
+    return FormResponse(
+        submission_timestamp=datetime.fromisoformat(raw["submission_timestamp"]),
+        language=Language(raw["language"]),
+        level_id=int(raw["level_id"]),
+        showcase_link=raw["showcase_link"]
+    )
+
+
+def get_default_operator_name() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+@dataclass
+class CoordinatorClient:
+    # Used by the panel in multi-operator mode: open requests are leased from the coordinator instead of being
+    # picked from the sheet, and verdicts are sent to it, so several panels never review the same level
+    root_url: str
+    token: str
+    operator: str = field(default_factory=get_default_operator_name)
+    lease_id: str | None = field(default=None, init=False)
+    session: requests.Session = field(default_factory=requests.Session, init=False, repr=False)
+
+    def _post(self, endpoint: CoordinatorEndpoint, payload: dict) -> tp.Any:
+        def send() -> tp.Any:
+            response = self.session.post(
+                url=self.root_url.removesuffix("/") + endpoint,
+                json=payload,
+                headers={"x-key": self.token},
+                timeout=(CONNECT_TIMEOUT, READ_TIMEOUT)
+            )
+            response.raise_for_status()
+            return response.json()
+
+        with TRACER.span(f"coordinator.{endpoint.value.removeprefix('/')}", backend="coordinator", endpoint=endpoint.value):
+            return TRAFFIC.exchange(Backend.COORDINATOR, endpoint.value, payload, send)
+
+    def lease(self, oldest: bool) -> OpenRequest | None:
+        self.release()
+        response = self._post(CoordinatorEndpoint.LEASE, dict(operator=self.operator, oldest=oldest))
+        if not response.get("lease_id"):
+            return None
+        self.lease_id = response["lease_id"]
+        return load_open_request(response["request"])
+
+    def resolve(self, resolution: str) -> None:
+        if not self.lease_id:  # Requests picked from the bot are not in the sheet
+            return
+        self._post(CoordinatorEndpoint.RESOLVE, dict(operator=self.operator, lease_id=self.lease_id, resolution=resolution))
+        self.lease_id = None
+
+    def release(self) -> None:
+        if not self.lease_id:
+            return
+        lease_id, self.lease_id = self.lease_id, None
+        self._post(CoordinatorEndpoint.RELEASE, dict(operator=self.operator, lease_id=lease_id))
+
+    def submit_responses(self, responses: list[FormResponse]) -> None:
+        self._post(CoordinatorEndpoint.SUBMIT_RESPONSES, dict(operator=self.operator, responses=[dump_form_response(response) for response in responses]))
+
+    def get_status(self) -> dict:
+        return self._post(CoordinatorEndpoint.STATUS, dict(operator=self.operator))
+
+    def close(self) -> None:
+        try:
+            self.release()
+        finally:
+            self.session.close()
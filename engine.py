@@ -0,0 +1,595 @@
+import functools
+import threading
+from dataclasses import dataclass
+from functools import partial
+from time import perf_counter
+
+import jinja2
+
+import twitch
+import typing as tp
+
+from analytics import AnalyticsStore, RequestSource
+from apps_script import AppsScriptApiWrapper, AppsScriptFunction
+from caretaker import Caretaker
+from common_types import Backend, BroadcastInfo, FormResponse, OpenRequest, SendType
+from coordinator_client import CoordinatorClient
+from gd import get_levels, LevelGrade, RequestedDifficulty
+from submission_history import PendingQueue, SubmissionHistory, SubmissionSource
+from request_bot import construct_request_creation_payload, construct_request_pre_approval_payload, construct_request_resolution_payload, BotRequestWindow, RequestBotApiEndpoint, RequestBotApiWrapper
+from tracing import traced, TRACER
+from yt import LiveChatMessageQueue, ShowcaseMetadataCache, YoutubeApiWrapper, YoutubeLiveStreamingDetails
+
+
+def records_backend_calls(for_current_pick: bool = False) -> tp.Callable:
+    # The analytics store only gets the backend calls an engine operation makes on its own thread, so the broadcast
+    # monitor, bot window refills or showcase prefetches running meanwhile aren't counted towards the current pick
+    def decorator(func: tp.Callable) -> tp.Callable:
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            with TRACER.listening(partial(self.on_span_finished, self.current_pick_id if for_current_pick else None)):
+                return func(self, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+@dataclass
+class PickedRequest:
+    request: OpenRequest
+    request_id: int
+    is_from_bot: bool
+    details: str
+
+
+class StreamEngine:
+    # The stream workflow without any UI: starting / resuming a stream, ingesting responses, picking and resolving
+    # requests and ending the stream. Problems are reported through report_error, which may be called from background
+    # threads
+    def __init__(
+        self,
+        caretaker: Caretaker,
+        app_script: AppsScriptApiWrapper,
+        request_bot: RequestBotApiWrapper,
+        analytics: AnalyticsStore,
+        history: SubmissionHistory,
+        youtube: YoutubeApiWrapper | None = None,
+        live_chat_queue: LiveChatMessageQueue | None = None,
+        showcase_metadata: ShowcaseMetadataCache | None = None,
+        report_error: tp.Callable[[str], None] = print
+    ):
+        self.caretaker = caretaker
+        self.app_script = app_script
+        self.request_bot = request_bot
+        self.bot_request_window = BotRequestWindow(request_bot)
+        self.analytics = analytics
+        self.history = history
+        self.youtube = youtube
+        self.live_chat_queue = live_chat_queue
+        self.showcase_metadata = showcase_metadata
+        self.report_error = report_error
+        self.ingestion_lock = threading.Lock()
+
+        # In multi-operator mode the host runs the stream through the coordinator and this panel only reviews the
+        # requests leased from it
+        self.coordinator: CoordinatorClient | None = None
+        self.on_requests_queued: tp.Callable[[list[OpenRequest]], None] | None = None
+
+        # Will be defined once the stream is started or resumed
+        self.current_broadcast: BroadcastInfo | None = None
+        self.is_streaming = False
+        self.video_link: str | None = None
+        self.yt_live_streaming_details: YoutubeLiveStreamingDetails | None = None
+        self.analytics_session_id: int | None = None
+
+        # Will be defined once the first request is picked and updated with every new request
+        self.current_request_timecode: int | None = None
+        self.current_request_id: int | None = None
+        self.current_level_id: int | None = None
+        self.current_pick_id: int | None = None
+
+        self.approved_cnt = 0
+        self.rejected_cnt = 0
+        self.later_cnt = 0
+
+    def on_span_finished(self, pick_id: int | None, name: str, tags: dict[str, tp.Any], duration: float, failed: bool) -> None:
+        # Backend calls are timed once, by the tracing spans of the API wrappers, and the analytics store gets the same
+        # measurements as the latency tab
+        backend, operation = tags.get("backend"), tags.get("endpoint")
+        if self.analytics_session_id is None or not backend or not operation:
+            return
+        self.analytics.record_backend_call(self.analytics_session_id, pick_id, Backend(backend), str(operation), duration, not failed)
+
+    def get_video_link_with_timecode(self) -> str:
+        if self.current_broadcast.is_youtube and self.current_request_timecode:
+            return f"{self.video_link}&t={self.current_request_timecode + 10}"  # A streamer needs some time to react, find level etc. We'll be more accurate this way
+        return self.video_link
+
+    def has_live_chat(self) -> bool:
+        return bool(self.yt_live_streaming_details and self.yt_live_streaming_details.live_chat_id)
+
+    def lookup_broadcast(self) -> BroadcastInfo | None:
+        yt_video_id = None
+        if self.youtube:
+            try:
+                yt_video_id = self.youtube.get_live_stream_video_id(self.caretaker.youtube_channel_id)
+            except Exception:  # noqa
+                pass
+
+        if yt_video_id:
+            return BroadcastInfo(yt_video_id, True, self.caretaker.youtube_channel_id)
+
+        try:
+            twitch_stream_id = twitch.get_stream_id(self.caretaker.twitch_login)
+        except Exception:  # noqa
+            twitch_stream_id = None
+
+        if twitch_stream_id:
+            return BroadcastInfo(twitch_stream_id, False, self.caretaker.twitch_login)
+
+        return None
+
+    @records_backend_calls()
+    def resume_stream(self, broadcast: BroadcastInfo) -> None:
+        self.current_broadcast = broadcast
+
+        if broadcast.is_youtube:
+            self.video_link = f"https://www.youtube.com/watch?v={broadcast.video_id}"
+            try:
+                self.yt_live_streaming_details = self.youtube.get_live_streaming_details(broadcast.video_id) if self.youtube else None
+            except Exception as e:
+                self.yt_live_streaming_details = None
+                self.report_error(f"Failed to get the stream chat due to the exception: {e}\nYou will have to send form link manually when needed")
+        else:
+            self.video_link = f"https://www.twitch.tv/{broadcast.channel or self.caretaker.twitch_login}"
+            self.yt_live_streaming_details = None
+
+        self.analytics_session_id = self.analytics.start_session(broadcast.video_id)
+        self.is_streaming = True
+
+    @records_backend_calls()
+    @traced("app.start_stream")
+    def start_stream(self, broadcast: BroadcastInfo) -> None:
+        self.resume_stream(broadcast)
+        if self.coordinator or broadcast == self.caretaker.get_last_broadcast_info():
+            return
+
+        self.perform_stream_startup_routine()
+        self.caretaker.update_settings(
+            last_stream_id=broadcast.video_id,
+            last_stream_is_youtube=broadcast.is_youtube
+        )
+        self.caretaker.reset_processed_levels()
+        self.caretaker.save()
+
+    @records_backend_calls()
+    def perform_stream_startup_routine(self) -> None:
+        try:
+            self.app_script.execute_function(AppsScriptFunction.REOPEN_FORM)
+        except Exception as e:
+            self.report_error(f"Failed to reopen the form due to the exception: {e}\nYou might have to do it manually")
+
+        substitutions = dict(
+            video_link=self.video_link,
+            form_link=self.caretaker.form_link,
+            spreadsheet_link=self.caretaker.spreadsheet_link
+        )
+        announcement_text = jinja2.Template(self.caretaker.start_announcement_text).render(substitutions)
+
+        announcement = self.request_bot.post_async(
+            endpoint=RequestBotApiEndpoint.SEND_STREAM_START_MESSAGE,
+            payload=dict(
+                text=announcement_text
+            )
+        )
+
+        self.resend_form_link()
+
+        try:
+            announcement.result()
+        except Exception as e:
+            self.report_error(f"Failed to access bot api due to the exception: {e}\nStream announcement has not been sent, you might have to do it manually")
+
+    @records_backend_calls()
+    def resend_form_link(self) -> None:
+        if self.has_live_chat() and self.live_chat_queue:
+            self.live_chat_queue.post(self.yt_live_streaming_details.live_chat_id, self.caretaker.form_link)
+
+    @records_backend_calls()
+    def reopen_form(self) -> None:
+        try:
+            self.app_script.execute_function(AppsScriptFunction.REOPEN_FORM)
+        except Exception as e:
+            self.report_error(f"Failed to reopen the form due to the exception: {e}\nYou might have to do it manually")
+
+    @records_backend_calls()
+    @traced("app.end_stream")
+    def end_stream(self, dump: bool) -> None:
+        if self.coordinator:
+            self.leave_coordinated_stream()
+            return
+
+        try:
+            self.app_script.execute_function(AppsScriptFunction.CLOSE_FORM)
+        except Exception as e:
+            self.report_error(f"Failed to close the form due to the exception: {e}\nYou might have to do it manually")
+
+        self.process_new_responses()
+
+        try:
+            remaining_requests = self.app_script.close_remaining_requests(dump)
+        except Exception as e:
+            self.report_error(f"Failed to close remaining requests in Google Sheets due to the exception: {e}\nYou might have to do it manually")
+            remaining_requests = []
+
+        self.history.clear_pending(request.level_id for request in remaining_requests)
+
+        if dump:
+            dump_result = self.request_bot.create_requests(
+                [request for request in remaining_requests if request.level_id != self.current_level_id],
+                self.video_link
+            )
+            for request_id, request in dump_result.created.items():
+                self.history.mark_pending([request.level_id], PendingQueue.BOT, request_id)
+
+            total = len(dump_result.created) + len(dump_result.failed) + len(dump_result.unconfirmed)
+            if dump_result.failed:
+                failed_ids = ", ".join(str(request.level_id) for request in dump_result.failed)
+                self.report_error(f"Failed to dump {len(dump_result.failed)} of {total} requests to the bot. Level IDs that have not been dumped:\n{failed_ids}")
+            if dump_result.unconfirmed:
+                unconfirmed_ids = ", ".join(str(request.level_id) for request in dump_result.unconfirmed)
+                self.report_error(f"The bot didn't confirm {len(dump_result.unconfirmed)} of {total} dumped requests, check its queue before adding them again. Level IDs:\n{unconfirmed_ids}")
+
+        try:
+            self.request_bot.post(
+                endpoint=RequestBotApiEndpoint.SEND_STREAM_END_MESSAGE,
+                payload=dict(
+                    text=self.caretaker.end_goodbye_text,
+                    not_reviewed=len(remaining_requests),
+                    approved=self.approved_cnt,
+                    rejected=self.rejected_cnt,
+                    later=self.later_cnt
+                )
+            )
+        except Exception as e:
+            self.report_error(f"Failed to access bot api due to the exception: {e}")
+
+        try:
+            self.bot_request_window.release()
+        except Exception as e:
+            print(f"Failed to release leased bot requests: {e}")
+
+        self.end_analytics_session()
+        self.is_streaming = False
+
+    def end_analytics_session(self) -> None:
+        if self.analytics_session_id is not None:
+            self.analytics.end_session(self.analytics_session_id)
+            self.analytics_session_id = None
+
+    @records_backend_calls()
+    def leave_coordinated_stream(self) -> None:
+        # The stream itself goes on until the coordinator is stopped, we only give back what this panel holds
+        try:
+            self.coordinator.release()
+        except Exception as e:
+            print(f"Failed to release the leased request: {e}")
+
+        try:
+            self.bot_request_window.release()
+        except Exception as e:
+            print(f"Failed to release leased bot requests: {e}")
+
+        self.end_analytics_session()
+        self.is_streaming = False
+
+    def pick_open_request(self, pick_oldest: bool) -> OpenRequest | None:
+        if self.coordinator:
+            try:
+                return self.coordinator.lease(pick_oldest)
+            except Exception as e:
+                print(f"Failed to lease a request from the coordinator: {e}")
+                return None
+
+        self.process_new_responses()
+
+        try:
+            return self.app_script.pick_open_request(pick_oldest)
+        except Exception:  # noqa
+            return None
+
+    @records_backend_calls()
+    @traced("app.pick_new_request")
+    def pick_new_request(self, pick_oldest: bool) -> PickedRequest | None:
+        pick_started_at = perf_counter()
+
+        self.current_request_timecode = None
+        self.current_request_id = None
+        self.current_level_id = None
+        self.current_pick_id = None
+
+        picked_request = self.pick_open_request(pick_oldest)
+
+        is_from_bot = False
+        if not picked_request:
+            try:
+                bot_pick = self.bot_request_window.pick(pick_oldest)
+            except Exception as e:
+                self.report_error(f"Failed to access bot api due to the exception: {e}")
+                return None
+            else:
+                if bot_pick:
+                    bot_request, picked_request = bot_pick
+                    self.current_request_id = bot_request.id
+                    is_from_bot = True
+
+        if not picked_request:
+            self.report_error("No requests yet!")
+            return None
+
+        self.current_level_id = picked_request.level_id
+        history_description = self.history.describe(picked_request.level_id)
+
+        is_also_in_bot = False
+        if not is_from_bot:
+            duplicate_bot_request = self.bot_request_window.take_level(picked_request.level_id)
+            if duplicate_bot_request:  # One verdict will do for both of them
+                self.current_request_id = duplicate_bot_request.id
+                is_also_in_bot = True
+
+        if not self.current_request_id:
+            try:
+                self.current_request_id = self.request_bot.post(
+                    RequestBotApiEndpoint.CREATE_REQUEST,
+                    construct_request_creation_payload(
+                        picked_request,
+                        self.get_video_link_with_timecode()
+                    )
+                )
+            except Exception as e:
+                self.report_error(f"Failed to access bot api due to the exception: {e}")
+                return None
+
+        self.history.mark_pending([picked_request.level_id], PendingQueue.BOT if is_from_bot else PendingQueue.SHEET, self.current_request_id)
+
+        header = f"Request {self.current_request_id}"
+        if is_from_bot:
+            header += " (FROM BOT!)"
+        elif is_also_in_bot:
+            header += " (ALSO IN BOT QUEUE!)"
+
+        if picked_request.stars:
+            difficulty_explanation = f"requested {picked_request.stars} stars/moons"
+        else:
+            difficulty_explanation = "stars/moons were not requested"
+
+        details_lines = [
+            header,
+            f"Language: {picked_request.language.get_spreadsheet_value()}",
+            f"ID: {picked_request.level_id}",
+            f"Level: {picked_request.level_name} by {picked_request.creator}",
+            f"Difficulty: {picked_request.difficulty} ({difficulty_explanation})",
+            f"Showcase: {self.describe_showcase(picked_request.showcase_link)}",
+            f"Submitted: {picked_request.submission_timestamp}",
+        ]
+        if history_description:
+            details_lines.append(f"History: {history_description}")
+
+        if self.showcase_metadata:
+            self.showcase_metadata.prefetch(request.showcase_link for request in self.bot_request_window.get_pooled_requests())
+
+        if self.yt_live_streaming_details:
+            self.current_request_timecode = self.yt_live_streaming_details.get_current_duration_in_seconds()
+
+        # Picks made before a stream has been started or resumed don't belong to any analytics session
+        self.current_pick_id = self.analytics.record_pick(
+            self.analytics_session_id,
+            picked_request.level_id,
+            RequestSource.BOT if is_from_bot else RequestSource.SHEET,
+            perf_counter() - pick_started_at
+        ) if self.analytics_session_id is not None else None
+
+        return PickedRequest(picked_request, self.current_request_id, is_from_bot, "\n".join(details_lines))
+
+    def describe_showcase(self, showcase_link: str | None) -> str:
+        if not showcase_link:
+            return "Not provided"
+        try:
+            metadata = self.showcase_metadata.get(showcase_link) if self.showcase_metadata else None
+        except Exception:  # noqa
+            metadata = None
+        return f"{showcase_link} ({metadata.describe()})" if metadata else showcase_link
+
+    @records_backend_calls(for_current_pick=True)
+    @traced("app.resolve_in_bot_and_sheet")
+    def resolve_in_bot_and_sheet(self, resolution: str, bot_endpoint: RequestBotApiEndpoint, bot_payload: dict) -> bool:
+        # The sheet is only touched once the bot has taken the verdict: if the bot call fails, both sides stay open and
+        # the verdict can simply be given again
+        verdict_started_at = perf_counter()
+
+        try:
+            self.request_bot.post(bot_endpoint, bot_payload)
+        except Exception as e:
+            self.report_error(f"Failed to access bot api due to the exception: {e}")
+            return False
+
+        try:
+            if self.coordinator:
+                self.coordinator.resolve(resolution)
+            else:
+                self.app_script.execute_function(AppsScriptFunction.RESOLVE_REQUEST, [self.current_level_id, resolution])
+        except Exception as e:
+            if self.coordinator:
+                self.report_error(f"Failed to pass the verdict to the coordinator due to the exception: {e}")
+            else:
+                self.report_error(f"Failed to access Google Sheets due to the exception: {e}. You should mark the request as resolved manually")
+            return False
+
+        if self.current_pick_id is not None:
+            self.analytics.record_verdict(self.current_pick_id, resolution, perf_counter() - verdict_started_at)
+        self.history.record_verdict(self.current_level_id, resolution)
+        return True
+
+    def resolve(self, send_type: SendType) -> bool:
+        if send_type == SendType.NOT_SENT:
+            self.rejected_cnt += 1
+        else:
+            self.approved_cnt += 1
+
+        bot_resolution_payload = construct_request_resolution_payload(
+            request_id=self.current_request_id,
+            sent_for=send_type,
+            stream_link=self.get_video_link_with_timecode()
+        )
+
+        return self.resolve_in_bot_and_sheet(send_type.get_apps_script_value(), RequestBotApiEndpoint.RESOLVE_REQUEST, bot_resolution_payload)
+
+    def postpone(self) -> bool:
+        self.later_cnt += 1
+
+        bot_pre_approval_payload = construct_request_pre_approval_payload(
+            request_id=self.current_request_id
+        )
+
+        return self.resolve_in_bot_and_sheet("later", RequestBotApiEndpoint.PRE_APPROVE_REQUEST, bot_pre_approval_payload)
+
+    @records_backend_calls()
+    @traced("app.process_new_responses")
+    def process_new_responses(self) -> None:
+        if self.coordinator:  # The coordinator ingests the form responses
+            return
+
+        try:
+            new_responses, rejected_responses = self.app_script.get_new_responses()
+        except Exception:  # noqa
+            return
+
+        if not new_responses and not rejected_responses:
+            return
+
+        # The responses are cleared even when nothing got queued, otherwise rejected and skipped rows would be read
+        # again on every poll
+        with self.ingestion_lock:
+            if not self.ingest_responses(new_responses, from_form=True):
+                return
+            if rejected_responses:  # Clearing deletes these rows from the sheet, this is the last chance to see them
+                self.report_error(f"Dropped {len(rejected_responses)} form responses without a usable level ID:\n" + "\n".join(response.describe() for response in rejected_responses))
+            try:
+                self.app_script.execute_function(AppsScriptFunction.CLEAR_NEW_RESPONSES)
+            except Exception:  # noqa
+                pass  # It's fine, those responses will get filtered next time because we exclude requests made for the already processed level
+
+    @records_backend_calls()
+    def on_chat_requests(self, chat_requests: list[FormResponse]) -> None:
+        if self.coordinator:
+            try:
+                self.coordinator.submit_responses(chat_requests)
+            except Exception as e:
+                self.report_error(f"Failed to pass chat requests to the coordinator due to the exception: {e}")
+            return
+
+        with self.ingestion_lock:
+            self.ingest_responses(chat_requests, from_form=False)
+
+    @traced("app.ingest_responses")
+    def ingest_responses(self, new_responses: list[FormResponse], from_form: bool) -> bool:
+        # The earliest response for a level wins, so every GD batch slot goes to a distinct level
+        unique_responses = {}
+        for response in new_responses:
+            if response.level_id not in self.caretaker.last_stream_processed_levels:
+                unique_responses.setdefault(response.level_id, response)
+        new_responses = list(unique_responses.values())
+        if not new_responses:
+            return True
+
+        # Submissions are counted once their levels are marked processed, so a failed ingestion that gets retried on
+        # the next poll doesn't count them again
+        source = SubmissionSource.FORM if from_form else SubmissionSource.CHAT
+
+        # Levels that are already queued, have been reviewed recently or are known to be rated are dropped without
+        # asking GD about them
+        retrieved_levels = dict()
+        skipped = set()
+        for response in new_responses:
+            if self.history.get_skip_reason(response.level_id):
+                skipped.add(response.level_id)
+            else:
+                retrieved_levels[response.level_id] = response
+
+        if skipped:
+            self.history.record_submissions(skipped, source)
+            self.caretaker.mark_levels_processed(skipped)
+        if not retrieved_levels:
+            return True
+
+        try:
+            level_data = get_levels(list(retrieved_levels.keys()))
+        except Exception as e:
+            self.report_error(f"Failed to access GD API due to the exception: {e}\nPlease retry")
+            return False
+        self.history.record_gd_checks({level_id: level_data[level_id].grade if level_id in level_data else None for level_id in retrieved_levels})
+
+        if self.showcase_metadata:
+            self.showcase_metadata.prefetch(response.showcase_link for response in retrieved_levels.values())
+
+        queued_requests = []
+        for level_id, response in retrieved_levels.items():
+            level = level_data.get(level_id)
+            if not level or level.grade != LevelGrade.UNRATED:
+                continue
+
+            queued_requests.append(OpenRequest(
+                submission_timestamp=response.submission_timestamp,
+                language=response.language,
+                level_name=level.name,
+                creator=level.author_name,
+                level_id=level_id,
+                stars=level.stars_requested,
+                difficulty=RequestedDifficulty.from_stars(level.stars_requested).value if level.stars_requested else "Unrated",
+                showcase_link=response.showcase_link,
+                length=level.length.name.title()
+            ))
+
+        rows = [
+            [
+                request.submission_timestamp.isoformat(),
+                request.language.value,
+                request.level_name,
+                request.creator,
+                str(request.level_id),
+                str(request.stars) if request.stars else "NA",
+                request.difficulty,
+                request.showcase_link
+            ]
+            for request in queued_requests
+        ]
+
+        try:
+            self.app_script.execute_function(AppsScriptFunction.APPEND_OPEN_REQUESTS, [rows])
+        except Exception as e:
+            self.report_error(f"Failed to access Google Sheets due to the exception: {e}\nPlease retry")
+            return False
+
+        self.history.record_submissions(retrieved_levels.keys(), source)
+        self.history.mark_pending((request.level_id for request in queued_requests), PendingQueue.SHEET)
+        self.caretaker.mark_levels_processed(set(retrieved_levels.keys()))
+
+        if self.on_requests_queued:
+            self.on_requests_queued(queued_requests)
+        return True
+
+    def close(self) -> None:
+        # Closing the panel mid-stream must not keep the leased bot requests away from everyone until the leases expire
+        try:
+            self.bot_request_window.release()
+        except Exception as e:
+            print(f"Failed to release leased bot requests: {e}")
+        self.request_bot.close()
+        if self.coordinator:
+            self.coordinator.close()
+        self.history.close()
+        self.end_analytics_session()  # Closing the panel mid-stream still ends the session
+        self.analytics.close()
+        if self.live_chat_queue:
+            self.live_chat_queue.close()
+        if self.showcase_metadata:
+            self.showcase_metadata.close()
@@ -5,7 +5,12 @@ from enum import StrEnum, IntEnum, Enum, auto
 from time import sleep
 
 import requests
-from datetime import datetime, timedelta
+
+from common_types import Backend
+from paths import GD_RATE_LIMIT_PATH
+from rate_limiter import SharedRateLimiter
+from tracing import TRACER, traced
+from traffic import TRAFFIC
 
 
 class Endpoint(StrEnum):
@@ -105,31 +110,32 @@ class Level:
 
 
 class ApiWrapper:
-    def __init__(self):
-        self.last_api_call: datetime | None = None
-        self.api_call_interval = timedelta(seconds=0.51)
+    def __init__(self, rate_limiter: SharedRateLimiter | None = None):
+        # Boomlings limits the whole host, so the panel, the coordinator and helper scripts share one limiter
+        self.rate_limiter = rate_limiter or SharedRateLimiter(GD_RATE_LIMIT_PATH, interval=0.51)
 
     def perform_request(self, endpoint: Endpoint, data: dict) -> str | None:
-        if self.last_api_call:
-            time_passed = datetime.now() - self.last_api_call
-            remaining_seconds = (self.api_call_interval - time_passed).total_seconds()
-            if remaining_seconds > 0:
+        remaining_seconds = self.rate_limiter.reserve()
+        if remaining_seconds > 0:
+            with TRACER.span("gd.throttle", backend="gd"):
                 sleep(remaining_seconds)
 
         data.update(secret="Wmfd2893gb7")
 
-        response = requests.post(
-            url=endpoint,
-            data=data,
-            headers={"User-Agent": ""}
-        ).text
-
-        self.last_api_call = datetime.now()
+        with TRACER.span("gd.perform_request", backend="gd", endpoint=endpoint.value):
+            response = TRAFFIC.exchange(Backend.GD, endpoint.value, data, lambda: requests.post(
+                url=endpoint,
+                data=data,
+                headers={"User-Agent": ""}
+            ).text)
 
         if response == "-1":
             return None
         return response
 
+    def close(self) -> None:
+        self.rate_limiter.close()
+
 
 API = ApiWrapper()
 
@@ -216,6 +222,7 @@ def _parse_level(level_string: str, *, player_id_to_creator_name_mapping: dict[i
     )
 
 
+@traced("gd.get_levels", backend="gd")
 def get_levels(level_ids: list[int]) -> dict[int, Level]:
     batch_size = 10  # We can't retrieve more than 10 levels per call
 
@@ -235,7 +242,8 @@ def get_levels(level_ids: list[int]) -> dict[int, Level]:
             )
         )
 
-        if not raw_response:
+        if not raw_response:  # None of the levels in the batch exist
+            current_batch_start += batch_size
             continue
 
         response_parts = raw_response.split("#")
@@ -258,6 +266,7 @@ def get_levels(level_ids: list[int]) -> dict[int, Level]:
     return result
 
 
+@traced("gd.get_level", backend="gd")
 def get_level(level_id: int) -> Level | None:
     raw_response = API.perform_request(
         Endpoint.GET_LEVELS,
@@ -1,3 +1,7 @@
+import threading
+from datetime import datetime, timedelta, timezone
+from time import sleep
+
 import google.auth.exceptions
 from google.auth.transport.requests import Request
 from google.oauth2.credentials import Credentials
@@ -13,8 +17,62 @@ AUTH_SCOPES = [
     'https://www.googleapis.com/auth/spreadsheets',
 ]
 
+# Google clients refresh a token lazily once it is less than ~4 minutes from expiring, we do it well before that
+REFRESH_MARGIN = timedelta(minutes=10)
+MAX_REFRESHER_SLEEP_SECONDS = 60.0  # Monotonic waits don't advance while the machine sleeps, so we check the clock often
+REFRESH_RETRY_SECONDS = 30.0
+
+
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)  # google-auth keeps expiry as naive UTC
+
+
+class SharedCredentials(Credentials):
+    # One token for every client and thread: concurrent refreshes are serialized, and a thread that waited for
+    # another one's refresh reuses its result instead of refreshing again
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._refresh_lock = threading.Lock()
+
+    def needs_refresh(self) -> bool:
+        return not self.token or not self.expiry or self.expiry - _utcnow() < REFRESH_MARGIN
+
+    def refresh(self, request) -> None:
+        with self._refresh_lock:
+            if self.valid and not self.needs_refresh():
+                return
+            super().refresh(request)
+            TOKEN_PATH.write_text(self.to_json())
 
-def get_credentials() -> Credentials:
+
+class CredentialRefresher:
+    # Refreshes the credentials in the background ahead of their expiry, so requests made on behalf of button presses
+    # always find a valid token. The lazy refresh of the Google clients stays as a fallback
+    def __init__(self, creds: SharedCredentials):
+        self.creds = creds
+        self._thread = threading.Thread(target=self._run, name="credential-refresher", daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            if self.creds.needs_refresh():
+                try:
+                    self.creds.refresh(Request())
+                except google.auth.exceptions.RefreshError as error:  # The token has been revoked, the next call will tell the user
+                    print(f'Failed to refresh Google credentials: {error}')
+                    return
+                except Exception as error:
+                    print(f'Failed to refresh Google credentials, retrying in {REFRESH_RETRY_SECONDS:.0f}s: {error}')
+                    sleep(REFRESH_RETRY_SECONDS)
+                    continue
+
+            seconds_left = (self.creds.expiry - REFRESH_MARGIN - _utcnow()).total_seconds()
+            sleep(min(max(seconds_left, REFRESH_RETRY_SECONDS), MAX_REFRESHER_SLEEP_SECONDS))
+
+
+def get_credentials() -> SharedCredentials:
     creds = None
 
     if not CLIENT_SECRET_PATH.is_file():
@@ -23,18 +81,18 @@ def get_credentials() -> Credentials:
 
     if TOKEN_PATH.is_file():
         try:
-            creds = Credentials.from_authorized_user_file(str(TOKEN_PATH), AUTH_SCOPES)
-            creds.refresh(Request())
+            creds = SharedCredentials.from_authorized_user_file(str(TOKEN_PATH), AUTH_SCOPES)
+            if not creds.valid or not creds.expiry:  # A token that is still valid is refreshed in the background
+                creds.refresh(Request())
         except google.auth.exceptions.RefreshError as error:
             creds = None
             print(f'An error occurred: {error}')
 
     if not creds or not creds.valid:
-        if creds and creds.expired and creds.refresh_token:
-            creds.refresh(Request())
-        else:
-            flow = InstalledAppFlow.from_client_secrets_file(str(CLIENT_SECRET_PATH), AUTH_SCOPES)
-            creds = flow.run_local_server()
-        TOKEN_PATH.write_text(creds.to_json())
-
-    return creds
\ No newline at end of file
+        flow = InstalledAppFlow.from_client_secrets_file(str(CLIENT_SECRET_PATH), AUTH_SCOPES)
+        flow_creds = flow.run_local_server()
+        TOKEN_PATH.write_text(flow_creds.to_json())
+        creds = SharedCredentials.from_authorized_user_file(str(TOKEN_PATH), AUTH_SCOPES)
+
+    CredentialRefresher(creds).start()
+    return creds
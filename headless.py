@@ -0,0 +1,277 @@
+import argparse
+import shlex
+import statistics
+from dataclasses import dataclass, field
+from pathlib import Path
+from time import perf_counter, sleep
+
+import typing as tp
+
+import gd
+from analytics import AnalyticsStore
+from apps_script import AppsScriptApiWrapper
+from caretaker import Caretaker
+from common_types import BroadcastInfo, SendType
+from engine import StreamEngine
+from local_apps_script import LocalAppsScriptService
+from request_bot import RequestBotApiWrapper
+from submission_history import SubmissionHistory
+from tracing import TRACER
+from traffic import TRAFFIC
+
+
+# Scripts are plain text with one command per line, "#" starts a comment:
+#   start [youtube <video id> | twitch <login>]   start the stream like the "Start Stream" button does
+#   resume [youtube <video id> | twitch <login>]  pick up the stream without the announcements and the form reopening
+#   submit <level id> [showcase link]              add a form response (--local-sheet only)
+#   ingest                                         process new form responses
+#   pick [oldest | random]                         pick the next request
+#   resolve <rejected | starrate | feature | epic | legendary | mythic>
+#   later                                          pre-approve the current request
+#   cycle <count> <verdict>                        pick and resolve <count> requests in a row
+#   sleep <seconds>
+#   end [dump | keep]                              end the stream, dumping the remaining requests to the bot by default
+
+
+class ScriptError(Exception):
+    pass
+
+
+@dataclass
+class SessionReport:
+    durations: dict[str, list[float]] = field(default_factory=dict)
+    errors: list[str] = field(default_factory=list)
+    transitions: int = 0
+
+    def record(self, command: str, duration: float) -> None:
+        self.durations.setdefault(command, []).append(duration)
+
+    def print_summary(self) -> None:
+        total = sum(sum(durations) for durations in self.durations.values())
+        print()
+        print(f"Transitions: {self.transitions}, errors: {len(self.errors)}, total time: {total:.2f}s")
+        print(f"{'Command':<10} {'Runs':>6} {'p50, ms':>9} {'p95, ms':>9} {'Max, ms':>9}")
+        for command, durations in sorted(self.durations.items()):
+            ordered = sorted(durations)
+            p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+            print(f"{command:<10} {len(ordered):>6} {statistics.median(ordered) * 1000:>9.1f} {p95 * 1000:>9.1f} {ordered[-1] * 1000:>9.1f}")
+
+
+class HeadlessSession:
+    def __init__(self, engine: StreamEngine, local_sheet: LocalAppsScriptService | None = None, alternate: bool = False, verbose: bool = True):
+        self.engine = engine
+        self.local_sheet = local_sheet
+        self.alternate = alternate
+        self.verbose = verbose
+        self.pick_oldest = True
+        self.report = SessionReport()
+        engine.report_error = self.on_error
+
+    def on_error(self, message: str) -> None:
+        print(f"ERROR: {message}")
+        self.report.errors.append(message)
+
+    @staticmethod
+    def parse_broadcast(args: list[str]) -> BroadcastInfo | None:
+        match args:
+            case []:
+                return None
+            case ["youtube", video_id]:
+                return BroadcastInfo(video_id, True)
+            case ["twitch", login]:
+                return BroadcastInfo(login, False, login)
+            case _:
+                raise ScriptError(f"Expected 'youtube <video id>' or 'twitch <login>', got {' '.join(args)!r}")
+
+    def get_broadcast(self, args: list[str]) -> BroadcastInfo:
+        broadcast = self.parse_broadcast(args) or self.engine.lookup_broadcast()
+        if not broadcast:
+            raise ScriptError("There is no active livestream on the configured channels")
+        return broadcast
+
+    def pick(self, mode: str | None = None) -> bool:
+        pick_oldest = self.pick_oldest if mode is None else mode == "oldest"
+        picked = self.engine.pick_new_request(pick_oldest)
+        if not picked:
+            return False
+        if self.verbose:
+            print(picked.details.splitlines()[0] + f" (level {picked.request.level_id})")
+        if self.alternate:
+            self.pick_oldest = not pick_oldest
+        self.report.transitions += 1
+        return True
+
+    def resolve(self, verdict: str) -> bool:
+        try:
+            send_type = SendType(verdict)
+        except ValueError:
+            raise ScriptError(f"Unknown verdict {verdict!r}") from None
+        if not self.engine.current_request_id:
+            raise ScriptError("No request has been picked")
+        resolved = self.engine.resolve(send_type)
+        if resolved:
+            self.report.transitions += 1
+        return resolved
+
+    def execute(self, command: str, args: list[str]) -> None:
+        match command, args:
+            case ("start", _):
+                self.engine.start_stream(self.get_broadcast(args))
+            case ("resume", _):
+                self.engine.resume_stream(self.get_broadcast(args))
+            case ("submit", [level_id, *showcase_link]) if len(showcase_link) <= 1:
+                if not self.local_sheet:
+                    raise ScriptError("Responses can only be submitted to the local sheet")
+                self.local_sheet.submit_form_response(level_id, showcase_link=showcase_link[0] if showcase_link else "")
+            case ("ingest", []):
+                self.engine.process_new_responses()
+            case ("pick", [] | ["oldest" | "random"]):
+                self.pick(args[0] if args else None)
+            case ("resolve", [verdict]):
+                self.resolve(verdict)
+            case ("later", []):
+                if self.engine.postpone():
+                    self.report.transitions += 1
+            case ("cycle", [count, verdict]):
+                for _ in range(int(count)):
+                    if not self.pick() or not self.resolve(verdict):
+                        break
+            case ("sleep", [seconds]):
+                sleep(float(seconds))
+            case ("end", [] | ["dump" | "keep"]):
+                self.engine.end_stream(dump=args != ["keep"])
+            case _:
+                raise ScriptError(f"Unknown command {' '.join([command, *args])!r}")
+
+    def run(self, script: str, keep_going: bool = False) -> SessionReport:
+        for line_number, line in enumerate(script.splitlines(), start=1):
+            words = shlex.split(line, comments=True)
+            if not words:
+                continue
+
+            command, args = words[0], words[1:]
+            errors_before = len(self.report.errors)
+            started_at = perf_counter()
+            try:
+                self.execute(command, args)
+            except ScriptError as e:
+                raise ScriptError(f"Line {line_number}: {e}") from None
+            duration = perf_counter() - started_at
+            self.report.record(command, duration)
+            if self.verbose:
+                print(f"[{duration * 1000:9.1f} ms] {line.strip()}")
+
+            if len(self.report.errors) > errors_before and not keep_going:
+                print(f"Stopped at line {line_number}, pass --keep-going to carry on after errors")
+                break
+
+        return self.report
+
+
+def build_engine(
+    bot_url: str | None = None,
+    bot_token: str | None = None,
+    analytics_path: Path = Path(":memory:"),
+    history_path: Path = Path(":memory:"),
+    local_sheet: bool = False,
+    sheet_latency: float = 0.0,
+    sheet_latency_jitter: float = 0.0,
+    seed: int | None = None,
+    anonymous: bool = False,
+    live_chat: bool = False
+) -> tuple[StreamEngine, LocalAppsScriptService | None]:
+    # anonymous skips signing in to Google, for replays where nothing reaches it. live_chat gives the engine the chat
+    # message queue and the showcase metadata cache, like the panel has
+    caretaker = Caretaker.load_detached()
+    caretaker.last_stream_id = None  # Every scripted session starts from scratch
+
+    request_bot = RequestBotApiWrapper(bot_url or caretaker.api_root_url, bot_token or caretaker.api_token)
+    analytics = AnalyticsStore(analytics_path)
+    history = SubmissionHistory(history_path)
+
+    if local_sheet:
+        local_sheet_service = LocalAppsScriptService(latency=sheet_latency, latency_jitter=sheet_latency_jitter, seed=seed)
+        return StreamEngine(caretaker, AppsScriptApiWrapper(service=local_sheet_service), request_bot, analytics, history), local_sheet_service
+
+    from yt import LiveChatMessageQueue, ShowcaseMetadataCache, YoutubeApiWrapper
+
+    if anonymous:
+        from google.auth.credentials import AnonymousCredentials
+        google_creds = AnonymousCredentials()
+    else:
+        from google_auth import get_credentials
+        google_creds = get_credentials()
+    youtube = YoutubeApiWrapper(google_creds)
+    engine = StreamEngine(
+        caretaker,
+        AppsScriptApiWrapper(google_creds),
+        request_bot,
+        analytics,
+        history,
+        youtube=youtube,
+        live_chat_queue=LiveChatMessageQueue(youtube, on_error=lambda e: print(f"Failed to post to the stream chat: {e}")) if live_chat else None,
+        showcase_metadata=ShowcaseMetadataCache(youtube) if live_chat else None
+    )
+    return engine, None
+
+
+def main(argv: tp.Sequence[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Runs a scripted stream session without the UI")
+    parser.add_argument("script", type=Path, help="Session script, see the top of headless.py")
+    parser.add_argument("--local-sheet", action="store_true", help="Use an in-memory spreadsheet instead of Apps Script")
+    parser.add_argument("--sheet-latency", type=float, default=0.0, help="Simulated Apps Script latency, seconds")
+    parser.add_argument("--sheet-latency-jitter", type=float, default=0.0, help="Random extra Apps Script latency, seconds")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--bot-url", help="Request bot API root URL, the one from the settings by default")
+    parser.add_argument("--bot-token", help="Request bot API token, the one from the settings by default")
+    parser.add_argument("--analytics", type=Path, default=Path(":memory:"), help="Analytics database, in-memory by default")
+    parser.add_argument("--history", type=Path, default=Path(":memory:"), help="Submission history database, in-memory by default")
+    parser.add_argument("--alternate", action="store_true", help="Alternate between the oldest and random requests like the panel does")
+    parser.add_argument("--keep-going", action="store_true", help="Don't stop at the first reported error")
+    parser.add_argument("--trace", type=Path, help="Record tracing spans and save them as a Chrome trace")
+    traffic_mode = parser.add_mutually_exclusive_group()
+    traffic_mode.add_argument("--record", type=Path, help="Save every outbound call with its response and latency to this file")
+    traffic_mode.add_argument("--replay", type=Path, help="Answer every outbound call from a recording instead of the network")
+    parser.add_argument("--latency-scale", type=float, default=1.0, help="Multiplier for the recorded latencies during a replay, 0 to skip waiting")
+    arguments = parser.parse_args(argv)
+
+    if arguments.trace:
+        TRACER.enabled = True
+    if arguments.record:
+        TRAFFIC.record_to(arguments.record)
+    elif arguments.replay:
+        TRAFFIC.replay_from(arguments.replay, arguments.latency_scale)
+
+    script = arguments.script.read_text(encoding='utf-8')
+    engine, local_sheet = build_engine(
+        bot_url=arguments.bot_url,
+        bot_token=arguments.bot_token,
+        analytics_path=arguments.analytics,
+        history_path=arguments.history,
+        local_sheet=arguments.local_sheet,
+        sheet_latency=arguments.sheet_latency,
+        sheet_latency_jitter=arguments.sheet_latency_jitter,
+        seed=arguments.seed,
+        anonymous=bool(arguments.replay)
+    )
+    session = HeadlessSession(engine, local_sheet, arguments.alternate)
+
+    try:
+        report = session.run(script, arguments.keep_going)
+    except ScriptError as e:
+        print(f"Script error: {e}")
+        return 2
+    finally:
+        engine.close()
+        TRAFFIC.close()
+        if arguments.trace:
+            TRACER.export_chrome_trace(arguments.trace)
+
+    report.print_summary()
+    print(f"GD API shares: {gd.API.rate_limiter.describe_shares()}")
+    gd.API.close()
+    return 1 if report.errors else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,56 @@
+import re
+import unicodedata
+from dataclasses import dataclass
+
+
+MIN_LEVEL_ID = 128  # Lower IDs belong to the official levels, which are not on the servers
+MAX_LEVEL_ID = 999_999_999  # Way above the newest levels, anything bigger is a phone number or a typo
+
+DIGITS_PATTERN = re.compile(r"^\d+$")
+# Only thousands separators join digit groups ("12 345 678", "12.345.678"), "128 500 11" is several numbers
+GROUPED_DIGITS_PATTERN = re.compile(r"^\d{1,3}([ .,'])\d{3}(?:\1\d{3})*$")
+NUMBER_PATTERN = re.compile(r"(?<!\d)\d{3,}(?!\d)")  # Shorter numbers are star counts, versions etc.
+URL_PATTERN = re.compile(r"https?://\S+|(?:www\.)?(?:youtube\.com|youtu\.be)/\S+")
+GD_URL_PATTERN = re.compile(r"(?:gdbrowser\.com|gdhistory\.com|geometrydash\.com)\S*?(?<!\d)(\d+)(?!\d)")
+
+
+@dataclass
+class RejectedResponse:
+    submitted_at: str
+    raw_level_id: str
+    reason: str
+
+    def describe(self) -> str:
+        return f"{self.submitted_at}: {self.raw_level_id!r} ({self.reason})"
+
+
+def parse_level_id(raw: str) -> int:
+    # Finds the level ID in whatever people type into the ID field: "ID: 12345678", "12 345 678", a GDBrowser link or
+    # full-width digits from a phone keyboard. Raises ValueError with the reason when there is no usable ID
+    text = unicodedata.normalize('NFKC', str(raw)).strip()
+    if not text:
+        raise ValueError("empty")
+
+    if DIGITS_PATTERN.match(text) or GROUPED_DIGITS_PATTERN.match(text):
+        candidates = [re.sub(r"\D", "", text)]
+    else:
+        gd_url_match = GD_URL_PATTERN.search(text)
+        if gd_url_match:
+            candidates = [gd_url_match.group(1)]
+        else:
+            without_urls = URL_PATTERN.sub(" ", text)
+            if not without_urls.strip():
+                raise ValueError("a link instead of a level ID")
+            candidates = list(dict.fromkeys(NUMBER_PATTERN.findall(without_urls)))
+
+    if not candidates:
+        raise ValueError("no level ID found")
+    if len(candidates) > 1:
+        raise ValueError(f"several numbers: {', '.join(candidates)}")
+
+    level_id = int(candidates[0])
+    if level_id < MIN_LEVEL_ID:
+        raise ValueError("too small for an online level")
+    if level_id > MAX_LEVEL_ID:
+        raise ValueError("too big for a level ID")
+    return level_id
@@ -0,0 +1,157 @@
+from __future__ import annotations
+
+import random
+import threading
+from dataclasses import dataclass, field
+from datetime import datetime
+from time import sleep
+
+import typing as tp
+
+from apps_script import AppsScriptFunction
+from common_types import Language
+
+
+@dataclass
+class LocalSheetState:
+    form_open: bool = True
+    fresh_responses: list[list] = field(default_factory=list)
+    open_requests: list[list] = field(default_factory=list)
+    closed_requests: list[list] = field(default_factory=list)
+
+
+class LocalScriptError(Exception):
+    pass
+
+
+class _PendingRun:
+    def __init__(self, service: LocalAppsScriptService, body: dict):
+        self.service = service
+        self.body = body
+
+    def execute(self) -> dict:
+        return self.service.run(self.body)
+
+
+class _ScriptsResource:
+    def __init__(self, service: LocalAppsScriptService):
+        self.service = service
+
+    def run(self, scriptId: str, body: dict) -> _PendingRun:  # noqa
+        return _PendingRun(self.service, body)
+
+
+# Stand-in for the Apps Script service operating on an in-memory copy of the spreadsheet. Pass it as
+# AppsScriptApiWrapper(service=...). Every call sleeps for latency + U(0, latency_jitter), then either raises
+# TimeoutError (timeout_rate), returns a script error (failure_rate) or executes the function
+class LocalAppsScriptService:
+    def __init__(
+        self,
+        latency: float = 0.0,
+        latency_jitter: float = 0.0,
+        failure_rate: float = 0.0,
+        timeout_rate: float = 0.0,
+        seed: int | None = None
+    ):
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.failure_rate = failure_rate
+        self.timeout_rate = timeout_rate
+        self.state = LocalSheetState()
+        self.calls: list[str] = []
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def scripts(self) -> _ScriptsResource:
+        return _ScriptsResource(self)
+
+    def submit_form_response(self, level_id: int | str, language: Language = Language.EN, showcase_link: str = "", submitted_at: datetime | None = None) -> None:
+        timestamp = (submitted_at or datetime.now()).strftime('%m/%d/%Y %H:%M:%S')
+        if language == Language.EN:
+            row = [timestamp, language.value, str(level_id), showcase_link, "", ""]
+        else:
+            row = [timestamp, language.value, "", "", str(level_id), showcase_link]
+        with self._lock:
+            self.state.fresh_responses.append(row)
+
+    def run(self, body: dict) -> dict:
+        func = AppsScriptFunction(body["function"])
+        parameters = body.get("parameters", [])
+
+        delay = self.latency + self._random.uniform(0, self.latency_jitter)
+        if delay > 0:
+            sleep(delay)
+
+        roll = self._random.random()
+        if roll < self.timeout_rate:
+            raise TimeoutError(f"Injected timeout in {func.value}")
+        if roll < self.timeout_rate + self.failure_rate:
+            return self._error_response(f"Injected failure in {func.value}")
+
+        with self._lock:
+            self.calls.append(func.value)
+            try:
+                result = self._dispatch(func, parameters)
+            except LocalScriptError as e:
+                return self._error_response(str(e))
+
+        response = {}
+        if result is not None:
+            response.update(result=result)
+        return dict(done=True, response=response)
+
+    @staticmethod
+    def _error_response(message: str) -> dict:
+        return dict(
+            done=True,
+            error=dict(
+                code=3,
+                message="ScriptError",
+                details=[dict(errorMessage=message, errorType="ScriptError")]
+            )
+        )
+
+    @staticmethod
+    def _to_sheet_timestamp(raw: str) -> str:
+        return datetime.fromisoformat(raw).strftime('%Y-%m-%d %H:%M:%S')
+
+    def _find_open_request_index(self, level_id: int | str) -> int:
+        for i, row in enumerate(self.state.open_requests):
+            if str(row[4]) == str(level_id):
+                return i
+        raise LocalScriptError(f"No open request for level {level_id}")
+
+    def _dispatch(self, func: AppsScriptFunction, parameters: list[tp.Any]) -> tp.Any:
+        state = self.state
+        match func:
+            case AppsScriptFunction.CLOSE_FORM:
+                state.form_open = False
+            case AppsScriptFunction.REOPEN_FORM:
+                state.fresh_responses.clear()
+                state.form_open = True
+            case AppsScriptFunction.GET_RAW_NEW_RESPONSES:
+                return [list(row) for row in state.fresh_responses]
+            case AppsScriptFunction.CLEAR_NEW_RESPONSES:
+                state.fresh_responses.clear()
+            case AppsScriptFunction.APPEND_OPEN_REQUESTS:
+                for row in parameters[0]:
+                    state.open_requests.append([self._to_sheet_timestamp(row[0]), *row[1:]])
+            case AppsScriptFunction.PICK_OPEN_REQUEST:
+                if not state.open_requests:
+                    return []
+                first = parameters[0] if parameters else True
+                return [list(state.open_requests[0] if first else self._random.choice(state.open_requests))]
+            case AppsScriptFunction.RESOLVE_REQUEST:
+                level_id, resolution = parameters
+                row = state.open_requests.pop(self._find_open_request_index(level_id))
+                state.closed_requests.insert(0, [*row, resolution, datetime.now().strftime('%Y-%m-%d %H:%M:%S')])
+            case AppsScriptFunction.CLOSE_REMAINING_OPEN_REQUESTS:
+                will_be_dumped = parameters[0] if parameters else False
+                resolution = "dumped" if will_be_dumped else "closed"
+                remaining = state.open_requests
+                state.open_requests = []
+                resolved_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+                for row in remaining:
+                    state.closed_requests.insert(0, [*row, resolution, resolved_at])
+                return remaining or None
+        return None
@@ -1,271 +1,237 @@
+import threading
+from collections.abc import Callable
 from functools import partial
+from queue import SimpleQueue
 from tkinter import messagebox, Tk, ttk, BooleanVar
 from tkinter.constants import CENTER, LEFT, TOP
 
-import jinja2
-
-from apps_script import AppsScriptApiWrapper, AppsScriptFunction
-from common_types import BroadcastInfo, Language, OpenRequest, SendType
+from analytics import AnalyticsStore
+from broadcast_monitor import BroadcastEvent, BroadcastEventType, BroadcastMonitor
+from chat_intake import LiveChatIntake
+from apps_script import AppsScriptApiWrapper
+from common_types import BroadcastInfo, OpenRequest, SendType
+from coordinator_client import CoordinatorClient
 from component_builder import BasicText, build_button, build_horizontal_centered_frame, build_image, build_option_row, build_tabs, ReadOnlyText
-from gd import get_level, get_levels, LevelGrade, RequestedDifficulty
+from engine import StreamEngine
 from google_auth import get_credentials
-from caretaker import Caretaker
-from request_bot import construct_request_creation_payload, construct_request_pre_approval_payload, construct_request_resolution_payload, Request, RequestBotApiEndpoint, RequestBotApiWrapper
-from yt import YoutubeApiWrapper, YoutubeLiveStreamingDetails
-
+from caretaker import Caretaker, DebouncedSaver
+from queue_preview import QueuePreview
+from paths import ANALYTICS_PATH, RESOURCE_LOG_PATH, SUBMISSION_HISTORY_PATH, TRACE_PATH
+from request_bot import RequestBotApiWrapper
+from resource_monitor import ResourceMonitor
+from submission_history import SubmissionHistory
+from tracing import TRACER
+from traffic import TRAFFIC
+from yt import LiveChatMessageQueue, ShowcaseMetadataCache, YoutubeApiWrapper, YoutubeQuotaMeter
+
+import gd
 import sv_ttk
 import twitch
+import typing as tp
 
 
-def normalize_bot_request(request_from_bot_api: Request) -> OpenRequest | None:
-    try:
-        level = get_level(request_from_bot_api.level_id)
-    except Exception:  # noqa
-        return None
+CHAT_INTAKE_STOP_TIMEOUT_SECONDS = 10.0  # The chat poll in flight may still be ingesting requests
 
-    if not level:
-        return None
 
-    return OpenRequest(
-        submission_timestamp=request_from_bot_api.requested_at,
-        language=Language.from_bot_api_value(request_from_bot_api.language),
-        level_name=level.name,
-        creator=level.author_name,
-        level_id=request_from_bot_api.level_id,
-        stars=level.stars_requested,
-        difficulty=RequestedDifficulty.from_stars(level.stars_requested).value if level.stars_requested else "Unrated",
-        showcase_link=request_from_bot_api.yt_link
-    )
+def split_list_option(raw: str) -> list[str]:
+    return [item.strip() for item in raw.split(",") if item.strip()]
 
 
 class Application:
+    def get_monitored_channels(self) -> tuple[list[str], list[str]]:
+        youtube_channel_ids = [self.caretaker.youtube_channel_id, *self.caretaker.additional_youtube_channel_ids]
+        twitch_logins = [self.caretaker.twitch_login, *self.caretaker.additional_twitch_logins]
+        return youtube_channel_ids, twitch_logins
+
     def get_current_broadcast(self) -> BroadcastInfo | None:
-        try:
-            yt_video_id = self.youtube.get_live_stream_video_id(self.caretaker.youtube_channel_id)
-        except Exception:  # noqa
-            yt_video_id = None
+        live_broadcasts = self.broadcast_monitor.get_live_broadcasts()
+        if live_broadcasts:
+            youtube_channel_ids, twitch_logins = self.get_monitored_channels()
+            channel_priority = [*youtube_channel_ids, *(login.lower() for login in twitch_logins)]
+            return min(live_broadcasts, key=lambda broadcast: channel_priority.index(broadcast.channel) if broadcast.channel in channel_priority else len(channel_priority))
 
-        if yt_video_id:
-            return BroadcastInfo(yt_video_id, True)
+        return self.engine.lookup_broadcast()
 
-        try:
-            twitch_stream_id = twitch.get_stream_id(self.caretaker.twitch_login)
-        except Exception:  # noqa
-            twitch_stream_id = None
+    def on_broadcast_event(self, event: BroadcastEvent) -> None:
+        platform = "YouTube" if event.broadcast.is_youtube else "Twitch"
+
+        if self.engine.is_streaming:
+            if event.type == BroadcastEventType.WENT_OFFLINE and event.broadcast == self.engine.current_broadcast:
+                messagebox.showwarning(None, f"The stream on {platform} ({event.broadcast.channel}) seems to have dropped. Check your streaming software")
+            return
+
+        live_broadcasts = self.broadcast_monitor.get_live_broadcasts()
+        if event.type == BroadcastEventType.WENT_LIVE and event.broadcast == self.caretaker.get_last_broadcast_info():
+            self.engine.resume_stream(event.broadcast)
+            self.shift_to_stream_layout()
+            self.update_chat_intake()
+        elif live_broadcasts:
+            channels = ", ".join(f"{broadcast.channel} ({'YouTube' if broadcast.is_youtube else 'Twitch'})" for broadcast in live_broadcasts)
+            self.broadcast_status_label.config(text=f"Live now: {channels}")
+        else:
+            self.broadcast_status_label.config(text="No active livestreams")
 
-        if twitch_stream_id:
-            return BroadcastInfo(twitch_stream_id, False)
+    def run_on_ui_thread(self, callback: Callable[[], tp.Any]) -> None:
+        self.ui_callbacks.put(callback)
+
+    def on_requests_queued(self, requests: list[OpenRequest]) -> None:
+        if threading.current_thread() is threading.main_thread():
+            self.queue_preview.add(requests)
+        else:
+            self.run_on_ui_thread(partial(self.queue_preview.add, requests))
 
-        return None
+    def show_error(self, message: str) -> None:
+        if threading.current_thread() is threading.main_thread():
+            messagebox.showerror(None, message)
+        else:
+            self.run_on_ui_thread(partial(messagebox.showerror, None, message))
 
-    def get_video_link_with_timecode(self) -> str:
-        if self.current_broadcast.is_youtube and self.current_request_timecode:
-            return f"{self.video_link}&t={self.current_request_timecode + 10}"  # A streamer needs some time to react, find level etc. We'll be more accurate this way
-        return self.video_link
+    def process_ui_callbacks(self) -> None:
+        try:
+            while not self.ui_callbacks.empty():
+                callback = self.ui_callbacks.get()
+                try:
+                    callback()
+                except Exception as e:  # One broken callback must not stop the others from ever running
+                    print(f"Failed to run a UI callback: {e}")
+        finally:
+            self.root.after(100, self.process_ui_callbacks)  # noqa
+
+    def refresh_latency_table(self) -> None:
+        for index, row in enumerate(TRACER.get_latency_table()):
+            values = (row.calls, f"{row.last * 1000:.0f}", f"{row.p50 * 1000:.0f}", f"{row.p95 * 1000:.0f}")
+            if self.latency_table.exists(row.name):
+                self.latency_table.item(row.name, values=values)
+                self.latency_table.move(row.name, '', index)
+            else:
+                self.latency_table.insert('', index, iid=row.name, text=row.name, values=values)
+        self.root.after(1000, self.refresh_latency_table)  # noqa
+
+    def on_export_trace_pressed(self) -> None:
+        try:
+            TRACER.export_chrome_trace(TRACE_PATH)
+        except Exception as e:
+            messagebox.showerror(None, f"Failed to export the trace due to the exception: {e}")
+        else:
+            messagebox.showinfo(None, f"The trace has been saved to {TRACE_PATH}. Open it in chrome://tracing or ui.perfetto.dev")
+
+    def get_resource_counters(self) -> dict[str, float]:
+        return dict(
+            processed_levels=len(self.caretaker.last_stream_processed_levels),
+            queued_requests=len(self.queue_preview.requests),
+            pending_ui_callbacks=self.ui_callbacks.qsize()
+        )
 
     def save_settings(self) -> None:
-        self.caretaker.api_root_url = self.api_root_url_entry.get_text()
-        self.caretaker.api_token = self.token_entry.get_text()
-        self.caretaker.youtube_channel_id = self.youtube_channel_id_entry.get_text()
-        self.caretaker.twitch_login = self.twitch_login_entry.get_text()
-        self.caretaker.form_link = self.form_link_entry.get_text()
-        self.caretaker.spreadsheet_link = self.spreadsheet_link_entry.get_text()
-        self.caretaker.start_announcement_text = self.start_announcement_text_entry.get_text()
-        self.caretaker.end_goodbye_text = self.end_goodbye_text_entry.get_text()
-        self.caretaker.api_root_url = self.api_root_url_entry.get_text()
-
-        self.caretaker.save()
+        changed = self.caretaker.update_settings(
+            api_root_url=self.api_root_url_entry.get_text(),
+            api_token=self.token_entry.get_text(),
+            youtube_channel_id=self.youtube_channel_id_entry.get_text(),
+            twitch_login=self.twitch_login_entry.get_text(),
+            form_link=self.form_link_entry.get_text(),
+            spreadsheet_link=self.spreadsheet_link_entry.get_text(),
+            start_announcement_text=self.start_announcement_text_entry.get_text(),
+            end_goodbye_text=self.end_goodbye_text_entry.get_text(),
+            additional_youtube_channel_ids=split_list_option(self.additional_youtube_channel_ids_entry.get_text()),
+            additional_twitch_logins=split_list_option(self.additional_twitch_logins_entry.get_text()),
+            coordinator_url=self.coordinator_url_entry.get_text().strip(),
+            coordinator_token=self.coordinator_token_entry.get_text()
+        )
+        if not changed:
+            return
+
+        self.settings_saver.schedule()
+
+        self.broadcast_monitor.set_channels(*self.get_monitored_channels())
 
         self.request_bot.root_url = self.caretaker.api_root_url
         self.request_bot.token = self.caretaker.api_token
 
+        if not self.engine.is_streaming:  # Switching coordinators in the middle of a stream would orphan the lease
+            self.update_coordinator()
+
+    def update_coordinator(self) -> None:
+        if self.engine.coordinator:
+            self.engine.coordinator.close()
+        if self.caretaker.coordinator_url:
+            self.engine.coordinator = CoordinatorClient(self.caretaker.coordinator_url, self.caretaker.coordinator_token)
+        else:
+            self.engine.coordinator = None
+
     def on_tab_changed(self, event) -> None:
         if event.widget.tab('current')['text'] != 'Options':
             self.save_settings()
 
-    def on_exit(self, _) -> None:
+    def shutdown(self) -> None:
         if self.destroyed:
             return
         self.save_settings()
-        self.destroyed = True
-
-    def perform_stream_startup_routine(self) -> None:
-        try:
-            self.app_script.execute_function(AppsScriptFunction.REOPEN_FORM)
-        except Exception as e:
-            messagebox.showerror(None, f"Failed to reopen the form due to the exception: {e}\nYou might have to do it manually")
-
-        substitutions = dict(
-            video_link=self.video_link,
-            form_link=self.caretaker.form_link,
-            spreadsheet_link=self.caretaker.spreadsheet_link
-        )
-        announcement_text = jinja2.Template(self.caretaker.start_announcement_text).render(substitutions)
-
-        try:
-            self.request_bot.post(
-                endpoint=RequestBotApiEndpoint.SEND_STREAM_START_MESSAGE,
-                payload=dict(
-                    text=announcement_text
-                )
-            )
-        except Exception as e:
-            messagebox.showerror(None, f"Failed to access bot api due to the exception: {e}\nStream announcement has not been sent, you might have to do it manually")
-
-        if self.yt_live_streaming_details and self.yt_live_streaming_details.live_chat_id:
+        self.settings_saver.flush()
+        # The producers feeding the engine stop first, so nothing reaches it once it's closed
+        self.broadcast_monitor.stop()
+        if self.chat_intake:
+            self.chat_intake.stop(timeout=CHAT_INTAKE_STOP_TIMEOUT_SECONDS)
+            self.chat_intake = None
+        self.engine.close()
+        TRAFFIC.close()
+        if self.resource_monitor:
+            self.resource_monitor.print_summary()
+            self.resource_monitor.close()
+        if self.resource_monitor or TRACER.enabled:  # Usage stats are diagnostics like the ones above
+            print(f"YouTube API quota used: {self.youtube.quota.units_used} units {self.youtube.quota.units_by_method}")
+            print(f"GD API shares: {gd.API.rate_limiter.describe_shares()}")
+        gd.API.close()
+        if TRACER.enabled:
             try:
-                self.youtube.post_message_to_live_chat(self.yt_live_streaming_details.live_chat_id, self.caretaker.form_link)
+                TRACER.export_chrome_trace(TRACE_PATH)
             except Exception as e:
-                messagebox.showerror(None, f"Failed to send form link to stream chat due to the exception: {e}\nYou might have to do it manually")
-        else:
-            self.resend_form_link_btn.config(state='disabled')
+                print(f"Failed to export the trace: {e}")
+        self.destroyed = True
+        self.root.destroy()
 
     def shift_to_stream_layout(self) -> None:
-        if self.current_broadcast.is_youtube:
-            self.video_link = f"https://www.youtube.com/watch?v={self.current_broadcast.video_id}"
-            try:
-                self.yt_live_streaming_details = self.youtube.get_live_streaming_details(self.current_broadcast.video_id)
-            except Exception as e:
-                self.yt_live_streaming_details = None
-                messagebox.showerror(None, f"Failed to get the stream chat due to the exception: {e}\nYou will have to send form link manually when needed")
-        else:
-            self.video_link = f"https://www.twitch.tv/{self.caretaker.twitch_login}"
-            self.yt_live_streaming_details = None
+        if not self.engine.has_live_chat():
+            self.resend_form_link_btn.config(state='disabled')
 
-        self.start_stream_btn.pack_forget()
+        self.broadcast_status_label.place_forget()
+        self.start_stream_btn.place_forget()
         self.streaming_mode_frame.pack(side=TOP, expand=True, fill='both')
 
+        # Every stream starts with an empty preview. The coordinator ingests the requests in its mode, so this panel
+        # never learns about them and the preview is hidden
+        self.queue_preview.clear()
+        if self.engine.coordinator:
+            self.queue_preview.pack_forget()
+        else:
+            self.queue_preview.pack(side=TOP, expand=True, fill='both', pady=5)
+
     def on_start_stream_pressed(self) -> None:
-        self.current_broadcast = self.get_current_broadcast()
+        broadcast = self.get_current_broadcast()
 
-        if self.current_broadcast:
+        if broadcast:
+            self.engine.start_stream(broadcast)
             self.shift_to_stream_layout()
-            if self.current_broadcast != self.caretaker.get_last_broadcast_info():
-                self.perform_stream_startup_routine()
-                self.caretaker.last_stream_id = self.current_broadcast.video_id
-                self.caretaker.last_stream_is_youtube = self.current_broadcast.is_youtube
-                self.caretaker.last_stream_processed_levels = set()
-                self.caretaker.save()
+            self.update_chat_intake()
         else:
             messagebox.showerror(None, "There is no active livestream on the selected channel. Did you specify channel ID in the Options tab correctly?")
 
     def on_end_stream_pressed(self) -> None:
-        try:
-            self.app_script.execute_function(AppsScriptFunction.CLOSE_FORM)
-        except Exception as e:
-            messagebox.showerror(None, f"Failed to close the form due to the exception: {e}\nYou might have to do it manually")
-
-        self.process_new_responses()
-
-        dump = self.dump_remaining_requests_var.get()
-
-        try:
-            remaining_requests = self.app_script.close_remaining_requests(dump)
-        except Exception as e:
-            messagebox.showerror(None, f"Failed to close remaining requests in Google Sheets due to the exception: {e}\nYou might have to do it manually")
-            remaining_requests = []
-
-        if dump:
-            try:
-                self.request_bot.post(
-                    RequestBotApiEndpoint.CREATE_REQUEST_BATCH,
-                    [
-                        construct_request_creation_payload(request, self.video_link)
-                        for request in remaining_requests
-                        if request.level_id != self.current_level_id
-                    ]
-                )
-            except Exception as e:
-                messagebox.showerror(None, f"Failed to access bot api due to the exception: {e}\nSome requests might have not been dumped")
-
-        try:
-            self.request_bot.post(
-                endpoint=RequestBotApiEndpoint.SEND_STREAM_END_MESSAGE,
-                payload=dict(
-                    text=self.caretaker.end_goodbye_text,
-                    not_reviewed=len(remaining_requests),
-                    approved=self.approved_cnt,
-                    rejected=self.rejected_cnt,
-                    later=self.later_cnt
-                )
-            )
-        except Exception as e:
-            messagebox.showerror(None, f"Failed to access bot api due to the exception: {e}")
-
-        self.root.destroy()
+        self.engine.end_stream(self.dump_remaining_requests_var.get())
+        self.queue_preview.clear()
+        self.shutdown()
 
     def pick_new_request(self) -> bool:
-        self.current_request_timecode = None
-        self.current_request_id = None
-        self.current_level_id = None
-
-        self.process_new_responses()
-
         pick_oldest = self.pick_oldest_var.get()
-        try:
-            picked_request = self.app_script.pick_open_request(pick_oldest)
-        except Exception:  # noqa
-            picked_request = None
-
-        is_from_bot = False
-        if not picked_request:
-            try:
-                bot_request = self.request_bot.pick_request(pick_oldest)
-            except Exception as e:
-                messagebox.showerror(None, f"Failed to access bot api due to the exception: {e}")
-                return False
-            else:
-                if bot_request:
-                    self.current_request_id = bot_request.id
-                    is_from_bot = True
-                    picked_request = normalize_bot_request(bot_request)
-
-        if not picked_request:
-            messagebox.showerror(None, "No requests yet!")
+        picked = self.engine.pick_new_request(pick_oldest)
+        if not picked:
             return False
 
-        self.current_level_id = picked_request.level_id
-
-        if not self.current_request_id:
-            try:
-                self.current_request_id = self.request_bot.post(
-                    RequestBotApiEndpoint.CREATE_REQUEST,
-                    construct_request_creation_payload(
-                        picked_request,
-                        self.get_video_link_with_timecode()
-                    )
-                )
-            except Exception as e:
-                messagebox.showerror(None, f"Failed to access bot api due to the exception: {e}")
-                return False
-
-        header = f"Request {self.current_request_id}"
-        if is_from_bot:
-            header += " (FROM BOT!)"
-
-        if picked_request.stars:
-            difficulty_explanation = f"requested {picked_request.stars} stars/moons"
-        else:
-            difficulty_explanation = "stars/moons were not requested"
-
-        details_lines = [
-            header,
-            f"Language: {picked_request.language.get_spreadsheet_value()}",
-            f"ID: {picked_request.level_id}",
-            f"Level: {picked_request.level_name} by {picked_request.creator}",
-            f"Difficulty: {picked_request.difficulty} ({difficulty_explanation})",
-            f"Showcase: {picked_request.showcase_link or 'Not provided'}",
-            f"Submitted: {picked_request.submission_timestamp}",
-        ]
-
-        self.request_details_entry.set_text("\n".join(details_lines))
+        self.request_details_entry.set_text(picked.details)
+        self.queue_preview.remove(picked.request.level_id)
 
         if self.alternate_var.get():
             self.pick_oldest_var.set(not pick_oldest)
 
-        if self.yt_live_streaming_details:
-            self.current_request_timecode = self.yt_live_streaming_details.get_current_duration_in_seconds()
-
         return True
 
     def shift_to_non_first_request_mode(self) -> None:
@@ -316,28 +282,7 @@ class Application:
     def on_opinion_btn_pressed(self, send_type: SendType) -> None:
         self.initiate_waiting()
 
-        if send_type == SendType.NOT_SENT:
-            self.rejected_cnt += 1
-        else:
-            self.approved_cnt += 1
-
-        try:
-            self.request_bot.post(
-                endpoint=RequestBotApiEndpoint.RESOLVE_REQUEST,
-                payload=construct_request_resolution_payload(
-                    request_id=self.current_request_id,
-                    sent_for=send_type,
-                    stream_link=self.get_video_link_with_timecode()
-                )
-            )
-        except Exception as e:
-            messagebox.showerror(None, f"Failed to access bot api due to the exception: {e}")
-            return
-
-        try:
-            self.app_script.execute_function(AppsScriptFunction.RESOLVE_REQUEST, [self.current_level_id, send_type.get_apps_script_value()])
-        except Exception as e:
-            messagebox.showerror(None, f"Failed to access Google Sheets due to the exception: {e}. You should mark the request as resolved manually")
+        if not self.engine.resolve(send_type):
             return
 
         self.pick_new_request_and_unlock(is_first=False)
@@ -345,114 +290,70 @@ class Application:
     def on_later_pressed(self) -> None:
         self.initiate_waiting()
 
-        self.later_cnt += 1
-
-        try:
-            self.request_bot.post(
-                endpoint=RequestBotApiEndpoint.PRE_APPROVE_REQUEST,
-                payload=construct_request_pre_approval_payload(
-                    request_id=self.current_request_id
-                )
-            )
-        except Exception as e:
-            messagebox.showerror(None, f"Failed to access bot api due to the exception: {e}")
-            return
-
-        try:
-            self.app_script.execute_function(AppsScriptFunction.RESOLVE_REQUEST, [self.current_level_id, "later"])
-        except Exception as e:
-            messagebox.showerror(None, f"Failed to access Google Sheets due to the exception: {e}. You should mark the request as resolved manually")
+        if not self.engine.postpone():
             return
 
         self.pick_new_request_and_unlock(is_first=False)
 
     def on_resend_form_link_pressed(self) -> None:
-        if self.yt_live_streaming_details and self.yt_live_streaming_details.live_chat_id:
-            try:
-                self.youtube.post_message_to_live_chat(self.yt_live_streaming_details.live_chat_id, self.caretaker.form_link)
-            except Exception as e:
-                messagebox.showerror(None, f"Failed to send form link to stream chat due to the exception: {e}\nYou might have to do it manually")
-
-    def on_clear_queue_pressed(self) -> None:
-        try:
-            self.app_script.execute_function(AppsScriptFunction.REOPEN_FORM)
-        except Exception as e:
-            messagebox.showerror(None, f"Failed to reopen the form due to the exception: {e}\nYou might have to do it manually")
-
-    def process_new_responses(self) -> None:
-        try:
-            new_responses = self.app_script.get_new_responses()
-        except Exception:  # noqa
-            return
-
-        retrieved_levels = dict()
-        for response in new_responses:
-            if response.level_id not in self.caretaker.last_stream_processed_levels:
-                retrieved_levels[response.level_id] = response
-        if not retrieved_levels:
-            return
-
-        try:
-            level_data = get_levels(list(retrieved_levels.keys()))
-        except Exception as e:
-            messagebox.showerror(None, f"Failed to access GD API due to the exception: {e}\nPlease retry")
-            return
-        rows = []
-
-        for level_id, response in retrieved_levels.items():
-            level = level_data.get(level_id)
-            if not level or level.grade != LevelGrade.UNRATED:
-                continue
-
-            rows.append([
-                response.submission_timestamp.isoformat(),
-                response.language.value,
-                level.name,
-                level.author_name,
-                str(level_id),
-                str(level.stars_requested) if level.stars_requested else "NA",
-                RequestedDifficulty.from_stars(level.stars_requested).value if level.stars_requested else "Unrated",
-                response.showcase_link
-            ])
-
-        try:
-            self.app_script.execute_function(AppsScriptFunction.APPEND_OPEN_REQUESTS, [rows])
-        except Exception as e:
-            messagebox.showerror(None, f"Failed to access Google Sheets due to the exception: {e}\nPlease retry")
+        self.engine.resend_form_link()
+
+    def on_live_chat_message_failed(self, e: Exception) -> None:
+        self.run_on_ui_thread(partial(messagebox.showerror, None, f"Failed to send form link to stream chat due to the exception: {e}\nYou might have to do it manually"))
+
+    def on_youtube_quota_running_low(self, units_used: int, daily_limit: int) -> None:
+        self.run_on_ui_thread(partial(messagebox.showwarning, None, f"{units_used} of {daily_limit} daily YouTube API quota units have already been used"))
+
+    def update_chat_intake(self) -> None:
+        live_chat_id = self.engine.yt_live_streaming_details.live_chat_id if self.engine.has_live_chat() else None
+        if self.chat_intake_var.get() and live_chat_id:
+            if not self.chat_intake:
+                intake = LiveChatIntake(self.youtube, live_chat_id, self.engine.on_chat_requests)
+                intake.on_stopped = lambda reason: self.run_on_ui_thread(partial(self.on_chat_intake_stopped, intake, reason))
+                intake.start()
+                self.chat_intake = intake
+        elif self.chat_intake:
+            self.chat_intake.stop()
+            self.chat_intake = None
+
+    def on_chat_intake_stopped(self, intake: LiveChatIntake, reason: str) -> None:
+        if intake is not self.chat_intake or self.destroyed:  # Stopped on purpose
             return
+        self.chat_intake = None
+        self.chat_intake_var.set(False)
+        messagebox.showwarning(None, f"Stopped taking requests from the stream chat: {reason}")
 
-        try:
-            self.app_script.execute_function(AppsScriptFunction.CLEAR_NEW_RESPONSES)
-        except Exception:  # noqa
-            pass  # It's fine, those responses will get filtered next time because we exclude requests made for the already processed level
-
-        self.caretaker.last_stream_processed_levels |= set(retrieved_levels.keys())
-        self.caretaker.save()
+    def on_clear_queue_pressed(self) -> None:
+        self.engine.reopen_form()
 
     def __init__(self) -> None:
         self.destroyed = False
+        self.ui_callbacks: SimpleQueue[Callable[[], tp.Any]] = SimpleQueue()
         self.caretaker = Caretaker.load()
+        self.settings_saver = DebouncedSaver(self.caretaker)
 
-        # Will be updated on the startup
-        self.current_broadcast: BroadcastInfo | None = None
-
-        # Will be defined once the "Start Stream" btn is pressed
-        self.video_link: str | None = None
-        self.yt_live_streaming_details: YoutubeLiveStreamingDetails | None = None
-
-        # Will be defined once the first request is picked and updated with every new request
-        self.current_request_timecode: int | None = None
-        self.current_request_id: int | None = None
-        self.current_level_id: int | None = None
+        self.chat_intake: LiveChatIntake | None = None
 
-        self.approved_cnt = 0
-        self.rejected_cnt = 0
-        self.later_cnt = 0
+        # Set RBCP_RESOURCE_MONITOR=1 to log resource usage every minute and catch leaks during long streams
+        self.resource_monitor_interval = ResourceMonitor.get_interval_from_environment()
+        self.resource_monitor = ResourceMonitor(RESOURCE_LOG_PATH, expected_growth=("processed_levels",)) if self.resource_monitor_interval else None
 
         google_creds = get_credentials()
-        self.app_script = AppsScriptApiWrapper(google_creds)
-        self.youtube = YoutubeApiWrapper(google_creds)
+        self.youtube = YoutubeApiWrapper(google_creds, YoutubeQuotaMeter(on_warning=self.on_youtube_quota_running_low))
         self.request_bot = RequestBotApiWrapper(self.caretaker.api_root_url, self.caretaker.api_token)
+        self.engine = StreamEngine(
+            caretaker=self.caretaker,
+            app_script=AppsScriptApiWrapper(google_creds),
+            request_bot=self.request_bot,
+            analytics=AnalyticsStore(ANALYTICS_PATH),
+            history=SubmissionHistory(SUBMISSION_HISTORY_PATH),
+            youtube=self.youtube,
+            live_chat_queue=LiveChatMessageQueue(self.youtube, on_error=self.on_live_chat_message_failed),
+            showcase_metadata=ShowcaseMetadataCache(self.youtube),
+            report_error=self.show_error
+        )
+        self.update_coordinator()
+        self.broadcast_monitor = BroadcastMonitor(self.youtube, twitch.CLIENT, on_event=lambda event: self.run_on_ui_thread(partial(self.on_broadcast_event, event)))
 
         self.root = Tk()
 
@@ -466,6 +367,8 @@ class Application:
 
         self.start_stream_btn = ttk.Button(self.stream_tab, text="Start Stream", command=self.on_start_stream_pressed, state='disabled')
         self.start_stream_btn.place(relx=0.5, rely=0.5, anchor=CENTER)
+        self.broadcast_status_label = ttk.Label(self.stream_tab, text="Looking for active livestreams...")
+        self.broadcast_status_label.place(relx=0.5, rely=0.42, anchor=CENTER)
 
         self.api_root_url_entry = build_option_row(self.options_tab, option_name='API Root URL', initial_value=self.caretaker.api_root_url)
         self.token_entry = build_option_row(self.options_tab, option_name='API Token', initial_value=self.caretaker.api_token, is_secret=True)
@@ -473,6 +376,10 @@ class Application:
         self.twitch_login_entry = build_option_row(self.options_tab, option_name='Twitch Login', initial_value=self.caretaker.twitch_login)
         self.form_link_entry = build_option_row(self.options_tab, option_name='Form Link', initial_value=self.caretaker.form_link)
         self.spreadsheet_link_entry = build_option_row(self.options_tab, option_name='Spreadsheet Link', initial_value=self.caretaker.spreadsheet_link)
+        self.additional_youtube_channel_ids_entry = build_option_row(self.options_tab, option_name='Co-host YouTube IDs', initial_value=", ".join(self.caretaker.additional_youtube_channel_ids))
+        self.additional_twitch_logins_entry = build_option_row(self.options_tab, option_name='Co-host Twitch Logins', initial_value=", ".join(self.caretaker.additional_twitch_logins))
+        self.coordinator_url_entry = build_option_row(self.options_tab, option_name='Coordinator URL', initial_value=self.caretaker.coordinator_url)
+        self.coordinator_token_entry = build_option_row(self.options_tab, option_name='Coordinator Token', initial_value=self.caretaker.coordinator_token, is_secret=True)
 
         self.start_announcement_text_entry = BasicText(self.start_announcement_tab, self.caretaker.start_announcement_text)
         self.start_announcement_text_entry.pack(side=LEFT, expand=True, fill='both')
@@ -519,24 +426,50 @@ class Application:
         self.resend_form_link_btn.pack(side=LEFT, padx=5)
         self.clear_queue_btn = ttk.Button(self.special_actions_row, text="Clear Queue", command=self.on_clear_queue_pressed)
         self.clear_queue_btn.pack(side=LEFT, padx=5)
+        self.chat_intake_var = BooleanVar(value=False)  # Opt-in, reading the chat costs ~900 quota units per hour
+        self.chat_intake_checkbox = ttk.Checkbutton(self.special_actions_row, text="Take requests from chat", variable=self.chat_intake_var, command=self.update_chat_intake)
+        self.chat_intake_checkbox.pack(side=LEFT, padx=5)
+
+        self.queue_preview = QueuePreview(self.streaming_mode_frame)
+        self.queue_preview.pack(side=TOP, expand=True, fill='both', pady=5)
+        self.engine.on_requests_queued = self.on_requests_queued
+
+        if TRACER.enabled:  # Set RBCP_TRACE=1 to time every step of the stream actions
+            self.latency_tab, = build_tabs(self.tab_control, ['Latency'])
+            self.latency_table = ttk.Treeview(self.latency_tab, columns=('calls', 'last', 'p50', 'p95'))
+            self.latency_table.heading('#0', text='Operation')
+            self.latency_table.heading('calls', text='Calls')
+            self.latency_table.heading('last', text='Last, ms')
+            self.latency_table.heading('p50', text='p50, ms')
+            self.latency_table.heading('p95', text='p95, ms')
+            self.latency_table.column('#0', width=320)
+            for column in ('calls', 'last', 'p50', 'p95'):
+                self.latency_table.column(column, width=80, anchor=CENTER)
+            self.latency_table.pack(side=TOP, expand=True, fill='both')
+            self.export_trace_btn = ttk.Button(self.latency_tab, text="Export Chrome Trace", command=self.on_export_trace_pressed)
+            self.export_trace_btn.pack(side=TOP, pady=5)
 
         self.tab_control.pack(expand=True, fill='both')
 
         sv_ttk.set_theme("light")
 
         self.tab_control.bind('<<NotebookTabChanged>>', self.on_tab_changed)
-        self.root.bind('<Destroy>', self.on_exit)
+        self.root.protocol('WM_DELETE_WINDOW', self.shutdown)  # Unlike <Destroy>, fires once and while the widgets are still alive
 
     def on_startup(self) -> None:
-        self.current_broadcast = self.get_current_broadcast()
-        if self.current_broadcast and self.current_broadcast == self.caretaker.get_last_broadcast_info():
-            self.shift_to_stream_layout()
-        else:
-            self.start_stream_btn.config(state='normal')
+        self.broadcast_monitor.set_channels(*self.get_monitored_channels())
+        self.broadcast_monitor.start()
+        self.start_stream_btn.config(state='normal')
 
     def run(self) -> None:
         self.root.after(100, self.on_startup)  # noqa
+        self.root.after(100, self.process_ui_callbacks)  # noqa
+        if TRACER.enabled:
+            self.root.after(1000, self.refresh_latency_table)  # noqa
+        if self.resource_monitor:
+            self.resource_monitor.schedule(self.root, self.resource_monitor_interval, self.get_resource_counters)
         self.root.mainloop()
 
 
-Application().run()
\ No newline at end of file
+if __name__ == "__main__":
+    Application().run()
\ No newline at end of file
@@ -5,6 +5,13 @@ from appdirs import user_config_dir
 
 CONFIG_DIR_PATH = Path(user_config_dir("RequestBotControlPanel"))
 CONFIG_PATH = CONFIG_DIR_PATH / 'settings.json'
+STATE_PATH = CONFIG_DIR_PATH / 'state.sqlite3'
+ANALYTICS_PATH = CONFIG_DIR_PATH / 'analytics.sqlite3'
+SUBMISSION_HISTORY_PATH = CONFIG_DIR_PATH / 'submission_history.sqlite3'
+COORDINATOR_HISTORY_PATH = CONFIG_DIR_PATH / 'coordinator_history.sqlite3'
+TRACE_PATH = CONFIG_DIR_PATH / 'trace.json'
+GD_RATE_LIMIT_PATH = CONFIG_DIR_PATH / 'gd_rate_limit.bin'
+RESOURCE_LOG_PATH = CONFIG_DIR_PATH / 'resources.jsonl'
 TOKEN_PATH = CONFIG_DIR_PATH / 'token.json'
 CLIENT_SECRET_PATH = CONFIG_DIR_PATH / 'client_secret.json'
 TMP_CLIENT_SECRET_SEARCH_PATH = Path("client_secret.json")
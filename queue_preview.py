@@ -0,0 +1,124 @@
+import tkinter as tk
+import tkinter.ttk as ttk
+from bisect import bisect_left, insort
+from datetime import datetime
+from enum import StrEnum
+from functools import partial
+from tkinter.constants import CENTER, LEFT, RIGHT, TOP
+
+import typing as tp
+
+from common_types import OpenRequest
+from gd import LevelLength
+
+
+class QueueColumn(StrEnum):
+    SUBMITTED = "submitted"
+    LEVEL = "level"
+    DIFFICULTY = "difficulty"
+    LENGTH = "length"
+    LANGUAGE = "language"
+
+
+SORTABLE_COLUMNS = (QueueColumn.SUBMITTED, QueueColumn.DIFFICULTY, QueueColumn.LENGTH, QueueColumn.LANGUAGE)
+COLUMN_TITLES = {
+    QueueColumn.SUBMITTED: "Submitted",
+    QueueColumn.LEVEL: "Level",
+    QueueColumn.DIFFICULTY: "Difficulty",
+    QueueColumn.LENGTH: "Length",
+    QueueColumn.LANGUAGE: "Language",
+}
+
+
+def get_sort_key(request: OpenRequest, column: QueueColumn) -> tuple:
+    # Requests that compare equal on the column stay ordered by age
+    match column:
+        case QueueColumn.DIFFICULTY:
+            primary = request.stars or 0
+        case QueueColumn.LENGTH:
+            primary = LevelLength[request.length.upper()].value if request.length else -1
+        case QueueColumn.LANGUAGE:
+            primary = request.language.value
+        case _:
+            primary = 0
+    return primary, request.submission_timestamp, request.level_id
+
+
+class QueuePreview(ttk.Frame):
+    # The open requests this panel knows about, in a Treeview that only renders the visible rows. Updates are applied
+    # one row at a time: new requests are inserted at their sorted position, so continuous ingestion never redraws
+    # the whole list. Only clicking a column heading reorders everything
+    def __init__(self, parent: tk.Misc):
+        super().__init__(parent)
+        self.requests: dict[int, OpenRequest] = {}
+        self.taken_levels: set[int] = set()  # Picked before the ingestion that queued them reached the UI
+        self.sort_column = QueueColumn.SUBMITTED
+        self.descending = False
+        self._order: list[tuple] = []  # Sort keys in ascending order, the tree shows them reversed when descending
+
+        self.count_label = ttk.Label(self, text="Queue is empty")
+        self.count_label.pack(side=TOP, anchor='w')
+
+        self.tree = ttk.Treeview(self, columns=tuple(QueueColumn), show='headings', selectmode='none', height=8)
+        for column in QueueColumn:
+            command = partial(self.sort_by, column) if column in SORTABLE_COLUMNS else ""
+            self.tree.heading(column, text=COLUMN_TITLES[column], command=command)
+            self.tree.column(column, width=320 if column == QueueColumn.LEVEL else 100, anchor=CENTER, stretch=column == QueueColumn.LEVEL)
+        self.scrollbar = ttk.Scrollbar(self, orient='vertical', command=self.tree.yview)
+        self.tree.configure(yscrollcommand=self.scrollbar.set)
+        self.scrollbar.pack(side=RIGHT, fill='y')
+        self.tree.pack(side=LEFT, expand=True, fill='both')
+        self._update_headings()
+
+    def _get_position(self, index: int) -> int:
+        return len(self._order) - 1 - index if self.descending else index
+
+    def add(self, requests: tp.Iterable[OpenRequest]) -> None:
+        for request in requests:
+            if request.level_id in self.requests or request.level_id in self.taken_levels:
+                continue
+            self.requests[request.level_id] = request
+
+            key = get_sort_key(request, self.sort_column)
+            insort(self._order, key)
+            self.tree.insert('', self._get_position(bisect_left(self._order, key)), iid=str(request.level_id), values=(
+                request.submission_timestamp.strftime('%H:%M:%S') if request.submission_timestamp.date() == datetime.now().date() else str(request.submission_timestamp),
+                f"{request.level_name} by {request.creator} ({request.level_id})",
+                request.difficulty,
+                request.length or "",
+                request.language.get_spreadsheet_value()
+            ))
+        self._update_count()
+
+    def remove(self, level_id: int) -> None:
+        self.taken_levels.add(level_id)
+        request = self.requests.pop(level_id, None)
+        if not request:
+            return
+
+        del self._order[bisect_left(self._order, get_sort_key(request, self.sort_column))]
+        self.tree.delete(str(level_id))
+        self._update_count()
+
+    def clear(self) -> None:
+        self.requests.clear()
+        self.taken_levels.clear()
+        self._order.clear()
+        self.tree.delete(*self.tree.get_children())
+        self._update_count()
+
+    def sort_by(self, column: QueueColumn) -> None:
+        self.descending = not self.descending if column == self.sort_column else False
+        self.sort_column = column
+        self._order = sorted(get_sort_key(request, column) for request in self.requests.values())
+        for index, key in enumerate(reversed(self._order) if self.descending else self._order):
+            self.tree.move(str(key[-1]), '', index)
+        self._update_headings()
+
+    def _update_headings(self) -> None:
+        for column in SORTABLE_COLUMNS:
+            arrow = (" ▼" if self.descending else " ▲") if column == self.sort_column else ""
+            self.tree.heading(column, text=COLUMN_TITLES[column] + arrow)
+
+    def _update_count(self) -> None:
+        self.count_label.config(text=f"{len(self.requests)} requests in the queue" if self.requests else "Queue is empty")
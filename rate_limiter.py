@@ -0,0 +1,161 @@
+import os
+import struct
+import threading
+from dataclasses import dataclass
+from pathlib import Path
+from time import sleep, time
+
+import typing as tp
+
+if os.name == 'nt':
+    import msvcrt
+else:
+    import fcntl
+
+
+# The state file starts with the time the next call is allowed at and the number of granted calls, followed by a fixed
+# table of the processes that used the limiter recently
+HEADER = struct.Struct("<dq")
+PROCESS_ENTRY = struct.Struct("<qqdd")  # pid, calls, seconds waited, last call time
+PROCESS_SLOTS = 32
+STATE_SIZE = HEADER.size + PROCESS_SLOTS * PROCESS_ENTRY.size
+STALE_PROCESS_SECONDS = 10 * 60
+MAX_RESERVATION_AHEAD_SECONDS = 60.0  # Anything further means the wall clock has been turned back
+
+
+@dataclass
+class ProcessShare:
+    pid: int
+    calls: int
+    waited_seconds: float
+    last_call_at: float
+    share: float
+
+    def describe(self) -> str:
+        return f"pid {self.pid}: {self.calls} calls ({self.share:.0%}), waited {self.waited_seconds:.1f}s"
+
+
+class _FileLock:
+    def __init__(self, file: tp.BinaryIO):
+        self.file = file
+
+    def __enter__(self) -> None:
+        if os.name == 'nt':
+            self.file.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(self.file.fileno(), msvcrt.LK_NBLCK, 1)
+                    return
+                except OSError:
+                    sleep(0.005)
+        else:
+            fcntl.flock(self.file.fileno(), fcntl.LOCK_EX)
+
+    def __exit__(self, *args: tp.Any) -> None:
+        if os.name == 'nt':
+            self.file.seek(0)
+            msvcrt.locking(self.file.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            fcntl.flock(self.file.fileno(), fcntl.LOCK_UN)
+
+
+class SharedRateLimiter:
+    # Spaces calls at least interval seconds apart across every process of the host that uses the same state file.
+    # Callers reserve the next free slot under a short file lock and wait for it without holding the lock, so the
+    # slots are handed out in the order they were asked for. If the state file can't be used we fall back to spacing
+    # the calls of this process only
+    def __init__(self, path: Path, interval: float):
+        self.path = path
+        self.interval = interval
+        self._file: tp.BinaryIO | None = None
+        self._is_shared = True
+        self._next_local_slot = 0.0
+        self._lock = threading.Lock()
+
+    def _open(self) -> tp.BinaryIO | None:
+        if self._file or not self._is_shared:
+            return self._file
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self.path.touch(exist_ok=True)
+            file = open(self.path, 'r+b')
+            with _FileLock(file):
+                file.seek(0, os.SEEK_END)
+                if file.tell() < STATE_SIZE:
+                    file.write(b"\0" * (STATE_SIZE - file.tell()))
+                    file.flush()
+            self._file = file
+        except OSError as e:
+            print(f"Failed to open the shared rate limit state, only calls of this process will be spaced: {e}")
+            self._is_shared = False
+        return self._file
+
+    def _read_state(self) -> tuple[float, int, list[tuple[int, int, float, float]]]:
+        self._file.seek(0)
+        raw = self._file.read(STATE_SIZE)
+        next_slot, total_calls = HEADER.unpack_from(raw)
+        entries = [PROCESS_ENTRY.unpack_from(raw, HEADER.size + i * PROCESS_ENTRY.size) for i in range(PROCESS_SLOTS)]
+        return next_slot, total_calls, entries
+
+    def _write_state(self, next_slot: float, total_calls: int, entries: list[tuple[int, int, float, float]]) -> None:
+        self._file.seek(0)
+        self._file.write(HEADER.pack(next_slot, total_calls) + b"".join(PROCESS_ENTRY.pack(*entry) for entry in entries))
+        self._file.flush()
+
+    def reserve(self) -> float:
+        # Returns how long the caller has to wait before making its call
+        with self._lock:
+            now = time()
+            file = self._open()
+            if not file:
+                slot = max(now, self._next_local_slot)
+                self._next_local_slot = slot + self.interval
+                return slot - now
+
+            with _FileLock(file):
+                next_slot, total_calls, entries = self._read_state()
+                if next_slot - now > MAX_RESERVATION_AHEAD_SECONDS:
+                    next_slot = now
+                slot = max(now, next_slot)
+                delay = slot - now
+
+                pid = os.getpid()
+                index = next((i for i, entry in enumerate(entries) if entry[0] == pid), None)
+                if index is None:  # Take the slot of the process that has been idle for the longest time
+                    index = min(range(PROCESS_SLOTS), key=lambda i: entries[i][3])
+                    entries[index] = (pid, 0, 0.0, 0.0)
+                _, calls, waited, _ = entries[index]
+                entries[index] = (pid, calls + 1, waited + delay, slot)
+
+                self._write_state(slot + self.interval, total_calls + 1, entries)
+            return delay
+
+    def get_shares(self) -> list[ProcessShare]:
+        with self._lock:
+            file = self._open()
+            if not file:
+                return []
+            with _FileLock(file):
+                _, _, entries = self._read_state()
+
+        now = time()
+        active = [entry for entry in entries if entry[0] and now - entry[3] < STALE_PROCESS_SECONDS]
+        total = sum(entry[1] for entry in active) or 1
+        return sorted(
+            (ProcessShare(pid, calls, waited, last_call_at, calls / total) for pid, calls, waited, last_call_at in active),
+            key=lambda share: share.calls,
+            reverse=True
+        )
+
+    def describe_shares(self) -> str:
+        shares = self.get_shares()
+        if not shares:
+            return "no calls recently"
+        pid = os.getpid()
+        return ", ".join(share.describe() + (" (this process)" if share.pid == pid else "") for share in shares)
+
+    def close(self) -> None:
+        with self._lock:
+            if self._file:
+                self._file.close()
+                self._file = None
@@ -1,11 +1,21 @@
-from dataclasses import dataclass
-from datetime import datetime
+import random
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
 from enum import StrEnum
+from http import HTTPStatus
+from time import sleep
 
 import requests
 from pydantic import BaseModel
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
 
-from common_types import OpenRequest, SendType
+from common_types import Backend, Language, OpenRequest, SendType
+from gd import get_level, get_levels, Level, RequestedDifficulty
+from tracing import TRACER
+from traffic import TRAFFIC
 
 
 class RequestBotApiEndpoint(StrEnum):
@@ -17,6 +27,8 @@ class RequestBotApiEndpoint(StrEnum):
     CREATE_REQUEST_BATCH = "/request/create_batch"
     GET_RANDOM_REQUEST = "/request/random"
     GET_OLDEST_REQUEST = "/request/oldest"
+    LEASE_REQUESTS = "/request/lease"
+    RELEASE_REQUESTS = "/request/release"
 
 
 class Request(BaseModel):
@@ -57,13 +69,112 @@ def construct_request_pre_approval_payload(request_id: int) -> dict:
     return dict(request_id=request_id)
 
 
+def construct_request_lease_payload(count: int, oldest: bool, lease_seconds: int) -> dict:
+    return dict(
+        count=count,
+        oldest=oldest,
+        lease_seconds=lease_seconds
+    )
+
+
+def construct_request_release_payload(request_ids: list[int]) -> dict:
+    return dict(request_ids=request_ids)
+
+
+def build_open_request_from_bot_request(request_from_bot_api: Request, level: Level) -> OpenRequest:
+    return OpenRequest(
+        submission_timestamp=request_from_bot_api.requested_at,
+        language=Language.from_bot_api_value(request_from_bot_api.language),
+        level_name=level.name,
+        creator=level.author_name,
+        level_id=request_from_bot_api.level_id,
+        stars=level.stars_requested,
+        difficulty=RequestedDifficulty.from_stars(level.stars_requested).value if level.stars_requested else "Unrated",
+        showcase_link=request_from_bot_api.yt_link
+    )
+
+
+def normalize_bot_request(request_from_bot_api: Request) -> OpenRequest | None:
+    try:
+        level = get_level(request_from_bot_api.level_id)
+    except Exception:  # noqa
+        return None
+
+    if not level:
+        return None
+
+    return build_open_request_from_bot_request(request_from_bot_api, level)
+
+
+def normalize_bot_requests(requests_from_bot_api: list[Request]) -> tuple[list[OpenRequest], list[Request]]:
+    # Resolves all the levels through batched GD calls. Network errors are propagated, levels that don't exist are returned as unresolved
+    levels = get_levels(list(dict.fromkeys(request.level_id for request in requests_from_bot_api)))
+
+    normalized = []
+    unresolved = []
+    for request in requests_from_bot_api:
+        level = levels.get(request.level_id)
+        if level:
+            normalized.append(build_open_request_from_bot_request(request, level))
+        else:
+            unresolved.append(request)
+
+    return normalized, unresolved
+
+
 Json = list | dict | int | float | bool | str | None
 
 
+CONNECT_TIMEOUT = 3.05
+DEFAULT_READ_TIMEOUT = 10.0
+ENDPOINT_READ_TIMEOUTS: dict[RequestBotApiEndpoint, float] = {
+    RequestBotApiEndpoint.SEND_STREAM_START_MESSAGE: 20.0,
+    RequestBotApiEndpoint.SEND_STREAM_END_MESSAGE: 20.0,
+    RequestBotApiEndpoint.CREATE_REQUEST_BATCH: 30.0,
+}
+
+BATCH_CHUNK_SIZE = 25
+BATCH_MAX_ATTEMPTS = 3
+BATCH_RETRY_BACKOFF_SECONDS = 1.0
+NOT_APPLIED_STATUS_CODES = {HTTPStatus.TOO_MANY_REQUESTS, HTTPStatus.SERVICE_UNAVAILABLE}
+
+
+@dataclass
+class BatchCreationResult:
+    created: dict[int, OpenRequest]  # By the ID of the bot request
+    failed: list[OpenRequest]  # Refused by the bot or never delivered
+    unconfirmed: list[OpenRequest]  # The call broke off after it was sent, the bot may have created them
+
+
+def is_safe_to_resend(e: Exception) -> bool:
+    # Only failures that happened before the bot could create anything, resending anything else may create duplicates
+    if isinstance(e, requests.HTTPError):
+        return e.response is not None and e.response.status_code in NOT_APPLIED_STATUS_CODES
+    if isinstance(e, requests.ConnectTimeout):
+        return True
+    reason = getattr(e.args[0], "reason", None) if isinstance(e, requests.ConnectionError) and e.args else None
+    return isinstance(reason, NewConnectionError)
+
+
+def is_rejected_by_bot(e: Exception) -> bool:
+    return isinstance(e, requests.HTTPError) and e.response is not None and 400 <= e.response.status_code < 500 and e.response.status_code not in NOT_APPLIED_STATUS_CODES
+
+
 @dataclass
 class RequestBotApiWrapper:
     root_url: str
     token: str
+    max_concurrent_requests: int = 4
+    read_timeouts: dict[RequestBotApiEndpoint, float] = field(default_factory=lambda: dict(ENDPOINT_READ_TIMEOUTS))
+    session: requests.Session = field(init=False, repr=False)
+    executor: ThreadPoolExecutor = field(init=False, repr=False)
+
+    def __post_init__(self) -> None:
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.max_concurrent_requests)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.executor = ThreadPoolExecutor(max_workers=self.max_concurrent_requests, thread_name_prefix="request-bot")
 
     def _get_url(self, endpoint: RequestBotApiEndpoint) -> str:
         return self.root_url.removesuffix("/") + endpoint
@@ -71,21 +182,226 @@ class RequestBotApiWrapper:
     def _get_headers(self) -> dict[str, str]:
         return {"x-key": self.token}
 
-    def post(self, endpoint: RequestBotApiEndpoint, payload: dict | list) -> Json:
-        return requests.post(
+    def _get_timeout(self, endpoint: RequestBotApiEndpoint) -> tuple[float, float]:
+        return CONNECT_TIMEOUT, self.read_timeouts.get(endpoint, DEFAULT_READ_TIMEOUT)
+
+    def _send(self, method: str, endpoint: RequestBotApiEndpoint, payload: dict | list | None = None) -> Json:
+        response = self.session.request(
+            method=method,
             url=self._get_url(endpoint),
             json=payload,
-            headers=self._get_headers()
-        ).json()
+            headers=self._get_headers(),
+            timeout=self._get_timeout(endpoint)
+        )
+        response.raise_for_status()
+        return response.json()
+
+    def post(self, endpoint: RequestBotApiEndpoint, payload: dict | list) -> Json:
+        with TRACER.span(f"request_bot.post {endpoint.value}", backend="request_bot", endpoint=endpoint.value):
+            return TRAFFIC.exchange(Backend.REQUEST_BOT, f"POST {endpoint.value}", payload, lambda: self._send("POST", endpoint, payload))
 
     def get(self, endpoint: RequestBotApiEndpoint) -> Json:
-        return requests.get(
-            url=self._get_url(endpoint),
-            headers=self._get_headers()
-        ).json()
+        with TRACER.span(f"request_bot.get {endpoint.value}", backend="request_bot", endpoint=endpoint.value):
+            return TRAFFIC.exchange(Backend.REQUEST_BOT, f"GET {endpoint.value}", None, lambda: self._send("GET", endpoint))
+
+    def post_async(self, endpoint: RequestBotApiEndpoint, payload: dict | list) -> Future[Json]:
+        return self.executor.submit(self.post, endpoint, payload)
+
+    def get_async(self, endpoint: RequestBotApiEndpoint) -> Future[Json]:
+        return self.executor.submit(self.get, endpoint)
+
+    def create_requests(self, requests_to_create: list[OpenRequest], placeholder_yt_link: str, chunk_size: int = BATCH_CHUNK_SIZE) -> BatchCreationResult:
+        # The bot answers a batch with the ID of every created request, or null for the ones it refused. A batch it
+        # rejects as a whole has created nothing, so its items are sent one by one to find out which of them it refuses
+        result = BatchCreationResult(created={}, failed=[], unconfirmed=[])
+        pending = [(requests_to_create[i:i + chunk_size], 0) for i in range(0, len(requests_to_create), chunk_size)]
+
+        while pending:
+            retry_attempt = max(attempt for _, attempt in pending)
+            if retry_attempt:
+                sleep(BATCH_RETRY_BACKOFF_SECONDS * 2 ** (retry_attempt - 1))
+
+            in_flight = [
+                (chunk, attempt, self.post_async(RequestBotApiEndpoint.CREATE_REQUEST_BATCH, [construct_request_creation_payload(request, placeholder_yt_link) for request in chunk]))
+                for chunk, attempt in pending
+            ]
+
+            pending = []
+            for chunk, attempt, future in in_flight:
+                try:
+                    request_ids = future.result()
+                except Exception as e:
+                    if is_safe_to_resend(e) and attempt + 1 < BATCH_MAX_ATTEMPTS:
+                        pending.append((chunk, attempt + 1))
+                    elif is_rejected_by_bot(e) and len(chunk) > 1:
+                        pending.extend(([request], 0) for request in chunk)
+                    elif is_safe_to_resend(e) or is_rejected_by_bot(e):
+                        result.failed.extend(chunk)
+                    else:
+                        result.unconfirmed.extend(chunk)
+                    continue
+
+                if not isinstance(request_ids, list) or len(request_ids) != len(chunk):
+                    result.unconfirmed.extend(chunk)
+                    continue
+                for request, request_id in zip(chunk, request_ids):
+                    if request_id:
+                        result.created[request_id] = request
+                    else:
+                        result.failed.append(request)
+
+        return result
+
+    def close(self) -> None:
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.session.close()
 
     def pick_request(self, oldest: bool) -> Request | None:
         raw_request = self.get(RequestBotApiEndpoint.GET_OLDEST_REQUEST if oldest else RequestBotApiEndpoint.GET_RANDOM_REQUEST)
         if not raw_request:
             return None
-        return Request.model_validate(raw_request)
\ No newline at end of file
+        return Request.model_validate(raw_request)
+
+    def lease_requests(self, count: int, oldest: bool, lease_seconds: int) -> list[Request]:
+        raw_requests = self.post(RequestBotApiEndpoint.LEASE_REQUESTS, construct_request_lease_payload(count, oldest, lease_seconds))
+        return [Request.model_validate(raw_request) for raw_request in raw_requests or []]
+
+    def release_requests(self, request_ids: list[int]) -> None:
+        self.post(RequestBotApiEndpoint.RELEASE_REQUESTS, construct_request_release_payload(request_ids))
+
+
+RELEASE_REFILL_WAIT_SECONDS = 15.0
+
+
+@dataclass
+class LeasedRequest:
+    request: Request
+    open_request: OpenRequest
+    lease_expires_at: datetime
+
+
+class BotRequestWindow:
+    # Keeps a few leased bot requests so that picks are served locally. Leased requests are not handed out by the bot
+    # to anyone else until the lease expires or they get resolved / released. Both picking modes share the pool: the
+    # oldest pick takes the oldest leased request, the random one any of them, and a refill leases with the mode of
+    # the pick that ran the pool low
+    def __init__(self, bot: RequestBotApiWrapper, size: int = 10, lease_seconds: int = 30 * 60):
+        self.bot = bot
+        self.size = size
+        self.lease_seconds = lease_seconds
+        self.leases_supported = True
+        self._pool: list[LeasedRequest] = []
+        self._unresolvable_ids: list[int] = []
+        self._refill: Future | None = None
+        self._lock = threading.Lock()
+
+    def _lease(self, oldest: bool) -> None:
+        leased_at = datetime.now()
+        with self._lock:
+            missing = self.size - len(self._pool)
+        if missing <= 0:
+            return
+
+        leased = self.bot.lease_requests(missing, oldest, self.lease_seconds)
+        if not leased:
+            return
+
+        try:
+            normalized, unresolved = normalize_bot_requests(leased)
+        except Exception:
+            # Nobody would hand these out again before the lease expires, so they go back to the bot right away
+            try:
+                self.bot.release_requests([request.id for request in leased])
+            except Exception as e:
+                print(f"Failed to release the leased bot requests: {e}")
+            raise
+        resolved = [request for request in leased if not any(request is unresolved_request for unresolved_request in unresolved)]
+        expires_at = leased_at + timedelta(seconds=self.lease_seconds)
+
+        with self._lock:
+            self._pool.extend(
+                LeasedRequest(request, open_request, expires_at)
+                for request, open_request in zip(resolved, normalized)
+            )
+            self._unresolvable_ids.extend(request.id for request in unresolved)
+
+    def _ensure_refill(self, oldest: bool) -> Future:
+        with self._lock:
+            if not self._refill or self._refill.done():
+                self._refill = self.bot.executor.submit(self._lease, oldest)
+            return self._refill
+
+    def _take(self, oldest: bool) -> LeasedRequest | None:
+        # Leases that are about to expire may be handed to someone else mid-review, so we skip them
+        deadline = datetime.now() + timedelta(minutes=1)
+        with self._lock:
+            self._pool = [leased for leased in self._pool if leased.lease_expires_at > deadline]
+            if not self._pool:
+                return None
+            if oldest:
+                leased = min(self._pool, key=lambda item: item.request.requested_at or item.request.created_at)
+            else:
+                leased = random.choice(self._pool)
+            self._pool.remove(leased)
+            return leased
+
+    def _pick_without_lease(self, oldest: bool) -> tuple[Request, OpenRequest | None] | None:
+        bot_request = self.bot.pick_request(oldest)
+        if not bot_request:
+            return None
+        return bot_request, normalize_bot_request(bot_request)
+
+    def pick(self, oldest: bool) -> tuple[Request, OpenRequest | None] | None:
+        if not self.leases_supported:
+            return self._pick_without_lease(oldest)
+
+        leased = self._take(oldest)
+        if not leased:
+            try:
+                self._ensure_refill(oldest).result()
+            except requests.HTTPError as e:
+                if e.response is None or e.response.status_code != 404:
+                    raise
+                print("Bot API doesn't support request leases, falling back to picking requests one by one")
+                self.leases_supported = False
+                return self._pick_without_lease(oldest)
+            leased = self._take(oldest)
+            if not leased:
+                return None
+
+        with self._lock:
+            running_low = len(self._pool) < self.size // 2
+        if running_low:
+            self._ensure_refill(oldest)
+
+        return leased.request, leased.open_request
+
+    def take_level(self, level_id: int) -> Request | None:
+        # Takes the leased request for the level out of the window, so it can be reviewed along with the same level
+        # picked from the sheet instead of coming up again later
+        with self._lock:
+            for leased in self._pool:
+                if leased.open_request.level_id == level_id:
+                    self._pool.remove(leased)
+                    return leased.request
+        return None
+
+    def get_pooled_requests(self) -> list[OpenRequest]:
+        with self._lock:
+            return [leased.open_request for leased in self._pool]
+
+    def release(self) -> None:
+        # A refill still in flight would add leases after we gave the rest back, so we let it land first
+        refill = self._refill
+        if refill:
+            try:
+                refill.result(timeout=RELEASE_REFILL_WAIT_SECONDS)
+            except Exception:  # noqa
+                pass
+
+        with self._lock:
+            request_ids = [leased.request.id for leased in self._pool] + self._unresolvable_ids
+            self._pool = []
+            self._unresolvable_ids = []
+        if request_ids:
+            self.bot.release_requests(request_ids)
\ No newline at end of file
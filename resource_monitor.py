@@ -0,0 +1,168 @@
+from __future__ import annotations
+
+import json
+import os
+import threading
+import tkinter as tk
+import tracemalloc
+from collections import deque
+from dataclasses import asdict, dataclass, field
+from datetime import datetime
+from pathlib import Path
+
+import typing as tp
+
+try:
+    import psutil
+except ImportError:  # Optional, without it RSS and sockets are only measured on Linux
+    psutil = None
+
+
+GROWTH_WINDOW = 6  # Samples a metric has to keep growing for to get flagged
+GROWTH_MIN_RATIO = 0.05
+TOP_ALLOCATIONS = 5
+DEFAULT_INTERVAL_SECONDS = 60.0
+
+
+def get_rss_bytes() -> int | None:
+    if psutil:
+        return psutil.Process().memory_info().rss
+    try:
+        return int(Path("/proc/self/statm").read_text().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def count_open_sockets() -> int | None:
+    if psutil:
+        process = psutil.Process()
+        return len(process.net_connections() if hasattr(process, "net_connections") else process.connections())
+    try:
+        descriptors = os.listdir("/proc/self/fd")
+    except OSError:
+        return None
+    sockets = 0
+    for descriptor in descriptors:
+        try:
+            sockets += os.readlink(f"/proc/self/fd/{descriptor}").startswith("socket:")
+        except OSError:  # Closed while we were looking
+            pass
+    return sockets
+
+
+def count_tk_objects(root: tk.Misc) -> dict[str, int]:
+    widgets = 0
+    pending = [root]
+    while pending:
+        widget = pending.pop()
+        widgets += 1
+        pending.extend(widget.winfo_children())
+    return dict(tk_widgets=widgets, tk_images=len(root.tk.call('image', 'names')))
+
+
+@dataclass
+class ResourceSample:
+    taken_at: str
+    metrics: dict[str, float]
+    top_allocations: list[str] = field(default_factory=list)
+    growing: list[str] = field(default_factory=list)
+
+
+class ResourceMonitor:
+    # Samples memory, sockets, threads and whatever counters the caller passes, appends every sample to a JSON lines
+    # log and flags metrics that kept growing over the last GROWTH_WINDOW samples. Allocation stats come from
+    # tracemalloc and show the lines that allocated the most since the first sample. Counters that grow with the work
+    # done, like the processed levels, are passed as expected_growth: they are still sampled but never flagged
+    def __init__(self, log_path: Path | None, trace_allocations: bool = True, expected_growth: tp.Iterable[str] = ()):
+        self.log_path = log_path
+        self.trace_allocations = trace_allocations
+        self.expected_growth = set(expected_growth)
+        self.samples: list[ResourceSample] = []
+        self.flagged: set[str] = set()
+        self._history: dict[str, deque[float]] = {}
+        self._baseline: tracemalloc.Snapshot | None = None
+        self._lock = threading.Lock()
+        if trace_allocations and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    @classmethod
+    def get_interval_from_environment(cls) -> float | None:
+        # RBCP_RESOURCE_MONITOR=1 samples every minute, any other number sets the interval in seconds
+        raw = os.environ.get("RBCP_RESOURCE_MONITOR")
+        if not raw:
+            return None
+        return DEFAULT_INTERVAL_SECONDS if raw == "1" else float(raw)
+
+    def _get_top_allocations(self) -> list[str]:
+        snapshot = tracemalloc.take_snapshot().filter_traces([tracemalloc.Filter(False, tracemalloc.__file__)])
+        if not self._baseline:
+            self._baseline = snapshot
+            return [str(statistic) for statistic in snapshot.statistics('lineno')[:TOP_ALLOCATIONS]]
+        return [str(statistic) for statistic in snapshot.compare_to(self._baseline, 'lineno')[:TOP_ALLOCATIONS]]
+
+    def _update_growth(self, metrics: dict[str, float]) -> list[str]:
+        growing = []
+        for name, value in metrics.items():
+            if name in self.expected_growth:
+                continue
+            history = self._history.setdefault(name, deque(maxlen=GROWTH_WINDOW))
+            history.append(value)
+            if len(history) < GROWTH_WINDOW:
+                continue
+            values = list(history)
+            if all(a <= b for a, b in zip(values, values[1:])) and values[-1] > values[0] * (1 + GROWTH_MIN_RATIO):
+                growing.append(name)
+        return growing
+
+    def sample(self, counters: dict[str, float] | None = None) -> ResourceSample:
+        metrics = dict(threads=threading.active_count())
+        for name, value in (("rss_bytes", get_rss_bytes()), ("open_sockets", count_open_sockets())):
+            if value is not None:
+                metrics[name] = value
+        top_allocations = []
+        if self.trace_allocations:
+            metrics["traced_bytes"] = tracemalloc.get_traced_memory()[0]
+            top_allocations = self._get_top_allocations()
+        metrics.update(counters or {})
+
+        with self._lock:
+            growing = self._update_growth(metrics)
+            sample = ResourceSample(datetime.now().isoformat(timespec='seconds'), metrics, top_allocations, growing)
+            self.samples.append(sample)
+            for name in growing:
+                if name not in self.flagged:
+                    print(f"Resource monitor: {name} has been growing for {GROWTH_WINDOW} samples in a row, now {metrics[name]:,.0f}")
+            self.flagged.update(growing)
+
+            if self.log_path:
+                with self.log_path.open('a', encoding='utf-8') as file:
+                    file.write(json.dumps(asdict(sample), ensure_ascii=False) + "\n")
+        return sample
+
+    def print_summary(self) -> None:
+        if not self.samples:
+            return
+        first, last = self.samples[0].metrics, self.samples[-1].metrics
+        print(f"Resources over {len(self.samples)} samples:")
+        for name, value in last.items():
+            marker = "  <- kept growing" if name in self.flagged else "  (grows by design)" if name in self.expected_growth else ""
+            print(f"  {name:<20} {first.get(name, 0):>16,.0f} -> {value:>16,.0f}{marker}")
+        if self.samples[-1].top_allocations:
+            print("Top allocation growth:")
+            for line in self.samples[-1].top_allocations:
+                print(f"  {line}")
+
+    def close(self) -> None:
+        if self.trace_allocations and tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+    def schedule(self, root: tk.Misc, interval: float, get_counters: tp.Callable[[], dict[str, float]]) -> None:
+        # Sampling runs on the UI thread, where Tk objects can be counted
+        def sample_and_reschedule() -> None:
+            try:
+                self.sample(count_tk_objects(root) | get_counters())
+            except Exception as e:
+                print(f"Failed to sample resources: {e}")
+            root.after(int(interval * 1000), sample_and_reschedule)  # noqa
+
+        root.after(int(interval * 1000), sample_and_reschedule)  # noqa
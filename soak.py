@@ -0,0 +1,130 @@
+import argparse
+import itertools
+import random
+from pathlib import Path
+from time import perf_counter
+from urllib.parse import urlsplit
+
+import typing as tp
+
+import gd
+from common_types import SendType
+from headless import build_engine, HeadlessSession
+from request_bot import RequestBotApiEndpoint
+from resource_monitor import ResourceMonitor
+from traffic import TRAFFIC
+
+
+# Drives thousands of ingest / pick / resolve transitions through the headless engine with the sheet, the bot and GD
+# all answered in-process, and samples resources along the way:
+#   python soak.py --transitions 20000 --log soak.jsonl
+
+SOAK_PLAYER_ID = 5
+FIRST_LEVEL_ID = 10_000_000
+VERDICTS = [send_type.value for send_type in SendType]
+
+
+class LocalBotResponse:
+    def __init__(self, body: tp.Any):
+        self.body = body
+
+    def raise_for_status(self) -> None:
+        pass
+
+    def json(self) -> tp.Any:
+        return self.body
+
+
+class LocalRequestBotSession:
+    # Stands in for the requests session of RequestBotApiWrapper and answers like a bot with an empty queue
+    def __init__(self):
+        self._request_ids = itertools.count(1)
+
+    def request(self, method: str, url: str, json: tp.Any = None, headers: dict | None = None, timeout: tp.Any = None) -> LocalBotResponse:  # noqa
+        match RequestBotApiEndpoint(urlsplit(url).path):
+            case RequestBotApiEndpoint.CREATE_REQUEST:
+                return LocalBotResponse(next(self._request_ids))
+            case RequestBotApiEndpoint.CREATE_REQUEST_BATCH:
+                return LocalBotResponse([next(self._request_ids) for _ in json])
+            case RequestBotApiEndpoint.LEASE_REQUESTS:
+                return LocalBotResponse([])
+            case RequestBotApiEndpoint.GET_OLDEST_REQUEST | RequestBotApiEndpoint.GET_RANDOM_REQUEST:
+                return LocalBotResponse(None)
+        return LocalBotResponse({})
+
+    def close(self) -> None:
+        pass
+
+
+class LocalGdApi:
+    # Answers GD level searches with unrated levels whose length and requested stars depend on the ID
+    def perform_request(self, endpoint: gd.Endpoint, data: dict) -> str | None:
+        level_strings = [
+            f"1:{level_id}:2:Soak {level_id}:6:{SOAK_PLAYER_ID}:9:0:13:22:15:{int(level_id) % 5}:17:0:18:0:19:0:25:0:30:0:39:{int(level_id) % 10 + 1}:42:0:43:0"
+            for level_id in data["str"].split(",")
+        ]
+        return "|".join(level_strings) + f"#{SOAK_PLAYER_ID}:Soak Creator:{SOAK_PLAYER_ID}"
+
+
+def build_cycle_script(level_ids: list[int], rng: random.Random) -> str:
+    lines = [f"submit {level_id}" for level_id in level_ids] + ["ingest"]
+    for _ in level_ids:
+        lines.append("pick")
+        lines.append("later" if rng.random() < 0.1 else f"resolve {rng.choice(VERDICTS)}")
+    return "\n".join(lines)
+
+
+def main(argv: tp.Sequence[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Runs a long simulated stream and watches for resource leaks")
+    parser.add_argument("--transitions", type=int, default=5000, help="Picks and verdicts to go through")
+    parser.add_argument("--batch", type=int, default=20, help="Form responses submitted before each ingestion")
+    parser.add_argument("--sample-every", type=int, default=500, help="Transitions between resource samples")
+    parser.add_argument("--log", type=Path, help="Append every resource sample to this JSON lines file")
+    parser.add_argument("--no-tracemalloc", action="store_true", help="Skip allocation tracing, which slows Python down a lot")
+    parser.add_argument("--sheet-latency", type=float, default=0.0, help="Simulated Apps Script latency, seconds")
+    parser.add_argument("--seed", type=int, default=0)
+    arguments = parser.parse_args(argv)
+
+    engine, local_sheet = build_engine(bot_url="http://local-bot", bot_token="", local_sheet=True, sheet_latency=arguments.sheet_latency, seed=arguments.seed)
+    engine.request_bot.session = LocalRequestBotSession()
+    gd.API = LocalGdApi()
+
+    # Every transition submits a fresh level, so these counters grow with the run, not with a leak
+    monitor = ResourceMonitor(arguments.log, trace_allocations=not arguments.no_tracemalloc, expected_growth=("processed_levels", "history_levels"))
+    session = HeadlessSession(engine, local_sheet, alternate=True, verbose=False)
+    rng = random.Random(arguments.seed)
+    level_ids = itertools.count(FIRST_LEVEL_ID)
+
+    def get_counters() -> dict[str, float]:
+        return dict(
+            processed_levels=len(engine.caretaker.last_stream_processed_levels),
+            history_levels=len(engine.history),
+            open_requests=len(local_sheet.state.open_requests)
+        )
+
+    started_at = perf_counter()
+    session.run("resume twitch soak")
+    monitor.sample(get_counters())
+    next_sample_at = arguments.sample_every
+    while session.report.transitions < arguments.transitions:
+        session.run(build_cycle_script([next(level_ids) for _ in range(arguments.batch)], rng), keep_going=True)
+        if session.report.transitions >= next_sample_at:
+            monitor.sample(get_counters())
+            next_sample_at += arguments.sample_every
+    session.run("end keep")
+    elapsed = perf_counter() - started_at
+
+    monitor.sample(get_counters())
+    engine.close()
+    TRAFFIC.close()
+    monitor.close()
+
+    session.report.print_summary()
+    print(f"{session.report.transitions / elapsed:.0f} transitions per second")
+    print()
+    monitor.print_summary()
+    return 1 if session.report.errors else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,70 @@
+import json
+from array import array
+import sqlite3
+import threading
+from pathlib import Path
+
+import typing as tp
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS settings (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS processed_levels (
+    level_id INTEGER PRIMARY KEY
+);
+"""
+
+
+class StateStore:
+    def __init__(self, path: Path, read_only: bool = False):
+        if read_only:  # Neither creates nor migrates anything, the store of a running panel may be open next to it
+            self.connection = sqlite3.connect(f"{path.resolve().as_uri()}?mode=ro", uri=True, isolation_level=None, check_same_thread=False)
+        else:
+            self.connection = sqlite3.connect(str(path), isolation_level=None, check_same_thread=False)
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("PRAGMA synchronous=NORMAL")
+            self.connection.executescript(SCHEMA)
+        self._lock = threading.Lock()
+
+    def _write(self, statement: str, rows: tp.Iterable[tuple]) -> None:
+        with self._lock:
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                self.connection.executemany(statement, rows)
+            except BaseException:
+                self.connection.execute("ROLLBACK")
+                raise
+            self.connection.execute("COMMIT")
+
+    def load_settings(self) -> dict[str, tp.Any]:
+        with self._lock:
+            rows = self.connection.execute("SELECT key, value FROM settings").fetchall()
+        return {key: json.loads(value) for key, value in rows}
+
+    def save_settings(self, settings: dict[str, tp.Any]) -> None:
+        self._write(
+            "INSERT INTO settings (key, value) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+            [(key, json.dumps(value, ensure_ascii=False)) for key, value in settings.items()]
+        )
+
+    def load_processed_levels(self) -> array:
+        # Rows come out in primary key order, so the IDs go straight into a sorted array without an intermediate set.
+        # IDs that don't fit into 32 bits can only come from old settings files and are no levels anyway
+        processed_levels = array('I')
+        with self._lock:
+            for row in self.connection.execute("SELECT level_id FROM processed_levels WHERE level_id BETWEEN 0 AND 4294967295 ORDER BY level_id"):
+                processed_levels.append(row[0])
+        return processed_levels
+
+    def add_processed_levels(self, level_ids: tp.Iterable[int]) -> None:
+        self._write("INSERT OR IGNORE INTO processed_levels (level_id) VALUES (?)", [(level_id,) for level_id in level_ids])
+
+    def clear_processed_levels(self) -> None:
+        self._write("DELETE FROM processed_levels", [()])
+
+    def close(self) -> None:
+        with self._lock:
+            self.connection.close()
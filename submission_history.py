@@ -0,0 +1,197 @@
+import sqlite3
+import threading
+from dataclasses import astuple, dataclass, fields, replace
+from datetime import datetime
+from enum import StrEnum
+from pathlib import Path
+from time import time
+
+import typing as tp
+
+from gd import LevelGrade
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS levels (
+    level_id INTEGER PRIMARY KEY,
+    submissions INTEGER NOT NULL,
+    sources TEXT NOT NULL,
+    first_submitted_at REAL,
+    last_submitted_at REAL,
+    last_verdict TEXT,
+    last_verdict_at REAL,
+    last_gd_check_at REAL,
+    last_gd_grade TEXT,
+    pending_in TEXT,
+    pending_since REAL,
+    bot_request_id INTEGER
+);
+"""
+
+DAY_SECONDS = 24 * 60 * 60
+VERDICT_COOLDOWN_SECONDS = 7 * DAY_SECONDS
+PENDING_TTL_SECONDS = 14 * DAY_SECONDS  # Requests may get resolved elsewhere, so we stop trusting old pending marks
+RATED_CHECK_TTL_SECONDS = 30 * DAY_SECONDS
+
+
+class SubmissionSource(StrEnum):
+    FORM = "form"
+    CHAT = "chat"
+    BOT = "bot"
+
+
+class PendingQueue(StrEnum):
+    SHEET = "sheet"
+    BOT = "bot"
+
+
+@dataclass
+class LevelHistory:
+    level_id: int
+    submissions: int = 0
+    sources: str = ""
+    first_submitted_at: float | None = None
+    last_submitted_at: float | None = None
+    last_verdict: str | None = None
+    last_verdict_at: float | None = None
+    last_gd_check_at: float | None = None
+    last_gd_grade: str | None = None
+    pending_in: str | None = None
+    pending_since: float | None = None
+    bot_request_id: int | None = None
+
+    def is_pending(self, now: float) -> bool:
+        return bool(self.pending_in) and now - (self.pending_since or 0) < PENDING_TTL_SECONDS
+
+
+def _format_date(timestamp: float) -> str:
+    return datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d')
+
+
+class SubmissionHistory:
+    # Everything we know about every level ever submitted, kept in memory for O(1) lookups and written through to
+    # SQLite. It outlives streams, unlike the processed levels of the caretaker, and covers all request sources
+    def __init__(self, path: Path):
+        self.connection = sqlite3.connect(str(path), isolation_level=None, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.executescript(SCHEMA)
+        self._lock = threading.Lock()
+        self._levels: dict[int, LevelHistory] = {
+            row[0]: LevelHistory(*row)
+            for row in self.connection.execute(f"SELECT {', '.join(f.name for f in fields(LevelHistory))} FROM levels")
+        }
+
+    def _update(self, level_ids: tp.Iterable[int], apply: tp.Callable[[LevelHistory], None]) -> None:
+        columns = [f.name for f in fields(LevelHistory)]
+        statement = (
+            f"INSERT INTO levels ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))}) "
+            f"ON CONFLICT(level_id) DO UPDATE SET {', '.join(f'{column} = excluded.{column}' for column in columns[1:])}"
+        )
+
+        with self._lock:
+            updated = []
+            for level_id in dict.fromkeys(level_ids):
+                entry = self._levels.get(level_id) or LevelHistory(level_id)
+                apply(entry)
+                self._levels[level_id] = entry
+                updated.append(astuple(entry))
+            if not updated:
+                return
+
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                self.connection.executemany(statement, updated)
+            except BaseException:
+                self.connection.execute("ROLLBACK")
+                raise
+            self.connection.execute("COMMIT")
+
+    def __len__(self) -> int:
+        return len(self._levels)
+
+    def get(self, level_id: int) -> LevelHistory | None:
+        with self._lock:
+            entry = self._levels.get(level_id)
+            return replace(entry) if entry else None
+
+    def get_skip_reason(self, level_id: int) -> str | None:
+        entry = self.get(level_id)
+        if not entry:
+            return None
+
+        now = time()
+        if entry.is_pending(now):
+            return f"already waiting in the {entry.pending_in} queue"
+        if entry.last_verdict_at and now - entry.last_verdict_at < VERDICT_COOLDOWN_SECONDS:
+            return f"reviewed on {_format_date(entry.last_verdict_at)} ({entry.last_verdict})"
+        if entry.last_gd_grade and entry.last_gd_grade != LevelGrade.UNRATED.name and now - entry.last_gd_check_at < RATED_CHECK_TTL_SECONDS:
+            return f"already {entry.last_gd_grade.lower()}"
+        return None
+
+    def describe(self, level_id: int) -> str | None:
+        entry = self.get(level_id)
+        if not entry or (entry.submissions <= 1 and not entry.last_verdict):
+            return None
+
+        parts = [f"submitted {entry.submissions} times via {entry.sources}"]
+        if entry.last_verdict:
+            parts.append(f"last verdict: {entry.last_verdict} on {_format_date(entry.last_verdict_at)}")
+        return ", ".join(parts)
+
+    def record_submissions(self, level_ids: tp.Iterable[int], source: SubmissionSource) -> None:
+        now = time()
+
+        def apply(entry: LevelHistory) -> None:
+            entry.submissions += 1
+            entry.sources = ",".join(sorted({*filter(None, entry.sources.split(",")), source.value}))
+            entry.first_submitted_at = entry.first_submitted_at or now
+            entry.last_submitted_at = now
+
+        self._update(level_ids, apply)
+
+    def record_gd_checks(self, grades: dict[int, LevelGrade | None]) -> None:
+        now = time()
+
+        def apply(entry: LevelHistory) -> None:
+            grade = grades[entry.level_id]
+            entry.last_gd_check_at = now
+            entry.last_gd_grade = grade.name if grade else None
+
+        self._update(grades.keys(), apply)
+
+    def mark_pending(self, level_ids: tp.Iterable[int], queue: PendingQueue, bot_request_id: int | None = None) -> None:
+        now = time()
+
+        def apply(entry: LevelHistory) -> None:
+            entry.pending_in = queue.value
+            entry.pending_since = now
+            entry.bot_request_id = bot_request_id or entry.bot_request_id
+
+        self._update(level_ids, apply)
+
+    def clear_pending(self, level_ids: tp.Iterable[int]) -> None:
+        def apply(entry: LevelHistory) -> None:
+            entry.pending_in = None
+            entry.pending_since = None
+
+        self._update(level_ids, apply)
+
+    def record_verdict(self, level_id: int, verdict: str) -> None:
+        now = time()
+
+        def apply(entry: LevelHistory) -> None:
+            entry.last_verdict = verdict
+            entry.last_verdict_at = now
+            if verdict == "later":  # Pre-approved requests stay in the bot queue
+                entry.pending_in = PendingQueue.BOT.value
+                entry.pending_since = now
+            else:
+                entry.pending_in = None
+                entry.pending_since = None
+
+        self._update([level_id], apply)
+
+    def close(self) -> None:
+        with self._lock:
+            self.connection.close()
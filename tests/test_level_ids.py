@@ -0,0 +1,40 @@
+import pytest
+
+from level_ids import parse_level_id
+
+
+@pytest.mark.parametrize("raw, expected", [
+    ("12345678", 12345678),
+    ("  12345678\n", 12345678),
+    ("ID: 12345678", 12345678),
+    ("12 345 678", 12345678),
+    ("12.345.678", 12345678),
+    ("12,345,678", 12345678),
+    ("12'345'678", 12345678),
+    ("12 345 678", 12345678),
+    ("１２３４５６７８", 12345678),
+    ("128", 128),
+    ("https://gdbrowser.com/12345678", 12345678),
+    ("12345678 https://youtu.be/dQw4w9WgXcQ", 12345678),
+    ("12345678 (12345678)", 12345678),
+])
+def test_parses_level_id(raw, expected):
+    assert parse_level_id(raw) == expected
+
+
+@pytest.mark.parametrize("raw, reason", [
+    ("", "empty"),
+    ("   ", "empty"),
+    ("https://youtu.be/dQw4w9WgXcQ", "a link instead of a level ID"),
+    ("my level", "no level ID found"),
+    ("128 500 11", "several numbers: 128, 500"),
+    ("1234 5678", "several numbers: 1234, 5678"),
+    ("12 345.678", "several numbers: 345, 678"),
+    ("12345678 87654321", "several numbers: 12345678, 87654321"),
+    ("12-345-678", "several numbers: 345, 678"),
+    ("127", "too small for an online level"),
+    ("1 000 000 000", "too big for a level ID"),
+])
+def test_rejects_raw_level_id(raw, reason):
+    with pytest.raises(ValueError, match=f"^{reason}$"):
+        parse_level_id(raw)
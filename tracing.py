@@ -0,0 +1,138 @@
+import functools
+import json
+import os
+import statistics
+import threading
+from collections import deque
+from contextlib import contextmanager, nullcontext
+from dataclasses import dataclass
+from pathlib import Path
+from time import perf_counter_ns
+
+import typing as tp
+
+
+MAX_RECORDED_SPANS = 100_000
+LATENCY_WINDOW = 500
+
+_DISABLED_SPAN = nullcontext()
+
+
+@dataclass
+class OperationLatency:
+    name: str
+    calls: int
+    last: float
+    p50: float
+    p95: float
+
+
+SpanListener = tp.Callable[[str, dict[str, tp.Any], float, bool], None]  # name, tags, duration in seconds, failed
+
+
+class Tracer:
+    # Records nested spans of the hot-path calls. A thread can also listen to the spans it finishes, even while
+    # recording is disabled, that's how the analytics store gets the backend latencies of an engine operation without
+    # timing the calls a second time. When disabled and the thread isn't listening, span() returns a shared no-op
+    # context manager and traced() functions are called directly, so instrumentation costs a couple of attribute checks
+    def __init__(self, enabled: bool = False):
+        self.enabled = enabled
+        self.pid = os.getpid()
+        self._spans: deque[dict] = deque(maxlen=MAX_RECORDED_SPANS)
+        self._durations: dict[str, deque[float]] = {}
+        self._calls: dict[str, int] = {}
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def is_active(self) -> bool:
+        return self.enabled or getattr(self._local, "listener", None) is not None
+
+    @contextmanager
+    def listening(self, listener: SpanListener) -> tp.Iterator[None]:
+        # Only the spans finished by the current thread inside the block are passed to the listener
+        previous = getattr(self._local, "listener", None)
+        self._local.listener = listener
+        try:
+            yield
+        finally:
+            self._local.listener = previous
+
+    def span(self, name: str, **tags: tp.Any) -> tp.ContextManager:
+        if not self.is_active():
+            return _DISABLED_SPAN
+        return self._record_span(name, tags)
+
+    @contextmanager
+    def _record_span(self, name: str, tags: dict[str, tp.Any]) -> tp.Iterator[None]:
+        started_at = perf_counter_ns()
+        failed = False
+        try:
+            yield
+        except BaseException:
+            failed = True
+            raise
+        finally:
+            duration = perf_counter_ns() - started_at
+            if self.enabled:
+                self._store_span(name, tags, started_at, duration, failed)
+            listener = getattr(self._local, "listener", None)
+            if listener:
+                try:
+                    listener(name, tags, duration / 1e9, failed)
+                except Exception as e:
+                    print(f"Failed to pass the {name} span to a listener: {e}")
+
+    def _store_span(self, name: str, tags: dict[str, tp.Any], started_at: int, duration: int, failed: bool) -> None:
+        args = {key: str(value) for key, value in tags.items()}
+        if failed:
+            args["failed"] = "true"
+        event = dict(
+            name=name,
+            cat=str(tags.get("backend", "app")),
+            ph="X",
+            ts=started_at / 1000,
+            dur=duration / 1000,
+            pid=self.pid,
+            tid=threading.get_ident(),
+            args=args
+        )
+        with self._lock:
+            self._spans.append(event)
+            self._durations.setdefault(name, deque(maxlen=LATENCY_WINDOW)).append(duration / 1e9)
+            self._calls[name] = self._calls.get(name, 0) + 1
+
+    def get_latency_table(self) -> list[OperationLatency]:
+        with self._lock:
+            snapshot = {name: (list(durations), self._calls[name]) for name, durations in self._durations.items()}
+
+        table = []
+        for name, (durations, calls) in snapshot.items():
+            ordered = sorted(durations)
+            table.append(OperationLatency(
+                name=name,
+                calls=calls,
+                last=durations[-1],
+                p50=statistics.median(ordered),
+                p95=ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+            ))
+        return sorted(table, key=lambda row: row.name)
+
+    def export_chrome_trace(self, path: Path) -> None:
+        with self._lock:
+            events = list(self._spans)
+        path.write_text(json.dumps(dict(traceEvents=events, displayTimeUnit="ms")), encoding='utf-8')
+
+
+TRACER = Tracer(enabled=os.environ.get("RBCP_TRACE") == "1")
+
+
+def traced(name: str, **tags: tp.Any) -> tp.Callable:
+    def decorator(func: tp.Callable) -> tp.Callable:
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not TRACER.is_active():
+                return func(*args, **kwargs)
+            with TRACER.span(name, **tags):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,184 @@
+from __future__ import annotations
+
+import builtins
+import gzip
+import hashlib
+import json
+import os
+import threading
+from collections import deque
+from enum import StrEnum
+from pathlib import Path
+from time import perf_counter, sleep
+
+import httplib2
+import requests
+from googleapiclient.errors import HttpError
+
+import typing as tp
+
+from common_types import Backend
+
+
+T = tp.TypeVar("T")
+
+
+class TrafficMode(StrEnum):
+    OFF = "off"
+    RECORD = "record"
+    REPLAY = "replay"
+
+
+class ReplayMissError(Exception):
+    pass
+
+
+class ReplayedError(Exception):
+    pass
+
+
+def _digest(request: tp.Any) -> str:
+    canonical = json.dumps(request, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.blake2b(canonical.encode('utf-8'), digest_size=8).hexdigest()
+
+
+def _describe_error(e: Exception) -> dict:
+    if isinstance(e, HttpError):
+        content = e.content.decode('utf-8', errors='replace') if isinstance(e.content, bytes) else str(e.content)
+        return dict(type="HttpError", status=e.resp.status, content=content)
+    if isinstance(e, requests.HTTPError) and e.response is not None:
+        return dict(type="HTTPError", status=e.response.status_code, message=str(e))
+    return dict(type=type(e).__name__, message=str(e))
+
+
+def _rebuild_error(error: dict) -> Exception:
+    match error["type"]:
+        case "HttpError":
+            return HttpError(httplib2.Response(dict(status=error["status"])), error["content"].encode('utf-8'))
+        case "HTTPError":
+            response = requests.Response()
+            response.status_code = error["status"]
+            return requests.HTTPError(error["message"], response=response)
+    error_class = getattr(requests.exceptions, error["type"], None) or getattr(builtins, error["type"], None)
+    if isinstance(error_class, type) and issubclass(error_class, Exception):
+        return error_class(error["message"])
+    return ReplayedError(f"{error['type']}: {error['message']}")
+
+
+class TrafficTap:
+    # Every wrapper sends its network calls through exchange(). In record mode the outcome and latency of each call
+    # are appended to a gzipped JSON lines file, in replay mode the calls are answered from such a file instead of
+    # the network. Calls are matched per backend operation in the recorded order, preferring the next one with the
+    # same request, so small differences between sessions (timecodes, page tokens) don't derail the replay. Calls
+    # answered with the response to a different request are counted as mismatches, a replay is only deterministic
+    # without them
+    def __init__(self):
+        self.mode = TrafficMode.OFF
+        self.latency_scale = 1.0
+        self.misses = 0
+        self.mismatches = 0
+        self._file: tp.TextIO | None = None
+        self._started_at = 0.0
+        self._recorded: dict[tuple[str, str], deque[dict]] = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_environment(cls) -> TrafficTap:
+        tap = TrafficTap()
+        if os.environ.get("RBCP_REPLAY"):
+            tap.replay_from(Path(os.environ["RBCP_REPLAY"]), float(os.environ.get("RBCP_REPLAY_LATENCY_SCALE", "1")))
+        elif os.environ.get("RBCP_RECORD"):
+            tap.record_to(Path(os.environ["RBCP_RECORD"]))
+        return tap
+
+    def record_to(self, path: Path) -> None:
+        self.close()
+        self._file = gzip.open(path, 'wt', encoding='utf-8')
+        self._started_at = perf_counter()
+        self.mode = TrafficMode.RECORD
+
+    def replay_from(self, path: Path, latency_scale: float = 1.0) -> None:
+        self.close()
+        entries = []
+        with gzip.open(path, 'rt', encoding='utf-8') as file:
+            try:
+                for line in file:
+                    entries.append(json.loads(line))
+            except (EOFError, json.JSONDecodeError):  # The recording has been cut short, use what has been written
+                pass
+
+        self._recorded = {}
+        for entry in sorted(entries, key=lambda entry: entry["t"]):
+            self._recorded.setdefault((entry["b"], entry["op"]), deque()).append(entry)
+        self.latency_scale = latency_scale
+        self.misses = 0
+        self.mismatches = 0
+        self.mode = TrafficMode.REPLAY
+
+    def get_unused_count(self) -> int:
+        with self._lock:
+            return sum(len(entries) for entries in self._recorded.values())
+
+    def exchange(self, backend: Backend, operation: str, request: tp.Any, perform: tp.Callable[[], T]) -> T:
+        if self.mode == TrafficMode.OFF:
+            return perform()
+        if self.mode == TrafficMode.REPLAY:
+            return self._replay(backend, operation, request)
+        return self._record(backend, operation, request, perform)
+
+    def _record(self, backend: Backend, operation: str, request: tp.Any, perform: tp.Callable[[], T]) -> T:
+        started_at = perf_counter()
+        entry = dict(b=backend.value, op=operation, req=_digest(request), t=round(started_at - self._started_at, 6))
+        try:
+            response = perform()
+        except Exception as e:
+            entry.update(lat=round(perf_counter() - started_at, 6), err=_describe_error(e))
+            self._write(entry)
+            raise
+        entry.update(lat=round(perf_counter() - started_at, 6), res=response)
+        self._write(entry)
+        return response
+
+    def _write(self, entry: dict) -> None:
+        line = json.dumps(entry, ensure_ascii=False, separators=(',', ':'), default=str)
+        with self._lock:
+            if self._file:
+                self._file.write(line + "\n")
+
+    def _replay(self, backend: Backend, operation: str, request: tp.Any) -> tp.Any:
+        digest = _digest(request)
+        with self._lock:
+            entries = self._recorded.get((backend.value, operation))
+            entry = None
+            if entries:
+                entry = next((candidate for candidate in entries if candidate["req"] == digest), None)
+                if not entry:
+                    entry = entries[0]
+                    self.mismatches += 1
+                entries.remove(entry)
+            else:
+                self.misses += 1
+
+        if not entry:
+            raise ReplayMissError(f"No recorded {backend.value} {operation} call left to replay")
+
+        if self.latency_scale > 0:
+            sleep(entry["lat"] * self.latency_scale)
+        if "err" in entry:
+            raise _rebuild_error(entry["err"])
+        return entry["res"]
+
+    def close(self) -> None:
+        with self._lock:
+            if self._file:
+                self._file.close()
+                self._file = None
+        if self.mode == TrafficMode.REPLAY:
+            print(
+                f"Replay finished: {self.misses} calls had no recording, {self.mismatches} were answered with the "
+                f"response to a different request, {self.get_unused_count()} recorded calls were not used"
+            )
+        self.mode = TrafficMode.OFF
+
+
+TRAFFIC = TrafficTap.from_environment()
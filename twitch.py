@@ -1,9 +1,20 @@
+import threading
+from time import monotonic
+
 import requests
 
+from common_types import Backend
+from tracing import traced
+from traffic import TRAFFIC
+
 
-GET_STREAM_QUERY_TEMPLATE = """
-query {
-  user(login: "%USERNAME%") {
+GQL_URL = "https://gql.twitch.tv/gql"
+CLIENT_ID = "kimne78kx3ncx6brgo4mv6wki5h1ko"
+
+GET_STREAMS_QUERY = """
+query($logins: [String!]) {
+  users(logins: $logins) {
+    login
     stream {
       id
     }
@@ -12,19 +23,68 @@ query {
 """
 
 
+class TwitchClient:
+    def __init__(self, positive_ttl: float = 30.0, negative_ttl: float = 10.0, timeout: tuple[float, float] = (3.05, 5.0)):
+        self.positive_ttl = positive_ttl
+        self.negative_ttl = negative_ttl
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.headers.update({"client-id": CLIENT_ID})
+        self._cache: dict[str, tuple[str | None, float]] = {}
+        self._lock = threading.Lock()
+
+    def _get_cached(self, login: str) -> tuple[bool, str | None]:
+        with self._lock:
+            cached = self._cache.get(login)
+        if not cached:
+            return False, None
+        stream_id, fetched_at = cached
+        ttl = self.positive_ttl if stream_id else self.negative_ttl
+        return monotonic() - fetched_at < ttl, stream_id
+
+    @traced("twitch.get_streams", backend="twitch")
+    def _fetch(self, logins: list[str]) -> dict[str, str | None]:
+        payload = dict(
+            query=GET_STREAMS_QUERY,
+            variables=dict(logins=logins)
+        )
+        response = TRAFFIC.exchange(Backend.TWITCH, "get_streams", payload, lambda: self.session.post(url=GQL_URL, json=payload, timeout=self.timeout).json()) or {}
+
+        data = response.get("data") or {}
+        stream_ids = dict.fromkeys(logins)
+        for user in data.get("users") or []:
+            if not user:  # Unknown logins come back as nulls
+                continue
+            stream = user.get("stream") or {}
+            stream_ids[user.get("login", "").lower()] = stream.get("id")
+        return stream_ids
+
+    def get_stream_ids(self, logins: list[str]) -> dict[str, str | None]:
+        result = {}
+        missing = []
+        for login in dict.fromkeys(login.lower() for login in logins):
+            is_fresh, stream_id = self._get_cached(login)
+            if is_fresh:
+                result[login] = stream_id
+            else:
+                missing.append(login)
+
+        if missing:
+            fetched = self._fetch(missing)
+            fetched_at = monotonic()
+            with self._lock:
+                for login in missing:
+                    self._cache[login] = (fetched.get(login), fetched_at)
+            result.update((login, fetched.get(login)) for login in missing)
+
+        return result
+
+    def get_stream_id(self, login: str) -> str | None:
+        return self.get_stream_ids([login])[login.lower()]
+
+
+CLIENT = TwitchClient()
+
+
 def get_stream_id(username: str) -> str | None:
-    response = requests.post(
-        url="https://gql.twitch.tv/gql",
-        json=dict(
-            query=GET_STREAM_QUERY_TEMPLATE.replace("%USERNAME%", username),
-            variables={}
-        ),
-        headers={
-            "client-id": "kimne78kx3ncx6brgo4mv6wki5h1ko"
-        }
-    ).json() or {}
-
-    data = response.get("data") or {}
-    user = data.get("user") or {}
-    stream = user.get("stream") or {}
-    return stream.get("id")
\ No newline at end of file
+    return CLIENT.get_stream_id(username)
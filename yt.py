@@ -1,13 +1,113 @@
 import math
+import queue
+import re
+import threading
+import xml.etree.ElementTree as ElementTree
 from dataclasses import dataclass
-from datetime import datetime
+from datetime import date, datetime, timedelta, timezone
+from enum import StrEnum
+from concurrent.futures import ThreadPoolExecutor
+from time import monotonic, sleep
+from urllib.parse import parse_qs, urlparse
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
 
+import google_auth_httplib2
 import googleapiclient.discovery
 import googleapiclient.errors
+import googleapiclient.http
+import httplib2
+import requests
 
 from google.oauth2.credentials import Credentials
 from googleapiclient.errors import HttpError
 
+import typing as tp
+
+from common_types import Backend
+from tracing import TRACER
+from traffic import TRAFFIC
+
+
+class YoutubeApiMethod(StrEnum):
+    SEARCH_LIST = "search.list"
+    VIDEOS_LIST = "videos.list"
+    LIVE_CHAT_MESSAGES_LIST = "liveChatMessages.list"
+    LIVE_CHAT_MESSAGES_INSERT = "liveChatMessages.insert"
+
+
+QUOTA_COSTS: dict[YoutubeApiMethod, int] = {
+    YoutubeApiMethod.SEARCH_LIST: 100,
+    YoutubeApiMethod.VIDEOS_LIST: 1,
+    YoutubeApiMethod.LIVE_CHAT_MESSAGES_LIST: 5,
+    YoutubeApiMethod.LIVE_CHAT_MESSAGES_INSERT: 50,
+}
+
+# Responses younger than this are served from cache, older ones are revalidated with their ETag
+CACHE_TTLS: dict[YoutubeApiMethod, float] = {
+    YoutubeApiMethod.SEARCH_LIST: 60.0,
+    YoutubeApiMethod.VIDEOS_LIST: 600.0,
+}
+
+DAILY_QUOTA_UNITS = 10_000
+QUOTA_WARNING_RATIO = 0.8
+LIVE_CHAT_MESSAGE_MAX_LENGTH = 200
+VIDEOS_LIST_MAX_IDS = 50
+
+CHANNEL_FEED_URL = "https://www.youtube.com/feeds/videos.xml"
+FEED_VIDEO_ID_TAG = "{http://www.youtube.com/xml/schemas/2015}videoId"
+
+try:
+    QUOTA_RESET_TIMEZONE = ZoneInfo("America/Los_Angeles")  # The quota is reset at midnight Pacific Time
+except ZoneInfoNotFoundError:
+    QUOTA_RESET_TIMEZONE = timezone(timedelta(hours=-8))
+
+
+VIDEO_ID_PATTERN = re.compile(r"^[\w-]{11}$")
+ISO_DURATION_PATTERN = re.compile(r"^P(?:(\d+)D)?T?(?:(\d+)H)?(?:(\d+)M)?(?:(\d+)S)?$")
+
+
+def extract_video_id(link: str) -> str | None:
+    link = link.strip()
+    parsed = urlparse(link if "://" in link else f"https://{link}")
+    host = parsed.netloc.lower().removeprefix("www.").removeprefix("m.")
+    if host == "youtu.be":
+        candidate = parsed.path.strip("/").split("/")[0]
+    elif host.endswith("youtube.com"):
+        path_parts = parsed.path.strip("/").split("/")
+        if path_parts[0] == "watch":
+            candidate = parse_qs(parsed.query).get("v", [""])[0]
+        elif path_parts[0] in ("shorts", "live", "embed") and len(path_parts) > 1:
+            candidate = path_parts[1]
+        else:
+            return None
+    else:
+        return None
+    return candidate if VIDEO_ID_PATTERN.match(candidate) else None
+
+
+def parse_iso_duration(raw: str) -> int | None:
+    match = ISO_DURATION_PATTERN.match(raw)
+    if not match:
+        return None
+    days, hours, minutes, seconds = (int(part or 0) for part in match.groups())
+    return ((days * 24 + hours) * 60 + minutes) * 60 + seconds
+
+
+@dataclass
+class VideoMetadata:
+    video_id: str
+    available: bool
+    title: str | None = None
+    duration_seconds: int | None = None
+
+    def describe(self) -> str:
+        if not self.available:
+            return "unavailable"
+        if self.duration_seconds is None:
+            return self.title or "untitled"
+        minutes, seconds = divmod(self.duration_seconds, 60)
+        return f"{self.title}, {minutes}:{seconds:02}"
+
 
 @dataclass
 class YoutubeLiveStreamingDetails:
@@ -18,13 +118,108 @@ class YoutubeLiveStreamingDetails:
         return max(math.floor(datetime.now().timestamp() - self.start_timestamp), 0) if self.start_timestamp else None
 
 
+class QuotaExceededError(Exception):
+    pass
+
+
+class YoutubeQuotaMeter:
+    def __init__(self, daily_limit: int = DAILY_QUOTA_UNITS, warning_ratio: float = QUOTA_WARNING_RATIO, on_warning: tp.Callable[[int, int], None] | None = None):
+        self.daily_limit = daily_limit
+        self.warning_threshold = int(daily_limit * warning_ratio)
+        self.on_warning = on_warning
+        self.units_used = 0
+        self.units_by_method: dict[str, int] = {}
+        self._day = self._get_quota_day()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _get_quota_day() -> date:
+        return datetime.now(QUOTA_RESET_TIMEZONE).date()
+
+    def _reset_if_new_day(self) -> None:
+        today = self._get_quota_day()
+        if today != self._day:
+            self._day = today
+            self.units_used = 0
+            self.units_by_method = {}
+
+    def get_remaining(self) -> int:
+        with self._lock:
+            self._reset_if_new_day()
+            return self.daily_limit - self.units_used
+
+    def can_afford(self, units: int) -> bool:
+        return self.get_remaining() >= units
+
+    def charge(self, method: str, units: int) -> None:
+        with self._lock:
+            self._reset_if_new_day()
+            crossed_warning_threshold = self.units_used < self.warning_threshold <= self.units_used + units
+            self.units_used += units
+            self.units_by_method[str(method)] = self.units_by_method.get(str(method), 0) + units
+            units_used = self.units_used
+
+        if crossed_warning_threshold and self.on_warning:
+            self.on_warning(units_used, self.daily_limit)
+
+
+@dataclass
+class _CachedResponse:
+    response: dict
+    etag: str | None
+    fetched_at: float
+
+
 class YoutubeApiWrapper:
-    def __init__(self, creds: Credentials):
+    def __init__(self, creds: Credentials, quota: YoutubeQuotaMeter | None = None):
+        self.creds = creds
+        self.quota = quota or YoutubeQuotaMeter()
         self.youtube = googleapiclient.discovery.build(
             serviceName="youtube",
             version="v3",
             credentials=creds
         )
+        self._thread_local = threading.local()
+        self._cache: dict[tuple, _CachedResponse] = {}
+        self._cache_lock = threading.Lock()
+
+    def _get_http(self) -> google_auth_httplib2.AuthorizedHttp:
+        # httplib2 connections are not thread-safe, so each thread gets its own one
+        http = getattr(self._thread_local, "http", None)
+        if not http:
+            http = google_auth_httplib2.AuthorizedHttp(self.creds, http=httplib2.Http())
+            self._thread_local.http = http
+        return http
+
+    def _execute(self, request: googleapiclient.http.HttpRequest, method: YoutubeApiMethod, cache_key: tuple | None = None) -> dict:
+        ttl = CACHE_TTLS.get(method)
+        cache_key = (method, *cache_key) if cache_key is not None and ttl else None
+
+        cached = None
+        if cache_key:
+            with self._cache_lock:
+                cached = self._cache.get(cache_key)
+            if cached and monotonic() - cached.fetched_at < ttl:
+                return cached.response
+            if cached and cached.etag:
+                request.headers["If-None-Match"] = cached.etag
+
+        try:
+            with TRACER.span(f"youtube.{method.value}", backend="youtube", endpoint=method.value, conditional=bool(cached)):
+                response = TRAFFIC.exchange(Backend.YOUTUBE, method.value, (request.uri, request.body), lambda: request.execute(http=self._get_http()))
+        except HttpError as e:
+            if cached and e.resp.status == 304:
+                cached.fetched_at = monotonic()
+                return cached.response
+            raise
+        finally:
+            self.quota.charge(method, QUOTA_COSTS[method])
+
+        if cache_key:
+            with self._cache_lock:
+                self._cache[cache_key] = _CachedResponse(response, response.get("etag"), monotonic())
+
+        return response
 
     def get_live_stream_video_id(self, channel_id: str) -> str | None:
         request = self.youtube.search().list(
@@ -35,7 +230,7 @@ class YoutubeApiWrapper:
         )
 
         try:
-            response = request.execute()
+            response = self._execute(request, YoutubeApiMethod.SEARCH_LIST, (channel_id,))
         except HttpError:
             return None
 
@@ -50,7 +245,7 @@ class YoutubeApiWrapper:
             part="liveStreamingDetails",
             id=video_id
         )
-        response = request.execute()
+        response = self._execute(request, YoutubeApiMethod.VIDEOS_LIST, ("liveStreamingDetails", video_id))
         live_streaming_details = response.get('items', [{}])[0].get('liveStreamingDetails', {})
         raw_start_time = live_streaming_details.get('actualStartTime')
         return YoutubeLiveStreamingDetails(
@@ -58,6 +253,52 @@ class YoutubeApiWrapper:
             live_chat_id=live_streaming_details.get('activeLiveChatId')
         )
 
+    def get_live_video_ids(self, video_ids: list[str]) -> list[str]:
+        # Live status must be fresh, so these responses are never cached
+        live_video_ids = []
+        for batch_start in range(0, len(video_ids), VIDEOS_LIST_MAX_IDS):
+            request = self.youtube.videos().list(
+                part="snippet",
+                id=",".join(video_ids[batch_start:batch_start + VIDEOS_LIST_MAX_IDS])
+            )
+            response = self._execute(request, YoutubeApiMethod.VIDEOS_LIST)
+            live_video_ids.extend(
+                item['id']
+                for item in response.get('items', [])
+                if item.get('snippet', {}).get('liveBroadcastContent') == 'live'
+            )
+        return live_video_ids
+
+    def get_videos_metadata(self, video_ids: list[str]) -> dict[str, VideoMetadata]:
+        result = {}
+        for batch_start in range(0, len(video_ids), VIDEOS_LIST_MAX_IDS):
+            batch = video_ids[batch_start:batch_start + VIDEOS_LIST_MAX_IDS]
+            request = self.youtube.videos().list(
+                part="snippet,contentDetails,status",
+                id=",".join(batch)
+            )
+            response = self._execute(request, YoutubeApiMethod.VIDEOS_LIST, ("metadata", *batch))
+            for video_id in batch:
+                result[video_id] = VideoMetadata(video_id, available=False)
+            for item in response.get('items', []):
+                raw_duration = item.get('contentDetails', {}).get('duration')
+                result[item['id']] = VideoMetadata(
+                    video_id=item['id'],
+                    available=item.get('status', {}).get('privacyStatus') != 'private',
+                    title=item.get('snippet', {}).get('title'),
+                    duration_seconds=parse_iso_duration(raw_duration) if raw_duration else None
+                )
+        return result
+
+    def list_live_chat_messages(self, live_chat_id: str, page_token: str | None = None) -> dict:
+        request = self.youtube.liveChatMessages().list(
+            liveChatId=live_chat_id,
+            part="snippet",
+            maxResults=2000,
+            pageToken=page_token
+        )
+        return self._execute(request, YoutubeApiMethod.LIVE_CHAT_MESSAGES_LIST)
+
     def post_message_to_live_chat(self, live_chat_id: str, message_text: str) -> None:
         request = self.youtube.liveChatMessages().insert(
             part="snippet",
@@ -71,4 +312,168 @@ class YoutubeApiWrapper:
                 )
             )
         )
-        request.execute()
+        self._execute(request, YoutubeApiMethod.LIVE_CHAT_MESSAGES_INSERT)
+
+
+def get_recent_channel_video_ids(channel_id: str, session: requests.Session | None = None, timeout: float = 5.0) -> list[str]:
+    # The public channel feed lists the latest uploads including upcoming and ongoing streams and costs no quota,
+    # unlike search.list which costs 100 units per call
+    def fetch_feed() -> str:
+        response = (session or requests).get(CHANNEL_FEED_URL, params=dict(channel_id=channel_id), timeout=timeout)
+        response.raise_for_status()
+        return response.text
+
+    feed = TRAFFIC.exchange(Backend.YOUTUBE, "channel_feed", channel_id, fetch_feed)
+    return [element.text for element in ElementTree.fromstring(feed).iter(FEED_VIDEO_ID_TAG) if element.text]
+
+
+@dataclass
+class _ChatMessage:
+    live_chat_id: str
+    text: str
+
+
+class LiveChatMessageQueue:
+    # Posts chat messages from a background thread, spacing them out, merging the ones queued for the same chat into
+    # a single message, dropping repeats of a recently posted message and refusing to post once the quota runs out
+    def __init__(
+        self,
+        youtube: YoutubeApiWrapper,
+        min_interval_seconds: float = 3.0,
+        dedup_window_seconds: float = 120.0,
+        on_error: tp.Callable[[Exception], None] | None = None
+    ):
+        self.youtube = youtube
+        self.min_interval_seconds = min_interval_seconds
+        self.dedup_window_seconds = dedup_window_seconds
+        self.on_error = on_error
+        self._pending: queue.Queue[_ChatMessage | None] = queue.Queue()
+        self._recent: dict[tuple[str, str], float] = {}
+        self._recent_lock = threading.Lock()
+        self._last_post_at: float | None = None
+        self._carried_over: _ChatMessage | None = None
+        self._worker = threading.Thread(target=self._run, name="live-chat-queue", daemon=True)
+        self._worker.start()
+
+    def post(self, live_chat_id: str, text: str) -> bool:
+        key = (live_chat_id, text)
+        now = monotonic()
+        with self._recent_lock:
+            self._recent = {recent_key: posted_at for recent_key, posted_at in self._recent.items() if now - posted_at < self.dedup_window_seconds}
+            if key in self._recent:
+                return False
+            self._recent[key] = now
+        self._pending.put(_ChatMessage(live_chat_id, text))
+        return True
+
+    def _take_batch(self, first: _ChatMessage) -> tuple[list[_ChatMessage], bool]:
+        batch = [first]
+        while True:
+            try:
+                message = self._pending.get_nowait()
+            except queue.Empty:
+                return batch, False
+            if message is None:
+                return batch, True
+            merged_length = sum(len(queued.text) + 3 for queued in batch) + len(message.text)
+            if message.live_chat_id != first.live_chat_id or merged_length > LIVE_CHAT_MESSAGE_MAX_LENGTH:
+                self._carried_over = message
+                return batch, False
+            batch.append(message)
+
+    def _send(self, live_chat_id: str, text: str) -> None:
+        if self._last_post_at is not None:
+            remaining_seconds = self.min_interval_seconds - (monotonic() - self._last_post_at)
+            if remaining_seconds > 0:
+                sleep(remaining_seconds)
+
+        if not self.youtube.quota.can_afford(QUOTA_COSTS[YoutubeApiMethod.LIVE_CHAT_MESSAGES_INSERT]):
+            raise QuotaExceededError(f"Not enough YouTube quota left to post to the chat ({self.youtube.quota.get_remaining()} units remaining)")
+
+        try:
+            self.youtube.post_message_to_live_chat(live_chat_id, text)
+        finally:
+            self._last_post_at = monotonic()
+
+    def _run(self) -> None:
+        stopped = False
+        while not stopped:
+            first = self._carried_over or self._pending.get()
+            self._carried_over = None
+            if first is None:
+                return
+            batch, stopped = self._take_batch(first)
+            try:
+                self._send(first.live_chat_id, " | ".join(message.text for message in batch))
+            except Exception as e:
+                with self._recent_lock:  # Failed messages may be resent right away
+                    for message in batch:
+                        self._recent.pop((message.live_chat_id, message.text), None)
+                if self.on_error:
+                    self.on_error(e)
+
+    def close(self) -> None:
+        self._pending.put(None)
+
+
+class ShowcaseMetadataCache:
+    # Resolves showcase videos in bulk in the background, so that picking a request doesn't cost a YouTube call
+    def __init__(self, youtube: YoutubeApiWrapper, ttl_seconds: float = 3600.0):
+        self.youtube = youtube
+        self.ttl_seconds = ttl_seconds
+        self._entries: dict[str, tuple[VideoMetadata, float]] = {}
+        self._pending: set[str] = set()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="showcase-metadata")
+        self._closed = False
+
+    def _is_fresh(self, video_id: str) -> bool:
+        entry = self._entries.get(video_id)
+        return bool(entry) and monotonic() - entry[1] < self.ttl_seconds
+
+    def _resolve(self, video_ids: list[str]) -> None:
+        try:
+            metadata = self.youtube.get_videos_metadata(video_ids)
+        except Exception as e:
+            print(f"Failed to resolve showcase videos: {e}")
+            metadata = {}
+        resolved_at = monotonic()
+        with self._lock:
+            for video_id, video_metadata in metadata.items():
+                self._entries[video_id] = (video_metadata, resolved_at)
+            self._pending.difference_update(video_ids)
+
+    def _flush(self) -> None:
+        with self._lock:
+            video_ids = list(self._pending)
+        if video_ids:
+            self._resolve(video_ids)
+
+    def prefetch(self, links: tp.Iterable[str | None]) -> None:
+        video_ids = {video_id for video_id in map(extract_video_id, filter(None, links)) if video_id}
+        with self._lock:
+            # Ingestion may still be running on another thread while the panel shuts down
+            if self._closed:
+                return
+            new_video_ids = {video_id for video_id in video_ids if not self._is_fresh(video_id)} - self._pending
+            self._pending |= new_video_ids
+            if new_video_ids:
+                self._executor.submit(self._flush)
+
+    def get(self, link: str | None) -> VideoMetadata | None:
+        # Never calls YouTube itself, it runs on the UI thread: metadata that is missing or expired is only prefetched,
+        # so it shows up the next time
+        video_id = extract_video_id(link) if link else None
+        if not video_id:
+            return None
+        with self._lock:
+            entry = self._entries.get(video_id) if self._is_fresh(video_id) else None
+        if not entry:
+            self.prefetch([link])
+            return None
+        return entry[0]
+
+    def close(self) -> None:
+        with self._lock:
+            self._closed = True
+        self._executor.shutdown(wait=False, cancel_futures=True)